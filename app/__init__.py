@@ -13,6 +13,8 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
+
 from common import ProjectException
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
@@ -28,9 +30,17 @@ from opentelemetry.sdk.resources import SERVICE_NAME, Resource
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
 
+from app.commons.psql_services.event_queue import get_event_queue
 from app.config import ConfigSettings, get_settings
 from app.resources.error_handler import APIException
+from app.resources.keycloak_api.attribute_buffer import get_attribute_buffer
+from app.resources.keycloak_api.http_client import close_keycloak_http_client
 from app.routers.api_registry import api_registry
+from app.routers.permissions.enforcer import get_policy_enforcer
+from app.services.data_providers.ldap_async import close_ldap_executor
+from app.services.data_providers.ldap_pool import close_ldap_pool
+from app.services.reconciliation.ad_group import ADGroupReconciliation
+from app.services.user_sync.user_sync import UserMirrorSync
 
 
 def create_app():
@@ -66,6 +76,31 @@ def create_app():
             content=exc.content,
         )
 
+    @app.on_event('startup')
+    async def start_background_tasks():
+        await asyncio.get_running_loop().run_in_executor(None, get_policy_enforcer().load)
+        if ConfigSettings.CASBIN_POLICY_LISTEN_ENABLED:
+            get_policy_enforcer().start_listener()
+        get_attribute_buffer().start()
+        get_event_queue().start()
+        if ConfigSettings.USER_SYNC_ENABLED:
+            app.state.user_sync_task = asyncio.create_task(UserMirrorSync().run())
+        if ConfigSettings.ENABLE_ACTIVE_DIRECTORY and ConfigSettings.AD_RECONCILE_ENABLED:
+            app.state.ad_reconcile_task = asyncio.create_task(ADGroupReconciliation().run())
+
+    @app.on_event('shutdown')
+    async def shutdown_app():
+        for task_name in ['user_sync_task', 'ad_reconcile_task']:
+            task = getattr(app.state, task_name, None)
+            if task:
+                task.cancel()
+        await get_attribute_buffer().stop()
+        await get_event_queue().stop()
+        await close_keycloak_http_client()
+        close_ldap_executor()
+        close_ldap_pool()
+        await asyncio.get_running_loop().run_in_executor(None, get_policy_enforcer().stop_listener)
+
     api_registry(app)
 
     instrument_app(app)
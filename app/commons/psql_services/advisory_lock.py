@@ -0,0 +1,73 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from common import LoggerFactory
+from fastapi_sqlalchemy import db
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+
+_logger = LoggerFactory('advisory_lock').get_logger()
+
+
+class AdvisoryLock:
+    '''
+    Summary:
+        Session level postgres advisory lock so only one worker runs a
+        background job at a time. The lock is held on a dedicated
+        connection in autocommit mode, so no transaction stays open
+        while the job awaits keycloak or ldap. The connection is closed
+        with the lock, postgres releases it if the worker dies
+
+        async with AdvisoryLock(key) as locked:
+            if locked:
+                ...
+    '''
+
+    def __init__(self, key: int):
+        self.key = key
+        self._conn = None
+
+    def _acquire(self) -> bool:
+        with db():
+            engine = db.session.get_bind()
+        conn = engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+        try:
+            locked = conn.execute(text('SELECT pg_try_advisory_lock(:key)'), {'key': self.key}).scalar()
+        except Exception:
+            conn.close()
+            raise
+        if not locked:
+            conn.close()
+            return False
+        self._conn = conn
+        return True
+
+    def _release(self) -> None:
+        conn, self._conn = self._conn, None
+        try:
+            conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': self.key})
+        except Exception as e:
+            # never give the connection holding the lock back to the pool
+            _logger.error(f'Fail to release the advisory lock {self.key}: {e}')
+            conn.invalidate()
+        finally:
+            conn.close()
+
+    async def __aenter__(self) -> bool:
+        return await run_in_threadpool(self._acquire)
+
+    async def __aexit__(self, *exc) -> None:
+        if self._conn is not None:
+            await run_in_threadpool(self._release)
@@ -0,0 +1,212 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import asyncio
+from datetime import datetime
+from typing import List, Tuple
+from uuid import uuid4
+
+from common import LoggerFactory
+from fastapi_sqlalchemy import db
+from sqlalchemy.exc import DataError, IntegrityError, OperationalError
+from starlette.concurrency import run_in_threadpool
+
+from app.config import ConfigSettings
+from app.models.sql_events import UserEventModel
+from app.resources.cache import TTLCache
+from app.resources.keycloak_api.ops_admin import get_admin_client
+
+_logger = LoggerFactory('event_queue').get_logger()
+
+EVENT_COLUMNS = ['id', 'target_user_id', 'target_user', 'operator_id', 'operator', 'event_type', 'timestamp', 'detail']
+
+
+class UserEventQueue:
+    '''
+    Summary:
+        In-process queue of the user events (role changes, invites,
+        account status changes) so the requests do not wait for the
+        keycloak lookups and the insert. The events are written with
+        multi-row INSERTs every EVENT_FLUSH_INTERVAL seconds or as soon
+        as EVENT_FLUSH_SIZE events are queued. The user ids are resolved
+        from the usernames through a cache. Until the queue is started
+        the events are written right away. A failed batch is retried row
+        by row, the rows the database rejects are dropped and the others
+        are kept for EVENT_FLUSH_RETRIES more flushes. At most
+        EVENT_QUEUE_MAX_SIZE events are queued, the oldest are dropped
+    '''
+
+    def __init__(self, realm_name: str = ConfigSettings.KEYCLOAK_REALM):
+        self.realm_name = realm_name
+        self._pending = []
+        self._user_ids = TTLCache(ConfigSettings.EVENT_USER_ID_CACHE_SIZE, ConfigSettings.EVENT_USER_ID_CACHE_TTL)
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+
+    async def add(self, model_data: dict) -> None:
+        '''
+        Summary:
+            queue the event for the next flush. The event keeps the time
+            it was queued at
+
+        Parameter:
+            - model_data(dict): the fields of the event, the user ids are
+              resolved from operator and target_user when missing
+
+        Return:
+            None
+        '''
+
+        self._pending.append({'timestamp': datetime.utcnow(), **model_data})
+        self._trim()
+        if self._task is None:
+            await self.flush()
+        elif len(self._pending) >= ConfigSettings.EVENT_FLUSH_SIZE:
+            self._wakeup.set()
+
+    def _trim(self) -> None:
+        overflow = len(self._pending) - ConfigSettings.EVENT_QUEUE_MAX_SIZE
+        if overflow > 0:
+            _logger.warning(f'The event queue is full, drop the {overflow} oldest user events')
+            del self._pending[:overflow]
+
+    async def get_user_id(self, username: str) -> str:
+        user_id = self._user_ids.get(username)
+        if user_id is None:
+            user = await get_admin_client(self.realm_name).get_user_by_username(username)
+            user_id = str(user['id'])
+            self._user_ids.set(username, user_id)
+        return user_id
+
+    async def _resolve_user_ids(self, events: List[dict]) -> None:
+        usernames = set()
+        for event in events:
+            if not event.get('operator_id') and event.get('operator'):
+                usernames.add(event['operator'])
+            if not event.get('target_user_id') and event.get('target_user'):
+                usernames.add(event['target_user'])
+
+        user_ids = {}
+        for username in usernames:
+            try:
+                user_ids[username] = await self.get_user_id(username)
+            except Exception as e:
+                _logger.error(f'Fail to get the id of user {username}: {e}')
+
+        for event in events:
+            if not event.get('operator_id'):
+                event['operator_id'] = user_ids.get(event.get('operator'))
+            if not event.get('target_user_id'):
+                event['target_user_id'] = user_ids.get(event.get('target_user'))
+
+    def _insert(self, events: List[dict]) -> None:
+        rows = []
+        for event in events:
+            # the blank fields are stored as null
+            rows.append({column: event.get(column) or None for column in EVENT_COLUMNS})
+            rows[-1]['id'] = rows[-1]['id'] or uuid4()
+
+        batch_size = ConfigSettings.EVENT_FLUSH_SIZE
+        with db():
+            for i in range(0, len(rows), batch_size):
+                db.session.execute(UserEventModel.__table__.insert().values(rows[i : i + batch_size]))
+            db.session.commit()
+
+    def _insert_each(self, events: List[dict]) -> List[Tuple[dict, Exception]]:
+        failed = []
+        for i, event in enumerate(events):
+            try:
+                self._insert([event])
+            except OperationalError as e:
+                # the database is unreachable, the other rows would fail the same
+                failed.extend((x, e) for x in events[i:])
+                break
+            except Exception as e:
+                failed.append((event, e))
+        return failed
+
+    async def flush(self) -> None:
+        '''
+        Summary:
+            write all the queued events. If the batch fails the events
+            are written one by one, the rows rejected by the database are
+            dropped and the others are put back in the queue until they
+            run out of retries
+
+        Return:
+            None
+        '''
+
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        await self._resolve_user_ids(pending)
+        try:
+            await run_in_threadpool(self._insert, pending)
+            return
+        except Exception as e:
+            _logger.error(f'Fail to write {len(pending)} user events, retry them one by one: {e}')
+
+        retry = []
+        for event, error in await run_in_threadpool(self._insert_each, pending):
+            event['retries'] = event.get('retries', 0) + 1
+            if isinstance(error, (DataError, IntegrityError)) or event['retries'] > ConfigSettings.EVENT_FLUSH_RETRIES:
+                _logger.warning(f'Drop the user event {event}: {error}')
+            else:
+                retry.append(event)
+        self._pending = retry + self._pending
+        self._trim()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), ConfigSettings.EVENT_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        '''
+        Summary:
+            stop the background flush and drain the queue
+
+        Return:
+            None
+        '''
+
+        if self._task:
+            # let the running flush finish instead of cancelling it
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._wakeup = None
+        await self.flush()
+
+
+_event_queue = UserEventQueue()
+
+
+def get_event_queue() -> UserEventQueue:
+    return _event_queue
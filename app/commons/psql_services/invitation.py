@@ -38,8 +38,21 @@ def create_invite(model_data: dict) -> InvitationModel:
         invitation_entry = InvitationModel(**model_data)
         db.session.add(invitation_entry)
         db.session.commit()
+        # load the fields and detach the entry, the caller may read it on the event loop
+        db.session.refresh(invitation_entry)
+        db.session.expunge(invitation_entry)
         return invitation_entry
     except Exception as e:
         error_msg = f'Error creating invite in psql: {str(e)}'
         _logger.error(error_msg)
         raise APIException(status_code=EAPIResponseCode.internal_error.value, error_msg=error_msg)
+
+
+def update_invite(query: dict, update_data: dict) -> None:
+    try:
+        db.session.query(InvitationModel).filter_by(**query).update(update_data)
+        db.session.commit()
+    except Exception as e:
+        error_msg = f'Error updating invite in psql: {str(e)}'
+        _logger.error(error_msg)
+        raise APIException(status_code=EAPIResponseCode.internal_error.value, error_msg=error_msg)
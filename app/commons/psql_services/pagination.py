@@ -0,0 +1,141 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+from datetime import datetime
+from typing import Tuple
+
+from sqlalchemy import DateTime, and_, or_
+from sqlalchemy.orm import Query
+
+from app.resources.utils import decode_cursor, encode_cursor
+
+
+def _cursor_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def _read_cursor(cursor: str, column) -> tuple:
+    '''
+    Summary:
+        decode the cursor of the previous page into the <column> value and
+        the id of its last row
+
+    Parameter:
+        - cursor(string): the next_cursor of the previous page
+        - column: the column the pages are ordered by
+
+    Return:
+        - value, last_id: the value is a datetime for the DateTime columns
+
+    Raise:
+        ValueError if the cursor is invalid
+    '''
+
+    try:
+        value, last_id = decode_cursor(cursor)
+    except TypeError:
+        raise ValueError('invalid cursor %s' % cursor)
+    if value is not None and isinstance(column.type, DateTime):
+        value = datetime.fromisoformat(value)
+    return value, last_id
+
+
+def paginate(
+    query: Query, column, id_column, order_type: str, page: int, page_size: int, cursor: str = None
+) -> Tuple[list, str]:
+    '''
+    Summary:
+        return a page of the query ordered by <column> and the id as tie
+        breaker. When the cursor of the previous page is provided the
+        page starts after its last row instead of an offset. With an
+        index on (<column>, id) a deep page costs the same as the first one.
+        The null values come last in asc and first in desc, like the
+        default ordering of postgres
+
+    Parameter:
+        - query(Query): the filtered query
+        - column: the column to order by
+        - id_column: the unique column breaking the ties
+        - order_type(string): asc or desc
+        - page(int): the page to return when no cursor is provided
+        - page_size(int): the size of the page
+        - cursor(string optional): the next_cursor of the previous page
+
+    Return:
+        - rows(list), next_cursor(string): the next_cursor is None on the last page
+
+    Raise:
+        ValueError if the cursor is invalid
+    '''
+
+    if cursor:
+        value, last_id = _read_cursor(cursor, column)
+        if order_type == 'desc':
+            if value is None:
+                after = or_(and_(column.is_(None), id_column < last_id), column.isnot(None))
+            else:
+                after = or_(column < value, and_(column == value, id_column < last_id))
+        else:
+            if value is None:
+                after = and_(column.is_(None), id_column > last_id)
+            else:
+                after = or_(column > value, and_(column == value, id_column > last_id), column.is_(None))
+        query = query.filter(after)
+
+    if order_type == 'desc':
+        query = query.order_by(column.desc(), id_column.desc())
+    else:
+        query = query.order_by(column.asc(), id_column.asc())
+    if not cursor:
+        query = query.offset(page * page_size)
+    rows = query.limit(page_size).all()
+
+    next_cursor = None
+    if len(rows) == page_size:
+        last = rows[-1]
+        next_cursor = encode_cursor(
+            [_cursor_value(getattr(last, column.key)), _cursor_value(getattr(last, id_column.key))]
+        )
+    return rows, next_cursor
+
+
+def estimate_count(query: Query) -> int:
+    '''
+    Summary:
+        the number of rows of the query estimated by the planner, it does
+        not read the rows like COUNT does
+
+    Parameter:
+        - query(Query): the filtered query
+
+    Return:
+        - the estimated row count(int)
+    '''
+
+    statement = query.statement.compile(dialect=query.session.bind.dialect)
+    plan = query.session.connection().execute('EXPLAIN (FORMAT JSON) ' + str(statement), statement.params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def count_rows(query: Query, exact: bool = True) -> int:
+    return query.order_by(None).count() if exact else estimate_count(query)
@@ -17,20 +17,29 @@ from fastapi_sqlalchemy import db
 from common import LoggerFactory
 from typing import Tuple
 
+from app.commons.psql_services.pagination import count_rows, paginate
 from app.models.api_response import EAPIResponseCode
 from app.models.sql_events import UserEventModel
 from app.resources.error_handler import APIException
-from app.resources.keycloak_api.ops_admin import OperationsAdmin
+from app.resources.keycloak_api.ops_admin import get_admin_client
 from app.config import ConfigSettings
 from sqlalchemy import cast, String, or_
+from starlette.concurrency import run_in_threadpool
 
 
 _logger = LoggerFactory('api_user_event').get_logger()
 
 
-def query_events(query: dict, page: int, page_size: int, order_type: str, order_by: str) -> Tuple[list, int]:
+def query_events(
+    query: dict,
+    page: int,
+    page_size: int,
+    order_type: str,
+    order_by: str,
+    cursor: str = None,
+    exact_total: bool = True,
+) -> Tuple[list, int, str]:
     try:
-        filters = {}
         event_query = db.session.query(UserEventModel)
         for key, value in query.items():
             if key == "project_code":
@@ -44,28 +53,26 @@ def query_events(query: dict, page: int, page_size: int, order_type: str, order_
                 event_query = event_query.filter(UserEventModel.detail['invitation_id'].as_string() == value)
             else:
                 event_query = event_query.filter(getattr(UserEventModel, key) == value)
-        if order_type == "desc":
-            order_by = getattr(UserEventModel, order_by).desc()
-        else:
-            order_by = getattr(UserEventModel, order_by).asc()
-        event_query = event_query.order_by(order_by)
-        total = event_query.count()
-        event_query = event_query.limit(page_size).offset(page * page_size)
-        events = event_query.all()
+        total = count_rows(event_query, exact_total)
+        events, next_cursor = paginate(
+            event_query, getattr(UserEventModel, order_by), UserEventModel.id, order_type, page, page_size, cursor
+        )
+    except ValueError as e:
+        raise APIException(status_code=EAPIResponseCode.bad_request.value, error_msg=str(e))
     except Exception as e:
         error_msg = f'Error querying events in psql: {str(e)}'
         _logger.error(error_msg)
         raise APIException(status_code=EAPIResponseCode.internal_error.value, error_msg=error_msg)
-    return events, total
+    return events, total, next_cursor
 
 
-def create_event(model_data: dict) -> UserEventModel:
+async def create_event(model_data: dict) -> UserEventModel:
     if not model_data.get("operator_id") and model_data.get("operator"):
-        admin_client = OperationsAdmin(ConfigSettings.KEYCLOAK_REALM)
-        model_data["operator_id"] = str(admin_client.get_user_by_username(model_data["operator"])["id"])
+        admin_client = get_admin_client(ConfigSettings.KEYCLOAK_REALM)
+        model_data["operator_id"] = str((await admin_client.get_user_by_username(model_data["operator"]))["id"])
     if not model_data.get("target_user_id") and model_data.get("target_user"):
-        admin_client = OperationsAdmin(ConfigSettings.KEYCLOAK_REALM)
-        model_data["target_user_id"] = str(admin_client.get_user_by_username(model_data["target_user"])["id"])
+        admin_client = get_admin_client(ConfigSettings.KEYCLOAK_REALM)
+        model_data["target_user_id"] = str((await admin_client.get_user_by_username(model_data["target_user"]))["id"])
 
     # remove blank items
     model_data = {k: v for k, v in model_data.items() if v}
@@ -73,10 +80,16 @@ def create_event(model_data: dict) -> UserEventModel:
     if not model_data.get("operator_id"):
         model_data["operator_id"] = None
 
+    # the insert blocks, keep it off the event loop
+    return await run_in_threadpool(_insert_event, model_data)
+
+
+def _insert_event(model_data: dict) -> UserEventModel:
     try:
         event = UserEventModel(**model_data)
         db.session.add(event)
         db.session.commit()
+        db.session.refresh(event)
     except Exception as e:
         error_msg = f'Error creating event in psql: {str(e)}'
         _logger.error(error_msg)
@@ -0,0 +1,163 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import datetime
+from typing import List, Tuple
+
+from common import LoggerFactory
+from fastapi_sqlalchemy import db
+from sqlalchemy.dialects.postgresql import insert
+
+from app.commons.psql_services.pagination import paginate
+from app.models.api_response import EAPIResponseCode
+from app.models.sql_users import UserModel, UserSyncStateModel
+from app.resources.error_handler import APIException
+
+_logger = LoggerFactory('api_users').get_logger()
+
+# the columns the user list can be ordered by
+USER_ORDER_FIELDS = {
+    'id': UserModel.id,
+    'username': UserModel.username,
+    'name': UserModel.username,
+    'email': UserModel.email,
+    'first_name': UserModel.first_name,
+    'last_name': UserModel.last_name,
+    'last_login': UserModel.last_login,
+    'time_created': UserModel.time_created,
+}
+
+SYNC_STATE_ID = 'keycloak'
+
+
+def user_from_keycloak(user: dict, synced_at: datetime) -> dict:
+    '''
+    Summary:
+        map the keycloak user representation to the mirror columns
+
+    Parameter:
+        - user(dict): the user infomation from keycloak
+        - synced_at(datetime): the time of the synchronization
+
+    Return:
+        - row(dict)
+    '''
+
+    attributes = user.get('attributes') or {}
+    return {
+        'id': user['id'],
+        'username': user.get('username') or '',
+        'email': user.get('email') or '',
+        'first_name': user.get('firstName') or '',
+        'last_name': user.get('lastName') or '',
+        'status': attributes.get('status', [None])[0],
+        'last_login': attributes.get('last_login', [''])[0] or '',
+        'time_created': datetime.utcfromtimestamp(user.get('createdTimestamp', 0) // 1000),
+        'synced_at': synced_at,
+    }
+
+
+def upsert_users(users: List[dict], synced_at: datetime) -> None:
+    '''
+    Summary:
+        insert or update the keycloak users in the mirror table
+
+    Parameter:
+        - users(list): the user infomation from keycloak
+        - synced_at(datetime): the time of the synchronization
+
+    Return:
+        None
+    '''
+
+    if not users:
+        return
+
+    rows = [user_from_keycloak(user, synced_at) for user in users]
+    stmt = insert(UserModel.__table__).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserModel.id],
+        set_={key: stmt.excluded[key] for key in rows[0] if key != 'id'},
+    )
+    db.session.execute(stmt)
+
+
+def delete_users(user_ids: List[str]) -> None:
+    if user_ids:
+        db.session.query(UserModel).filter(UserModel.id.in_(user_ids)).delete(synchronize_session=False)
+
+
+def delete_users_synced_before(synced_at: datetime) -> int:
+    return db.session.query(UserModel).filter(UserModel.synced_at < synced_at).delete(synchronize_session=False)
+
+
+def get_sync_state() -> UserSyncStateModel:
+    state = db.session.query(UserSyncStateModel).filter_by(id=SYNC_STATE_ID).first()
+    if state is None:
+        state = UserSyncStateModel(id=SYNC_STATE_ID, last_event_time=0)
+        db.session.add(state)
+    return state
+
+
+def query_users(
+    query: dict,
+    order_by: str,
+    order_type: str,
+    page: int,
+    page_size: int,
+    cursor: str = None,
+    user_ids: list = None,
+) -> Tuple[List[UserModel], int, str]:
+    '''
+    Summary:
+        list the users from the mirror table ordered by <order_by> and
+        the id as tie breaker. When the cursor of the previous page is
+        provided the page is located with the index instead of an offset
+
+    Parameter:
+        - query(dict): username/email are matched as substring, status exactly
+        - order_by(string): one of USER_ORDER_FIELDS
+        - order_type(string): asc or desc
+        - page(int): the page to return when no cursor is provided
+        - page_size(int): the return user size
+        - cursor(string optional): the next_cursor of the previous page
+        - user_ids(list optional): only return the users in the list
+
+    Return:
+        - users(list), total(int), next_cursor(string)
+    '''
+
+    try:
+        user_query = db.session.query(UserModel).filter(UserModel.status.isnot(None))
+        if query.get('username'):
+            user_query = user_query.filter(UserModel.username.contains(query['username'], autoescape=True))
+        if query.get('email'):
+            user_query = user_query.filter(UserModel.email.contains(query['email'], autoescape=True))
+        if query.get('status'):
+            user_query = user_query.filter(UserModel.status == query['status'])
+        if user_ids is not None:
+            user_query = user_query.filter(UserModel.id.in_(user_ids))
+        total = user_query.count()
+        users, next_cursor = paginate(
+            user_query, USER_ORDER_FIELDS[order_by], UserModel.id, order_type, page, page_size, cursor
+        )
+    except ValueError as e:
+        raise APIException(status_code=EAPIResponseCode.bad_request.value, error_msg=str(e))
+    except Exception as e:
+        error_msg = f'Error querying users in psql: {str(e)}'
+        _logger.error(error_msg)
+        raise APIException(status_code=EAPIResponseCode.internal_error.value, error_msg=error_msg)
+
+    return users, total, next_cursor
@@ -73,6 +73,28 @@ class Settings(BaseSettings):
     LDAP_USER_GROUP: str
     LDAP_COMMON_NAME_PREFIX: str
     LDAP_USER_OBJECTCLASS: str
+    # the base dn of the user searches, the domain root if it is empty
+    LDAP_USER_SEARCH_BASE: str = ''
+    LDAP_SEARCH_PAGE_SIZE: int = 500
+    # pool of the bound ldap connections in a worker
+    LDAP_POOL_SIZE: int = 10
+    LDAP_POOL_IDLE_TIMEOUT: float = 300.0
+    LDAP_POOL_HEALTH_CHECK_INTERVAL: float = 30.0
+    LDAP_POOL_ACQUIRE_TIMEOUT: float = 10.0
+    LDAP_NETWORK_TIMEOUT: float = 10.0
+    # threads running the blocking ldap calls off the event loop
+    LDAP_THREAD_POOL_SIZE: int = 10
+    # the users looked up in AD by email or username
+    LDAP_USER_CACHE_SIZE: int = 10000
+    LDAP_USER_CACHE_TTL: int = 60
+    LDAP_USER_NEGATIVE_CACHE_TTL: int = 15
+    # emails per OR filter and users per request of the bulk group changes
+    LDAP_BULK_FILTER_SIZE: int = 100
+    LDAP_BULK_MAX_USERS: int = 1000
+    # the reconciliation of the project realm roles into the ad groups
+    AD_RECONCILE_ENABLED: bool = False
+    AD_RECONCILE_INTERVAL: int = 3600
+    AD_RECONCILE_PROJECT_ROLES: str = 'admin,collaborator,contributor'
 
     # BFF RDS
     RDS_HOST: str
@@ -81,6 +103,22 @@ class Settings(BaseSettings):
     RDS_USER: str
     RDS_PWD: str
     RDS_SCHEMA_PREFIX: str
+    # seconds between the checks of the casbin policy version
+    CASBIN_POLICY_CHECK_INTERVAL: float = 1.0
+    CASBIN_BATCH_MAX_CHECKS: int = 1000
+    CASBIN_POLICY_BULK_MAX_RULES: int = 1000
+    # evaluate the checks with the compiled decision table instead of the casbin matcher
+    CASBIN_DECISION_TABLE_ENABLED: bool = False
+    # the decisions cached per worker, they are dropped when the policy version changes
+    CASBIN_DECISION_CACHE_SIZE: int = 10000
+    CASBIN_DECISION_CACHE_TTL: int = 3600
+    # reload the policy as soon as the trigger notifies a change
+    CASBIN_POLICY_LISTEN_ENABLED: bool = True
+    CASBIN_POLICY_LISTEN_RETRY_INTERVAL: float = 5.0
+    # load the policy of a zone on its first check instead of the whole table
+    CASBIN_POLICY_SHARDING_ENABLED: bool = False
+    CASBIN_POLICY_SHARD_COUNT: int = 100
+    CASBIN_POLICY_SHARD_IDLE_TIMEOUT: int = 600
 
     # Keycloak config
     KEYCLOAK_ID: str
@@ -88,6 +126,52 @@ class Settings(BaseSettings):
     KEYCLOAK_CLIENT_ID: str
     KEYCLOAK_SECRET: str
     KEYCLOAK_REALM: str
+    # seconds before expiry to renew the service-account token
+    KEYCLOAK_TOKEN_REFRESH_MARGIN: int = 30
+    # connection pool shared by the keycloak calls in a worker.
+    # http2 requires the h2 package (httpx[http2])
+    KEYCLOAK_HTTP_TIMEOUT: float = 10.0
+    KEYCLOAK_HTTP_MAX_CONNECTIONS: int = 100
+    KEYCLOAK_HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    KEYCLOAK_HTTP_KEEPALIVE_EXPIRY: float = 30.0
+    KEYCLOAK_HTTP2_ENABLED: bool = False
+    # cache of the realm roles resolved by name
+    KEYCLOAK_ROLE_CACHE_TTL: int = 300
+    KEYCLOAK_ROLE_CACHE_SIZE: int = 20000
+    KEYCLOAK_PLATFORM_ADMIN_CACHE_TTL: int = 60
+    # local verification of the access tokens. the issuer defaults to
+    # <KEYCLOAK_SERVER_URL>realms/<realm>. the token must be issued for
+    # the audience when it is set, otherwise to one of the authorized
+    # parties (azp, comma separated, default KEYCLOAK_CLIENT_ID)
+    KEYCLOAK_JWKS_TTL: int = 600
+    KEYCLOAK_JWKS_MIN_REFRESH_INTERVAL: int = 10
+    KEYCLOAK_TOKEN_ISSUER: str = ''
+    KEYCLOAK_TOKEN_AUDIENCE: str = ''
+    KEYCLOAK_TOKEN_AUTHORIZED_PARTIES: str = ''
+    KEYCLOAK_TOKEN_ALGORITHMS: str = 'RS256'
+    # the openid discovery document is revalidated after the ttl
+    KEYCLOAK_WELL_KNOWN_TTL: int = 3600
+    KEYCLOAK_WELL_KNOWN_RETRY: int = 60
+    # the access token claim mapped from the status attribute. when it is
+    # set the login reads the account status from the issued token
+    KEYCLOAK_LOGIN_STATUS_CLAIM: str = ''
+    # write-behind buffer of the user attributes like last_login
+    KEYCLOAK_ATTRIBUTE_FLUSH_INTERVAL: float = 5.0
+    KEYCLOAK_ATTRIBUTE_FLUSH_SIZE: int = 500
+    KEYCLOAK_ATTRIBUTE_FLUSH_CONCURRENCY: int = 10
+    KEYCLOAK_ATTRIBUTE_FLUSH_RETRIES: int = 3
+    # the user events are queued and written in batches
+    EVENT_FLUSH_INTERVAL: float = 1.0
+    EVENT_FLUSH_SIZE: int = 500
+    EVENT_FLUSH_RETRIES: int = 3
+    EVENT_QUEUE_MAX_SIZE: int = 10000
+    EVENT_USER_ID_CACHE_SIZE: int = 10000
+    EVENT_USER_ID_CACHE_TTL: int = 3600
+    # the local users mirror synchronization
+    USER_SYNC_ENABLED: bool = True
+    USER_SYNC_INTERVAL: int = 30
+    USER_SYNC_RECONCILE_INTERVAL: int = 3600
+    USER_SYNC_PAGE_SIZE: int = 500
 
     DOMAIN_NAME: str
     START_PATH: str
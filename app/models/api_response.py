@@ -41,3 +41,7 @@ class APIResponse(BaseModel):
         data = self.dict()
         data['code'] = self.code.value
         return JSONResponse(status_code=self.code.value, content=data)
+
+
+class CursorAPIResponse(APIResponse):
+    next_cursor: str = None
@@ -0,0 +1,51 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from typing import List
+
+from pydantic import BaseModel
+
+
+class AuthorizeCheck(BaseModel):
+    role: str
+    zone: str
+    resource: str
+    operation: str
+
+
+class AuthorizeBatchPOST(BaseModel):
+    """the permission checks evaluated in one call."""
+    checks: List[AuthorizeCheck]
+
+
+class PolicyRule(BaseModel):
+    role: str
+    zone: str
+    resource: str
+    operation: str
+
+
+class GroupingRule(BaseModel):
+    user: str
+    role: str
+    zone: str
+
+
+class PoliciesPUT(BaseModel):
+    """the policy and grouping rules added or removed in one transaction."""
+    operation_type: str
+    policies: List[PolicyRule] = []
+    grouping_policies: List[GroupingRule] = []
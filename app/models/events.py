@@ -122,6 +122,8 @@ class EventList(BaseModel):
     project_code: str = ""
     user_id: str = ""
     invitation_id: str = ""
+    cursor: str = None
+    exact_total: bool = True
 
     @validator('order_type')
     def validate_order_type(cls, v):
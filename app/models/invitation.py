@@ -35,6 +35,8 @@ class InvitationListPOST(BaseModel):
     order_by: str = 'create_timestamp'
     order_type: str = 'asc'
     filters: dict = {}
+    cursor: str = None
+    exact_total: bool = True
 
 
 class InvitationPOST(BaseModel):
@@ -34,6 +34,11 @@ class UserTokenRefreshPOST(BaseModel):
     refreshtoken: str
 
 
+class UserTokenVerifyPOST(BaseModel):
+    """user access token verification model."""
+    token: str
+
+
 class UserLastLoginPOST(BaseModel):
     username: str
 
@@ -13,7 +13,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import DDL, BigInteger, Column, Index, Integer, String, event
 from sqlalchemy.ext.declarative import declarative_base
 
 from app.config import ConfigSettings
@@ -23,7 +23,11 @@ Base = declarative_base()
 
 class CasbinRule(Base):
     __tablename__ = 'casbin_rule'
-    __table_args__ = {'schema': ConfigSettings.RDS_SCHEMA_PREFIX + "_casbin"}
+    __table_args__ = (
+        # the policies of a zone are loaded by ptype and zone
+        Index('ix_casbin_rule_ptype_v1_v0', 'ptype', 'v1', 'v0'),
+        {'schema': ConfigSettings.RDS_SCHEMA_PREFIX + "_casbin"},
+    )
 
     id = Column(Integer, primary_key=True)
     ptype = Column(String(255))
@@ -44,3 +48,51 @@ class CasbinRule(Base):
 
     def __repr__(self):
         return '<CasbinRule {}: "{}">'.format(self.id, str(self))
+
+
+class CasbinPolicyVersion(Base):
+    '''
+    Summary:
+        the single row counter bumped by a trigger on every change of
+        casbin_rule, the workers compare it to reload their policy
+    '''
+
+    __tablename__ = 'casbin_policy_version'
+    __table_args__ = {'schema': ConfigSettings.RDS_SCHEMA_PREFIX + "_casbin"}
+
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
+
+# the channel notified with the new version when the policy changes
+POLICY_CHANNEL = 'casbin_policy'
+# set in the transactions of the policy api, which notify the changed rules instead of the version
+POLICY_DELTA_SETTING = 'casbin.delta_notify'
+
+# same as the migration, so create_all gives the tables the trigger too
+_casbin_schema = ConfigSettings.RDS_SCHEMA_PREFIX + '_casbin'
+event.listen(
+    CasbinPolicyVersion.__table__,
+    'after_create',
+    DDL(
+        f'''
+        INSERT INTO {_casbin_schema}.casbin_policy_version (id, version) VALUES (1, 0);
+        CREATE OR REPLACE FUNCTION {_casbin_schema}.bump_casbin_policy_version() RETURNS trigger AS $$
+        DECLARE
+            new_version BIGINT;
+        BEGIN
+            UPDATE {_casbin_schema}.casbin_policy_version SET version = version + 1 WHERE id = 1
+                RETURNING version INTO new_version;
+            -- the policy api notifies the change itself
+            IF current_setting('{POLICY_DELTA_SETTING}', true) IS DISTINCT FROM 'on' THEN
+                PERFORM pg_notify('{POLICY_CHANNEL}', new_version::text);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        CREATE TRIGGER casbin_rule_policy_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {_casbin_schema}.casbin_rule
+            FOR EACH STATEMENT EXECUTE PROCEDURE {_casbin_schema}.bump_casbin_policy_version();
+        '''
+    ),
+)
@@ -16,7 +16,7 @@
 from datetime import datetime
 from uuid import uuid4
 
-from sqlalchemy import Column, DateTime, String
+from sqlalchemy import Column, DateTime, Index, String
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import JSON
@@ -28,7 +28,11 @@ Base = declarative_base()
 
 class UserEventModel(Base):
     __tablename__ = 'user_event'
-    __table_args__ = {'schema': ConfigSettings.RDS_SCHEMA_PREFIX + '_event'}
+    __table_args__ = (
+        # the keyset pagination of the default order
+        Index('ix_user_event_timestamp_id', 'timestamp', 'id'),
+        {'schema': ConfigSettings.RDS_SCHEMA_PREFIX + '_event'},
+    )
     id = Column(UUID(as_uuid=True), unique=True, primary_key=True, default=uuid4)
     target_user_id = Column(UUID(as_uuid=True))
     target_user = Column(String())
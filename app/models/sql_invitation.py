@@ -16,7 +16,7 @@
 from datetime import datetime
 from uuid import uuid4
 
-from sqlalchemy import Column, DateTime, String
+from sqlalchemy import Column, DateTime, Index, String
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -27,7 +27,11 @@ Base = declarative_base()
 
 class InvitationModel(Base):
     __tablename__ = 'invitation'
-    __table_args__ = {'schema': ConfigSettings.RDS_SCHEMA_PREFIX + '_invitation'}
+    __table_args__ = (
+        # the keyset pagination of the default order
+        Index('ix_invitation_create_timestamp_id', 'create_timestamp', 'id'),
+        {'schema': ConfigSettings.RDS_SCHEMA_PREFIX + '_invitation'},
+    )
     id = Column(UUID(as_uuid=True), unique=True, primary_key=True, default=uuid4)
     invitation_code = Column(String())
     expiry_timestamp = Column(DateTime())
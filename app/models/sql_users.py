@@ -0,0 +1,83 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import datetime
+
+from sqlalchemy import BigInteger, Column, DateTime, Index, String
+from sqlalchemy.ext.declarative import declarative_base
+
+from app.config import ConfigSettings
+
+Base = declarative_base()
+
+
+class UserModel(Base):
+    '''
+    Summary:
+        The local mirror of the keycloak users. The sortable columns are
+        not nullable so they can be used for the keyset pagination
+    '''
+
+    __tablename__ = 'users'
+    id = Column(String(), unique=True, primary_key=True)
+    username = Column(String(), nullable=False, server_default='')
+    email = Column(String(), nullable=False, server_default='')
+    first_name = Column(String(), nullable=False, server_default='')
+    last_name = Column(String(), nullable=False, server_default='')
+    status = Column(String(), nullable=True)
+    last_login = Column(String(), nullable=False, server_default='')
+    time_created = Column(DateTime(), nullable=False, default=datetime.utcnow)
+    synced_at = Column(DateTime(), nullable=False, default=datetime.utcnow)
+    __table_args__ = (
+        Index('ix_users_username_id', 'username', 'id'),
+        Index('ix_users_email_id', 'email', 'id'),
+        Index('ix_users_first_name_id', 'first_name', 'id'),
+        Index('ix_users_last_name_id', 'last_name', 'id'),
+        Index('ix_users_last_login_id', 'last_login', 'id'),
+        Index('ix_users_time_created_id', 'time_created', 'id'),
+        Index('ix_users_status', 'status'),
+        Index('ix_users_synced_at', 'synced_at'),
+        {'schema': ConfigSettings.RDS_SCHEMA_PREFIX + '_user'},
+    )
+
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.username,
+            'username': self.username,
+            'first_name': self.first_name,
+            'last_name': self.last_name,
+            'email': self.email,
+            'time_created': self.time_created.strftime('%Y-%m-%dT%H:%M:%S'),
+            'last_login': self.last_login or None,
+            'status': self.status,
+        }
+
+
+class UserSyncStateModel(Base):
+    '''
+    Summary:
+        The progress of the mirror synchronization shared by the workers
+    '''
+
+    __tablename__ = 'user_sync_state'
+    __table_args__ = {'schema': ConfigSettings.RDS_SCHEMA_PREFIX + '_user'}
+    id = Column(String(), primary_key=True)
+    last_event_time = Column(BigInteger(), nullable=False, default=0)
+    last_reconcile_at = Column(DateTime(), nullable=True)
@@ -30,6 +30,17 @@ class UserADGroupOperationsPUT(BaseModel):
     # realm: str
 
 
+class UserADGroupBulkOperationsPUT(BaseModel):
+    operation_type: str
+    group_code: str
+    user_emails: List[str]
+
+
+class ADGroupReconcilePOST(BaseModel):
+    project_codes: Optional[List[str]] = None
+    dry_run: bool = True
+
+
 class UserManagementV1PUT(BaseModel):
     operation_type: str
     user_email: str
@@ -0,0 +1,109 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class TTLCache:
+    '''
+    Summary:
+        A small thread-safe key/value cache. Every entry expires after
+        <ttl> seconds and the least recently used entry is evicted once
+        the cache holds <maxsize> entries
+    '''
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expire_at = entry
+            if time.monotonic() >= expire_at:
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float = None) -> None:
+        expire_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expire_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def update(self, items: dict, ttl: float = None) -> None:
+        for key, value in items.items():
+            self.set(key, value, ttl)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_MISSING = object()
+
+
+class SingleFlight:
+    '''
+    Summary:
+        Coalesce the identical concurrent calls. While a call for the key
+        is in flight, the other callers wait for it and get a copy of its
+        result (or its exception) instead of starting their own call
+    '''
+
+    def __init__(self):
+        self._calls = {}
+
+    def _forget(self, key: Hashable, future: asyncio.Future) -> None:
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        # mark the exception as retrieved if every caller was cancelled
+        if not future.cancelled():
+            future.exception()
+
+    async def do(self, key: Hashable, func: Callable[..., Awaitable], *args, **kwargs) -> Any:
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func(*args, **kwargs))
+            self._calls[key] = future
+            future.add_done_callback(lambda f: self._forget(key, f))
+
+        # a cancelled caller must not cancel the call shared with the others
+        result = await asyncio.shield(future)
+        # the callers are free to modify the result they get
+        return copy.deepcopy(result)
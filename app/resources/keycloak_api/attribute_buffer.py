@@ -0,0 +1,166 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+from common import LoggerFactory
+from keycloak import exceptions
+
+from app.config import ConfigSettings
+from app.resources.keycloak_api.ops_admin import get_admin_client
+
+_logger = LoggerFactory('attribute_buffer').get_logger()
+
+
+class UserAttributeBuffer:
+    '''
+    Summary:
+        Write-behind buffer for the user attributes which do not need to
+        be written within the request (eg. last_login). The attributes are
+        merged per user so a user logging in many times between two flushes
+        costs one keycloak update. The buffer is flushed every
+        KEYCLOAK_ATTRIBUTE_FLUSH_INTERVAL seconds or as soon as
+        KEYCLOAK_ATTRIBUTE_FLUSH_SIZE users are pending. A failed update is
+        retried KEYCLOAK_ATTRIBUTE_FLUSH_RETRIES times unless keycloak rejected
+        it (eg. the user was deleted), then the attributes are dropped
+    '''
+
+    def __init__(self, realm_name: str = ConfigSettings.KEYCLOAK_REALM):
+        self.realm_name = realm_name
+        self._pending = {}
+        self._failures = {}
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+
+    def add(self, user_id: str, attributes: dict) -> None:
+        '''
+        Summary:
+            queue the attributes of the user for the next flush. the newer
+            value wins if the same attribute is already pending
+
+        Parameter:
+            - user_id(string): the user id (hash) in keycloak
+            - attributes(dict): the attributes to update
+
+        Return:
+            None
+        '''
+
+        self._pending.setdefault(user_id, {}).update(attributes)
+        if self._wakeup and len(self._pending) >= ConfigSettings.KEYCLOAK_ATTRIBUTE_FLUSH_SIZE:
+            self._wakeup.set()
+
+    def take(self, user_id: str) -> dict:
+        '''
+        Summary:
+            remove the pending attributes of the user so the caller can
+            write them together with its own synchronous update
+
+        Parameter:
+            - user_id(string): the user id (hash) in keycloak
+
+        Return:
+            the pending attributes(dict)
+        '''
+
+        self._failures.pop(user_id, None)
+        return self._pending.pop(user_id, {})
+
+    async def _update_user(self, semaphore: asyncio.Semaphore, user_id: str, attributes: dict) -> None:
+        async with semaphore:
+            try:
+                await get_admin_client(self.realm_name).update_user_attributes(user_id, attributes)
+                self._failures.pop(user_id, None)
+                return
+            except exceptions.KeycloakError as e:
+                if e.response_code and 400 <= e.response_code < 500 and e.response_code not in (408, 429):
+                    # retrying will not help, the user is gone or the update is invalid
+                    self._drop(user_id, attributes, e)
+                    return
+                error = e
+            except Exception as e:
+                error = e
+
+            failures = self._failures.get(user_id, 0) + 1
+            if failures > ConfigSettings.KEYCLOAK_ATTRIBUTE_FLUSH_RETRIES:
+                self._drop(user_id, attributes, error)
+                return
+            _logger.error(f'Fail to update the attributes of user {user_id}: {error}')
+            self._failures[user_id] = failures
+            # put the attributes back unless a newer value was queued meanwhile
+            self._pending[user_id] = {**attributes, **self._pending.get(user_id, {})}
+
+    def _drop(self, user_id: str, attributes: dict, error: Exception) -> None:
+        _logger.warning(f'Drop the attributes {attributes} of user {user_id}: {error}')
+        self._failures.pop(user_id, None)
+
+    async def flush(self) -> None:
+        '''
+        Summary:
+            write all the pending attributes to keycloak. The failed updates
+            are queued again for the next flush until they run out of retries
+
+        Return:
+            None
+        '''
+
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        semaphore = asyncio.Semaphore(ConfigSettings.KEYCLOAK_ATTRIBUTE_FLUSH_CONCURRENCY)
+        await asyncio.gather(
+            *[self._update_user(semaphore, user_id, attributes) for user_id, attributes in pending.items()]
+        )
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), ConfigSettings.KEYCLOAK_ATTRIBUTE_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        '''
+        Summary:
+            stop the background flush and drain the buffer
+
+        Return:
+            None
+        '''
+
+        if self._task:
+            # let the running flush finish instead of cancelling it
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._wakeup = None
+        await self.flush()
+
+
+_attribute_buffer = UserAttributeBuffer()
+
+
+def get_attribute_buffer() -> UserAttributeBuffer:
+    return _attribute_buffer
@@ -0,0 +1,64 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import httpx
+
+from app.config import ConfigSettings
+
+_http_client = None
+
+
+def get_keycloak_http_client() -> httpx.AsyncClient:
+    '''
+    Summary:
+        Return the http client shared by the worker for all the keycloak
+        calls. The connections are kept alive in the pool so the calls
+        will not pay the tcp/tls setup again
+
+    Return:
+        - httpx.AsyncClient
+    '''
+
+    global _http_client
+
+    if _http_client is None or _http_client.is_closed:
+        limits = httpx.Limits(
+            max_connections=ConfigSettings.KEYCLOAK_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=ConfigSettings.KEYCLOAK_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=ConfigSettings.KEYCLOAK_HTTP_KEEPALIVE_EXPIRY,
+        )
+        _http_client = httpx.AsyncClient(
+            limits=limits,
+            timeout=ConfigSettings.KEYCLOAK_HTTP_TIMEOUT,
+            http2=ConfigSettings.KEYCLOAK_HTTP2_ENABLED,
+        )
+
+    return _http_client
+
+
+async def close_keycloak_http_client() -> None:
+    '''
+    Summary:
+        Close the shared http client and release the pooled connections
+
+    Return:
+        None
+    '''
+
+    global _http_client
+
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
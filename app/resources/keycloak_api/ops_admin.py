@@ -13,19 +13,71 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
+import threading
+import time
+from functools import wraps
+
 import httpx
-import requests
-from keycloak import KeycloakAdmin, exceptions
+from common import LoggerFactory
+from keycloak import exceptions
+from keycloak.exceptions import raise_error_from_response
 
 from app.config import ConfigSettings
-from app.models.api_response import EAPIResponseCode
-from app.resources.error_handler import APIException
+from app.resources.cache import SingleFlight, TTLCache
+from app.resources.keycloak_api.http_client import get_keycloak_http_client
 
+_logger = LoggerFactory('keycloak_admin').get_logger()
 
-class OperationsAdmin:
+_admin_clients = {}
+_admin_clients_lock = threading.Lock()
+
+# the page size used to walk the paginated admin api
+PAGE_SIZE = 100
+
+PLATFORM_ADMIN_ROLE = 'platform-admin'
+
+
+def get_admin_client(realm_name: str = ConfigSettings.KEYCLOAK_REALM) -> 'OperationsAdmin':
+    '''
+    Summary:
+        Return the admin client shared by the worker for the target realm.
+        The client is created on first use so the service-account token
+        is only requested once and then kept fresh by the client itself
+
+    Parameter:
+        - realm_name(string): the realm in keycloak
+
+    Return:
+        - OperationsAdmin
+    '''
+
+    admin_client = _admin_clients.get(realm_name)
+    if admin_client is None:
+        with _admin_clients_lock:
+            admin_client = _admin_clients.get(realm_name)
+            if admin_client is None:
+                admin_client = OperationsAdmin(realm_name)
+                _admin_clients[realm_name] = admin_client
+    return admin_client
 
-    keycloak_admin: KeycloakAdmin
 
+def single_flight(func):
+    '''
+    Summary:
+        share one in-flight keycloak call between the concurrent
+        identical lookups on the same admin client
+    '''
+
+    @wraps(func)
+    async def inner(self, *args, **kwargs):
+        key = (func.__name__, args, tuple(sorted(kwargs.items())))
+        return await self._single_flight.do(key, func, self, *args, **kwargs)
+
+    return inner
+
+
+class OperationsAdmin:
     def __init__(
         self,
         realm_name,
@@ -36,7 +88,9 @@ class OperationsAdmin:
     ):
         '''
         Summary:
-            The initialization for the keycloak admin operation
+            The initialization for the keycloak admin operation. The
+            service-account token is requested on the first call so
+            the client can be created outside of the event loop
 
         Parameter:
             - realm_name(string): the realm in keycloak
@@ -52,21 +106,152 @@ class OperationsAdmin:
             None
         '''
 
-        self.keycloak_admin = KeycloakAdmin(
-            server_url=server_url,
-            client_id=client_id,
-            client_secret_key=client_secret_key,
-            realm_name=realm_name,
-            verify=verify,
-        )
         self.realm_name = realm_name
-        self.token = self.keycloak_admin.token
-        self.header = {'Authorization': 'Bearer ' + self.token.get('access_token'), 'Content-Type': 'application/json'}
+        self.server_url = server_url
+        self.client_id = client_id
+        self.client_secret_key = client_secret_key
+        self.verify = verify
+        self.admin_url = f'{server_url}admin/realms/{realm_name}'
+
+        self.token = None
+        self._token_refresh_at = 0
+        self._token_lock = None
+        self._refresh_handle = None
+
+        # name indexed realm roles. the whole catalog is reloaded once
+        # it expires and missing names are looked up one by one
+        self._realm_roles = TTLCache(ConfigSettings.KEYCLOAK_ROLE_CACHE_SIZE, ConfigSettings.KEYCLOAK_ROLE_CACHE_TTL)
+        self._realm_roles_expire_at = 0
+
+        # id to username of the platform admins. it is dropped when the
+        # platform admin role is granted or revoked through this client
+        self._platform_admins = None
+        self._platform_admins_expire_at = 0
+
+        self._single_flight = SingleFlight()
+
+    async def get_header(self) -> dict:
+        await self._ensure_token()
+        return {'Authorization': 'Bearer ' + self.token.get('access_token'), 'Content-Type': 'application/json'}
+
+    def _set_token(self, token: dict) -> None:
+        '''
+        Summary:
+            store the new service-account token and schedule the
+            background refresh shortly before it expires
+
+        Parameter:
+            - token(dict): the token response from keycloak
+
+        Return:
+            None
+        '''
+
+        self.token = token
+        expires_in = token.get('expires_in', 60)
+        # renew ahead of the expiry but never later than half way
+        # through the lifetime of short lived tokens
+        delay = max(expires_in - ConfigSettings.KEYCLOAK_TOKEN_REFRESH_MARGIN, expires_in / 2)
+        self._token_refresh_at = time.monotonic() + delay
+
+        if self._refresh_handle:
+            self._refresh_handle.cancel()
+        loop = asyncio.get_running_loop()
+        self._refresh_handle = loop.call_later(delay, lambda: loop.create_task(self._background_refresh()))
+
+    async def _background_refresh(self) -> None:
+        try:
+            await self.refresh_token(self.token)
+        except Exception as e:
+            # the next call will retry the refresh on demand
+            _logger.error('Fail to refresh keycloak admin token: ' + str(e))
+
+    async def _ensure_token(self) -> None:
+        if self.token is None or time.monotonic() >= self._token_refresh_at:
+            await self.refresh_token(self.token)
 
-    def get_user_id(self, username: str) -> str:
+    async def refresh_token(self, stale_token: dict = None) -> None:
         '''
         Summary:
-            The wraped for python keycloak client to get user id by username
+            request a new service-account token with the client credentials.
+            the refresh is serialized so concurrent callers holding the same
+            stale token only trigger one round trip to keycloak
+
+        Parameter:
+            - stale_token(dict optional): the token the caller observed as
+                expired. skip the refresh if it was already replaced
+
+        Return:
+            None
+        '''
+
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+
+        async with self._token_lock:
+            if self.token is not None and stale_token is not self.token:
+                return
+
+            url = f'{self.server_url}realms/{self.realm_name}/protocol/openid-connect/token'
+            payload = {
+                'grant_type': 'client_credentials',
+                'client_id': self.client_id,
+                'client_secret': self.client_secret_key,
+            }
+            client = get_keycloak_http_client()
+            api_res = await client.post(url, data=payload)
+            token = raise_error_from_response(api_res, exceptions.KeycloakGetError)
+            self._set_token(token)
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        '''
+        Summary:
+            send the request to the keycloak admin api on the shared
+            connection pool and retry once with a new token if keycloak
+            responds 401
+        '''
+
+        client = get_keycloak_http_client()
+        header = await self.get_header()
+        token = self.token
+        api_res = await client.request(method, url, headers=header, **kwargs)
+        if api_res.status_code == 401:
+            await self.refresh_token(token)
+            api_res = await client.request(method, url, headers=await self.get_header(), **kwargs)
+        return api_res
+
+    async def _fetch_all(self, url: str, query: dict = None) -> list:
+        '''
+        Summary:
+            walk through the paginated admin api and return all the
+            entries matching the query
+
+        Parameter:
+            - url(string): the admin api endpoint
+            - query(dict optional): the filter for the endpoint
+
+        Return:
+            list of entries
+        '''
+
+        query = dict(query or {})
+        results = []
+        page = 0
+        while True:
+            query['first'] = page * PAGE_SIZE
+            query['max'] = PAGE_SIZE
+            api_res = await self._request('GET', url, params=query)
+            partial = raise_error_from_response(api_res, exceptions.KeycloakGetError)
+            results.extend(partial)
+            if len(partial) < PAGE_SIZE:
+                break
+            page += 1
+        return results
+
+    async def get_user_id(self, username: str) -> str:
+        '''
+        Summary:
+            The wraped for keycloak api to get user id by username
 
         Parameter:
             - username(string): target username
@@ -75,13 +260,15 @@ class OperationsAdmin:
             - user_id(string): the hash id from keycloak
         '''
 
-        user_id = self.keycloak_admin.get_user_id(username)
-        return user_id
+        lower_user_name = username.lower()
+        users = await self._fetch_all(f'{self.admin_url}/users', {'search': lower_user_name})
+        return next((user['id'] for user in users if user['username'] == lower_user_name), None)
 
-    def get_user_by_id(self, user_id: str) -> dict:
+    @single_flight
+    async def get_user_by_id(self, user_id: str) -> dict:
         '''
         Summary:
-            The wraped for python keycloak client to get user infomation
+            The wraped for keycloak api to get user infomation
             by id
 
         Parameter:
@@ -91,13 +278,14 @@ class OperationsAdmin:
             - user(dict): the user infomation from keycloak
         '''
 
-        user = self.keycloak_admin.get_user(user_id)
-        return user
+        api_res = await self._request('GET', f'{self.admin_url}/users/{user_id}')
+        return raise_error_from_response(api_res, exceptions.KeycloakGetError)
 
-    def get_user_by_email(self, email: str) -> dict:
+    @single_flight
+    async def get_user_by_email(self, email: str) -> dict:
         '''
         Summary:
-            The wraped for python keycloak client to get user infomation
+            The wraped for keycloak api to get user infomation
             by email
 
         Parameter:
@@ -107,29 +295,30 @@ class OperationsAdmin:
             - user(dict): the user infomation from keycloak
         '''
 
-        users = self.keycloak_admin.get_users({'email': email})
+        users = await self._fetch_all(f'{self.admin_url}/users', {'email': email})
         # Loop through search results and only return an exact match
         return next((user for user in users if user['email'] == email), None)
 
-    def get_user_by_username(self, username: str) -> dict:
+    @single_flight
+    async def get_user_by_username(self, username: str) -> dict:
         '''
         Summary:
-            The wraped for python keycloak client to get user infomation
-            by email
+            The wraped for keycloak api to get user infomation
+            by username
 
         Parameter:
-            - email(string): the email for target user
+            - username(string): the username for target user
 
         Return:
             - user(dict): the user infomation from keycloak
         '''
 
-        user_id = self.keycloak_admin.get_user_id(username)
-        user = self.keycloak_admin.get_user(user_id)
-        # Loop through search results and only return an exact match
-        return user
+        user_id = await self.get_user_id(username)
+        if user_id is None:
+            raise exceptions.KeycloakGetError('User %s is not found' % username, response_code=404)
+        return await self.get_user_by_id(user_id)
 
-    def update_user_attributes(self, user_id: str, new_attributes: dict) -> dict:
+    async def update_user_attributes(self, user_id: str, new_attributes: dict) -> dict:
         '''
         Summary:
             the function will use keycloak api to update the user attribute
@@ -147,26 +336,17 @@ class OperationsAdmin:
         '''
 
         # get user info and update the new attribute to existing
-        user_info = self.keycloak_admin.get_user(user_id)
+        user_info = await self.get_user_by_id(user_id)
         attri = user_info.get('attributes', {})
         attri.update(new_attributes)
 
-        with httpx.Client() as client:
-            api = (
-                ConfigSettings.KEYCLOAK_SERVER_URL
-                + 'admin/realms/'
-                + ConfigSettings.KEYCLOAK_REALM
-                + '/users/'
-                + user_id
-            )
-            api_res = client.put(api, headers=self.header, json={'attributes': attri})
-            # return check if fail raise the error
-            if api_res.status_code != 204:
-                raise Exception('Fail to update user attributes: ' + str(api_res.__dict__))
+        api_res = await self._request('PUT', f'{self.admin_url}/users/{user_id}', json={'attributes': attri})
+        # return check if fail raise the error
+        raise_error_from_response(api_res, exceptions.KeycloakGetError, expected_code=204)
 
         return new_attributes
 
-    def get_all_users(
+    async def get_all_users(
         self, username: str = None, email: str = None, first: int = 0, max: int = 1000, q: str = ''
     ) -> list:
         '''
@@ -195,16 +375,14 @@ class OperationsAdmin:
             'q': q,
         }
 
-        api = ConfigSettings.KEYCLOAK_SERVER_URL + 'admin/realms/' + ConfigSettings.KEYCLOAK_REALM + '/users'
-        with httpx.Client() as client:
-            api_res = client.get(api, headers=self.header, params=query)
-            # return check if fail raise the error
-            if api_res.status_code != 200:
-                raise Exception('Fail to get all user: ' + str(api_res.__dict__))
+        api_res = await self._request('GET', f'{self.admin_url}/users', params=query)
+        # return check if fail raise the error
+        if api_res.status_code != 200:
+            raise Exception('Fail to get all user: ' + str(api_res.__dict__))
 
         return api_res.json()
 
-    def get_user_count(
+    async def get_user_count(
         self, username: str = None, email: str = None, first: int = 0, max: int = 1000, q: str = ''
     ) -> int:
         '''
@@ -234,17 +412,131 @@ class OperationsAdmin:
             'q': q,
         }
 
-        api = ConfigSettings.KEYCLOAK_SERVER_URL + 'admin/realms/' + ConfigSettings.KEYCLOAK_REALM + '/users/count'
-        with httpx.Client() as client:
-            api_res = client.get(api, headers=self.header, params=query)
-            # return check if fail raise the error
-            if api_res.status_code != 200:
-                raise Exception('Fail to get user count: ' + str(api_res.__dict__))
+        api_res = await self._request('GET', f'{self.admin_url}/users/count', params=query)
+        # return check if fail raise the error
+        if api_res.status_code != 200:
+            raise Exception('Fail to get user count: ' + str(api_res.__dict__))
         return api_res.json()
 
+    async def iter_users(self, page_size: int = PAGE_SIZE):
+        '''
+        Summary:
+            walk through all the users of the realm page by page
+
+        Parameter:
+            - page_size(int): the number of users fetched per request
+
+        Return:
+            async generator of the user list pages
+        '''
+
+        first = 0
+        while True:
+            api_res = await self._request('GET', f'{self.admin_url}/users', params={'first': first, 'max': page_size})
+            users = raise_error_from_response(api_res, exceptions.KeycloakGetError)
+            if users:
+                yield users
+            if len(users) < page_size:
+                break
+            first += page_size
+
+    async def get_admin_events(self, resource_types: list, date_from: str = None, since: int = None) -> list:
+        '''
+        Summary:
+            list the admin events recorded by keycloak. The admin events
+            need to be enabled in the realm settings. Keycloak returns the
+            newest events first, so the pages stop at the first event
+            which is not newer than <since>
+
+        Parameter:
+            - resource_types(list): eg. USER, REALM_ROLE_MAPPING
+            - date_from(string optional): the first day(YYYY-MM-DD) to return
+            - since(int optional): only return the events after this time(ms)
+
+        Return:
+            list of the admin events, the newest first
+        '''
+
+        query = {'resourceTypes': resource_types, 'max': PAGE_SIZE}
+        if date_from:
+            query['dateFrom'] = date_from
+        events = []
+        first = 0
+        while True:
+            query['first'] = first
+            api_res = await self._request('GET', f'{self.admin_url}/admin-events', params=query)
+            partial = raise_error_from_response(api_res, exceptions.KeycloakGetError)
+            newer = [event for event in partial if since is None or event.get('time', 0) > since]
+            events.extend(newer)
+            if len(partial) < PAGE_SIZE or len(newer) < len(partial):
+                break
+            first += PAGE_SIZE
+        return events
+
     # the realm role operations
 
-    def assign_user_role(self, user_id, role_name) -> dict:
+    async def get_realm_roles(self) -> list:
+        '''
+        Summary:
+            the function will list all the realm roles in keycloak and
+            refresh the realm role cache with them
+
+        Return:
+            list of the realm roles
+        '''
+
+        api_res = await self._request('GET', f'{self.admin_url}/roles')
+        realm_roles = raise_error_from_response(api_res, exceptions.KeycloakGetError)
+
+        self._realm_roles.clear()
+        self._realm_roles.update({role['name']: role for role in realm_roles})
+        self._realm_roles_expire_at = time.monotonic() + ConfigSettings.KEYCLOAK_ROLE_CACHE_TTL
+        return realm_roles
+
+    async def _load_realm_role(self, role_name: str) -> dict:
+        '''
+        Summary:
+            fetch a single realm role by name and store it in the cache
+
+        Parameter:
+            - role_name(string): the role name from keycloak
+
+        Return:
+            the realm role(dict) or None if it does not exist
+        '''
+
+        api_res = await self._request('GET', f'{self.admin_url}/roles/{role_name}')
+        if api_res.status_code == 404:
+            return None
+        role = raise_error_from_response(api_res, exceptions.KeycloakGetError)
+        self._realm_roles.set(role_name, role)
+        return role
+
+    async def get_realm_role(self, role_name: str) -> dict:
+        '''
+        Summary:
+            resolve the realm role by name from the cache. the catalog is
+            reloaded when it expires, otherwise an unknown name (eg. a role
+            created by another worker) is fetched on its own
+
+        Parameter:
+            - role_name(string): the role name from keycloak
+
+        Return:
+            the realm role(dict) or None if it does not exist
+        '''
+
+        role = self._realm_roles.get(role_name)
+        if role is not None:
+            return role
+
+        if time.monotonic() >= self._realm_roles_expire_at:
+            await self.get_realm_roles()
+            return self._realm_roles.get(role_name)
+
+        return await self._load_realm_role(role_name)
+
+    async def assign_user_role(self, user_id, role_name) -> dict:
         '''
         Summary:
             the function will assign the user to target realm role in keycloak
@@ -256,18 +548,19 @@ class OperationsAdmin:
         Return:
             dict
         '''
-        client_id = ConfigSettings.KEYCLOAK_CLIENT_ID
-        realm_roles = self.keycloak_admin.get_realm_roles()
 
         # pick out the role we wnat to assign
-        find_role = [role for role in realm_roles if role['name'] == role_name]
-        if len(find_role) == 0:
+        role = await self.get_realm_role(role_name)
+        if role is None:
             raise Exception('Failed to find the role')
 
-        res = self.keycloak_admin.assign_realm_roles(client_id=client_id, user_id=user_id, roles=find_role)
-        return res
+        api_res = await self._request('POST', f'{self.admin_url}/users/{user_id}/role-mappings/realm', json=[role])
+        result = raise_error_from_response(api_res, exceptions.KeycloakGetError, expected_code=204)
+        self._invalidate_platform_admins([role])
+        return result
 
-    def get_user_realm_roles(self, user_id: str) -> list:
+    @single_flight
+    async def get_user_realm_roles(self, user_id: str) -> list:
         '''
         Summary:
             the function will use the keycloak native api to fecth the
@@ -280,23 +573,14 @@ class OperationsAdmin:
             list of the realm roles
         '''
 
-        with httpx.Client() as client:
-            api = (
-                ConfigSettings.KEYCLOAK_SERVER_URL
-                + 'admin/realms/'
-                + ConfigSettings.KEYCLOAK_REALM
-                + '/users/'
-                + user_id
-                + '/role-mappings/realm'
-            )
-            api_res = client.get(api, headers=self.header)
-            # return check if fail raise the error
-            if api_res.status_code != 200:
-                raise Exception('Fail to get user realm roles: ' + str(api_res.__dict__))
+        api_res = await self._request('GET', f'{self.admin_url}/users/{user_id}/role-mappings/realm')
+        # return check if fail raise the error
+        if api_res.status_code != 200:
+            raise Exception('Fail to get user realm roles: ' + str(api_res.__dict__))
 
         return api_res.json()
 
-    def remove_user_realm_roles(self, user_id: str, realm_roles: list) -> None:
+    async def remove_user_realm_roles(self, user_id: str, realm_roles: list) -> None:
         '''
         Summary:
             the function will use the keycloak native api to fecth the
@@ -310,23 +594,15 @@ class OperationsAdmin:
         '''
 
         # remove user from all existing role (remove the permission)
-        with httpx.Client() as client:
-            api = (
-                ConfigSettings.KEYCLOAK_SERVER_URL
-                + 'admin/realms/'
-                + ConfigSettings.KEYCLOAK_REALM
-                + '/users/'
-                + user_id
-                + '/role-mappings/realm'
-            )
-            # the httpx.delete deos not suppor the payload so I switch to genetic method
-            request = httpx.Request('DELETE', api, headers=self.header, json=realm_roles)
-            api_res = client.send(request)
-            # return check if fail raise the error
-            if api_res.status_code > 300:
-                raise Exception('Fail to remove user from realm: ' + str(api_res.__dict__))
-
-    def create_project_realm_roles(self, project_roles: list, code: str) -> None:
+        api_res = await self._request(
+            'DELETE', f'{self.admin_url}/users/{user_id}/role-mappings/realm', json=realm_roles
+        )
+        # return check if fail raise the error
+        if api_res.status_code > 300:
+            raise Exception('Fail to remove user from realm: ' + str(api_res.__dict__))
+        self._invalidate_platform_admins(realm_roles)
+
+    async def create_project_realm_roles(self, project_roles: list, code: str) -> None:
         '''
         Summary:
             the function will use the native the keycloak api to create
@@ -343,13 +619,14 @@ class OperationsAdmin:
 
         for role in project_roles:
             payload = {'name': '{}-{}'.format(code, role)}
-            url = f'{ConfigSettings.KEYCLOAK_SERVER_URL}admin/realms/{ConfigSettings.KEYCLOAK_REALM}/roles'
-            res = requests.post(url=url, headers=self.header, json=payload)
+            res = await self._request('POST', f'{self.admin_url}/roles', json=payload)
             if res.status_code != 201:
                 raise Exception('Fail to create new role' + str(res.__dict__))
+            # make the new role visible to the following assignments at once
+            await self._load_realm_role(payload['name'])
         return res
 
-    def delete_role_of_user(self, user_id: str, role_name: str):
+    async def delete_role_of_user(self, user_id: str, role_name: str):
         '''
         Summary:
             the function will use the native the keycloak api to remove
@@ -363,18 +640,19 @@ class OperationsAdmin:
             None
         '''
 
-        realm_roles = self.keycloak_admin.get_realm_roles()
-        find_role = [role for role in realm_roles if role['name'] == role_name]
+        role = await self.get_realm_role(role_name)
 
         # raise the error if user does not have target role
-        if len(find_role) == 0:
+        if role is None:
             raise Exception('User %s does not have role %s' % (user_id, role_name))
 
-        url = f'{ConfigSettings.KEYCLOAK_SERVER_URL}admin/realms/{self.realm_name}/users/{user_id}/role-mappings/realm'
-        delete_res = requests.delete(url, json=find_role, headers=self.header)
+        url = f'{self.admin_url}/users/{user_id}/role-mappings/realm'
+        delete_res = await self._request('DELETE', url, json=[role])
+        self._invalidate_platform_admins([role])
         return delete_res
 
-    def get_users_in_role(self, role_name: str) -> list:
+    @single_flight
+    async def get_users_in_role(self, role_name: str) -> list:
         '''
         Summary:
             the function will return the all users under target
@@ -390,31 +668,60 @@ class OperationsAdmin:
                 - email
         '''
 
-        with httpx.Client() as client:
-            api = (
-                ConfigSettings.KEYCLOAK_SERVER_URL
-                + 'admin/realms/'
-                + ConfigSettings.KEYCLOAK_REALM
-                + '/roles/'
-                + role_name
-                + '/users'
-            )
-            api_res = client.get(api, headers=self.header)
+        api_res = await self._request('GET', f'{self.admin_url}/roles/{role_name}/users')
 
-            if api_res.status_code == 404:
-                raise Exception('Role %s is not found' % role_name)
+        if api_res.status_code == 404:
+            raise Exception('Role %s is not found' % role_name)
 
         return api_res.json()
 
-    def sync_user_trigger(self):
-        access_token = self.token['access_token']
-        url = f'{ConfigSettings.KEYCLOAK_SERVER_URL}admin/realms/{ConfigSettings.KEYCLOAK_REALM}/user-storage/{ConfigSettings.KEYCLOAK_ID}/sync?action=triggerChangedUsersSync'
-        res = requests.post(url=url, headers=self.header)
+    async def get_role_members(self, role_name: str) -> list:
+        '''
+        Summary:
+            the function will return every user of the role, walking
+            through all the pages of the role members
+
+        Parameter:
+            - role_name(string): the role name from keycloak
+
+        Return:
+            list of user representation
+        '''
+
+        return await self._fetch_all(f'{self.admin_url}/roles/{role_name}/users')
+
+    def _invalidate_platform_admins(self, realm_roles: list) -> None:
+        if any(role.get('name') == PLATFORM_ADMIN_ROLE for role in realm_roles):
+            self._platform_admins = None
+
+    async def get_platform_admins(self) -> dict:
+        '''
+        Summary:
+            return the members of the platform admin role from the cache.
+            the cache expires after KEYCLOAK_PLATFORM_ADMIN_CACHE_TTL
+            seconds so the changes made outside this worker show up
+
+        Return:
+            dict of the platform admin id to username
+        '''
+
+        if self._platform_admins is None or time.monotonic() >= self._platform_admins_expire_at:
+            users = await self._fetch_all(f'{self.admin_url}/roles/{PLATFORM_ADMIN_ROLE}/users')
+            self._platform_admins = {user['id']: user['username'] for user in users}
+            self._platform_admins_expire_at = time.monotonic() + ConfigSettings.KEYCLOAK_PLATFORM_ADMIN_CACHE_TTL
+        return self._platform_admins
+
+    async def is_platform_admin(self, user_id: str) -> bool:
+        return user_id in await self.get_platform_admins()
+
+    async def sync_user_trigger(self):
+        url = f'{self.admin_url}/user-storage/{ConfigSettings.KEYCLOAK_ID}/sync?action=triggerChangedUsersSync'
+        res = await self._request('POST', url)
         return res
 
     # the group operation
 
-    def get_group_by_name(self, group_name: str) -> dict:
+    async def get_group_by_name(self, group_name: str) -> dict:
         '''
         Summary:
             the function will get the group from keycloak
@@ -425,10 +732,13 @@ class OperationsAdmin:
         Return:
             group inforamtion(dict)
         '''
-        group_info = self.keycloak_admin.get_group_by_path(f'/{group_name}')
-        return group_info
 
-    def create_group(self, group_name: str) -> None:
+        api_res = await self._request('GET', f'{self.admin_url}/group-by-path/{group_name}')
+        if api_res.status_code == 404:
+            return None
+        return raise_error_from_response(api_res, exceptions.KeycloakGetError)
+
+    async def create_group(self, group_name: str) -> None:
         '''
         Summary:
             the function will create new group in keycloak
@@ -441,10 +751,11 @@ class OperationsAdmin:
         '''
 
         group_dict = {'name': group_name}
-        self.keycloak_admin.create_group(group_dict)
+        api_res = await self._request('POST', f'{self.admin_url}/groups', json=group_dict)
+        raise_error_from_response(api_res, exceptions.KeycloakGetError, expected_code=201)
         return None
 
-    def add_user_to_group(self, user_id: str, group_id: str) -> None:
+    async def add_user_to_group(self, user_id: str, group_id: str) -> None:
         '''
         Summary:
             the function will create new group in keycloak
@@ -457,10 +768,11 @@ class OperationsAdmin:
             None
         '''
 
-        self.keycloak_admin.group_user_add(user_id, group_id)
+        api_res = await self._request('PUT', f'{self.admin_url}/users/{user_id}/groups/{group_id}')
+        raise_error_from_response(api_res, exceptions.KeycloakGetError, expected_code=204)
         return None
 
-    def remove_user_from_group(self, user_id: str, group_id: str) -> None:
+    async def remove_user_from_group(self, user_id: str, group_id: str) -> None:
         '''
         Summary:
             the function will create new group in keycloak
@@ -472,12 +784,14 @@ class OperationsAdmin:
         Return:
             None
         '''
-        self.keycloak_admin.group_user_remove(user_id, group_id)
+
+        api_res = await self._request('DELETE', f'{self.admin_url}/users/{user_id}/groups/{group_id}')
+        raise_error_from_response(api_res, exceptions.KeycloakGetError, expected_code=204)
         return None
 
-    def check_user_exists(self, email: str) -> bool:
+    async def check_user_exists(self, email: str) -> bool:
         try:
-            self.get_user_by_email(email)
+            await self.get_user_by_email(email)
             return True
         except exceptions.KeycloakGetError:
             return False
@@ -13,33 +13,117 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from keycloak import KeycloakOpenID
+import threading
+import time
+
+from common import LoggerFactory
+from keycloak import KeycloakOpenID, exceptions
+from keycloak.exceptions import raise_error_from_response
 
 from app.config import ConfigSettings
+from app.resources.keycloak_api.http_client import get_keycloak_http_client
+
+_logger = LoggerFactory('keycloak_user').get_logger()
+
+_user_clients = {}
+_user_clients_lock = threading.Lock()
+
+
+def get_user_client(
+    realm_name: str = ConfigSettings.KEYCLOAK_REALM,
+    client_id: str = ConfigSettings.KEYCLOAK_CLIENT_ID,
+    client_secret_key: str = ConfigSettings.KEYCLOAK_SECRET,
+) -> 'OperationsUser':
+    '''
+    Summary:
+        Return the openid client shared by the worker for the target
+        realm and client
+
+    Parameter:
+        - realm_name(string): the realm in keycloak
+        - client_id(string): the client in keycloak
+        - client_secret_key(string): the credential for the target client
+
+    Return:
+        - OperationsUser
+    '''
+
+    key = (realm_name, client_id)
+    user_client = _user_clients.get(key)
+    if user_client is None:
+        with _user_clients_lock:
+            user_client = _user_clients.get(key)
+            if user_client is None:
+                user_client = OperationsUser(client_id, realm_name, client_secret_key)
+                _user_clients[key] = user_client
+    return user_client
 
 
 class OperationsUser:
     def __init__(self, client_id, realm_name, client_secret_key):
+        self.client_id = client_id
+        self.client_secret_key = client_secret_key
+        self.openid_url = f'{ConfigSettings.KEYCLOAK_SERVER_URL}realms/{realm_name}/protocol/openid-connect'
         self.keycloak_openid = KeycloakOpenID(
             server_url=ConfigSettings.KEYCLOAK_SERVER_URL,
             client_id=client_id,
             realm_name=realm_name,
             client_secret_key=client_secret_key,
         )
-        self.config_well_know = self.keycloak_openid.well_know()
-        self.token = ''
+        self._well_know = None
+        self._well_know_expire_at = 0
+        self._well_know_lock = threading.Lock()
+
+    @property
+    def config_well_know(self) -> dict:
+        '''
+        Summary:
+            the openid discovery document of the realm. It is fetched on
+            first use and revalidated every KEYCLOAK_WELL_KNOWN_TTL seconds.
+            The previous document is kept if keycloak can not be reached
+
+        Return:
+            - discovery document(dict)
+        '''
+
+        if time.monotonic() >= self._well_know_expire_at:
+            with self._well_know_lock:
+                if time.monotonic() >= self._well_know_expire_at:
+                    try:
+                        self._well_know = self.keycloak_openid.well_know()
+                        self._well_know_expire_at = time.monotonic() + ConfigSettings.KEYCLOAK_WELL_KNOWN_TTL
+                    except Exception as e:
+                        if self._well_know is None:
+                            raise
+                        _logger.error('Fail to revalidate the openid configuration: ' + str(e))
+                        self._well_know_expire_at = time.monotonic() + ConfigSettings.KEYCLOAK_WELL_KNOWN_RETRY
+        return self._well_know
+
+    async def _token_request(self, payload: dict) -> dict:
+        '''
+        Summary:
+            call the token endpoint of the realm on the shared connection
+            pool with the client credentials added to the payload
+        '''
+
+        payload = {**payload, 'client_id': self.client_id}
+        if self.client_secret_key:
+            payload['client_secret'] = self.client_secret_key
+        client = get_keycloak_http_client()
+        api_res = await client.post(f'{self.openid_url}/token', data=payload)
+        return raise_error_from_response(api_res, exceptions.KeycloakGetError)
 
     # Get Token
-    def get_token(self, username, password):
-        self.token = self.keycloak_openid.token(username, password)
-        return self.token
+    async def get_token(self, username, password):
+        return await self._token_request({'grant_type': 'password', 'username': username, 'password': password})
 
     # Get Userinfo
-    def get_userinfo(self):
-        userinfo = self.keycloak_openid.userinfo(self.token['access_token'])
-        return userinfo
+    async def get_userinfo(self, token):
+        client = get_keycloak_http_client()
+        header = {'Authorization': 'Bearer ' + token['access_token']}
+        api_res = await client.get(f'{self.openid_url}/userinfo', headers=header)
+        return raise_error_from_response(api_res, exceptions.KeycloakGetError)
 
     # Refresh token
-    def get_refresh_token(self, token):
-        self.token = self.keycloak_openid.refresh_token(token)
-        return self.token
+    async def get_refresh_token(self, token):
+        return await self._token_request({'grant_type': 'refresh_token', 'refresh_token': token})
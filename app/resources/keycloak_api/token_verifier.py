@@ -0,0 +1,154 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import threading
+import time
+
+from jose import jwt
+from jose.exceptions import JWTClaimsError, JWTError
+from keycloak import exceptions
+from keycloak.exceptions import raise_error_from_response
+
+from app.config import ConfigSettings
+from app.resources.keycloak_api.http_client import get_keycloak_http_client
+
+_token_verifiers = {}
+_token_verifiers_lock = threading.Lock()
+
+
+def get_token_verifier(realm_name: str = ConfigSettings.KEYCLOAK_REALM) -> 'TokenVerifier':
+    '''
+    Summary:
+        Return the token verifier shared by the worker for the target realm
+
+    Parameter:
+        - realm_name(string): the realm in keycloak
+
+    Return:
+        - TokenVerifier
+    '''
+
+    token_verifier = _token_verifiers.get(realm_name)
+    if token_verifier is None:
+        with _token_verifiers_lock:
+            token_verifier = _token_verifiers.get(realm_name)
+            if token_verifier is None:
+                token_verifier = TokenVerifier(realm_name)
+                _token_verifiers[realm_name] = token_verifier
+    return token_verifier
+
+
+class TokenVerifier:
+    '''
+    Summary:
+        Validate the access tokens issued by the realm locally. The signing
+        keys (JWKS) are cached and reloaded every KEYCLOAK_JWKS_TTL seconds
+        or when a token is signed by a key that is not known yet
+    '''
+
+    def __init__(self, realm_name: str, server_url: str = ConfigSettings.KEYCLOAK_SERVER_URL):
+        self.realm_name = realm_name
+        self.issuer = ConfigSettings.KEYCLOAK_TOKEN_ISSUER or f'{server_url}realms/{realm_name}'
+        self.jwks_url = f'{server_url}realms/{realm_name}/protocol/openid-connect/certs'
+
+        self._keys = {}
+        self._keys_expire_at = 0
+        self._keys_loaded_at = 0
+        self._keys_lock = None
+
+    async def _load_keys(self, force: bool = False) -> None:
+        '''
+        Summary:
+            fetch the JWKS of the realm. A forced reload (unknown key id)
+            is throttled so random key ids can not flood keycloak
+        '''
+
+        if self._keys_lock is None:
+            self._keys_lock = asyncio.Lock()
+
+        async with self._keys_lock:
+            now = time.monotonic()
+            if force:
+                if now - self._keys_loaded_at < ConfigSettings.KEYCLOAK_JWKS_MIN_REFRESH_INTERVAL:
+                    return
+            elif now < self._keys_expire_at:
+                return
+
+            client = get_keycloak_http_client()
+            api_res = await client.get(self.jwks_url)
+            jwks = raise_error_from_response(api_res, exceptions.KeycloakGetError)
+            self._keys = {key['kid']: key for key in jwks.get('keys', []) if key.get('use', 'sig') == 'sig'}
+            self._keys_loaded_at = now
+            self._keys_expire_at = now + ConfigSettings.KEYCLOAK_JWKS_TTL
+
+    async def get_signing_key(self, kid: str) -> dict:
+        '''
+        Summary:
+            return the public key in JWK format for the key id
+
+        Parameter:
+            - kid(string): the key id from the token header
+
+        Return:
+            - key(dict)
+        '''
+
+        await self._load_keys()
+        key = self._keys.get(kid)
+        if key is None:
+            # the realm keys were rotated since the last load
+            await self._load_keys(force=True)
+            key = self._keys.get(kid)
+        if key is None:
+            raise JWTError('Unknown signing key %s' % kid)
+        return key
+
+    async def verify(self, token: str) -> dict:
+        '''
+        Summary:
+            validate the signature, expiry and issuer of the access token.
+            the algorithm must be one of KEYCLOAK_TOKEN_ALGORITHMS, the
+            token type Bearer and the token issued for the audience or
+            an authorized party so the id tokens and the tokens of the
+            other clients are refused
+
+        Parameter:
+            - token(string): the access token
+
+        Return:
+            - claims(dict): the decoded token
+        '''
+
+        header = jwt.get_unverified_header(token)
+        key = await self.get_signing_key(header.get('kid'))
+        algorithms = [x.strip() for x in ConfigSettings.KEYCLOAK_TOKEN_ALGORITHMS.split(',') if x.strip()]
+        audience = ConfigSettings.KEYCLOAK_TOKEN_AUDIENCE or None
+        claims = jwt.decode(
+            token,
+            key,
+            algorithms=algorithms,
+            audience=audience,
+            issuer=self.issuer,
+            options={'verify_aud': audience is not None, 'verify_at_hash': False},
+        )
+
+        if claims.get('typ') != 'Bearer':
+            raise JWTClaimsError('Invalid token type %s' % claims.get('typ'))
+        if audience is None:
+            parties = ConfigSettings.KEYCLOAK_TOKEN_AUTHORIZED_PARTIES or ConfigSettings.KEYCLOAK_CLIENT_ID
+            if claims.get('azp') not in [x.strip() for x in parties.split(',')]:
+                raise JWTClaimsError('Invalid authorized party %s' % claims.get('azp'))
+        return claims
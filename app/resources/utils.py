@@ -13,6 +13,8 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import base64
+import json
 from datetime import datetime
 
 import requests
@@ -32,3 +34,37 @@ def get_formatted_datetime(tz):
     cet = timezone(tz)
     now = datetime.now(cet)
     return now.strftime('%Y-%m-%d, %-I:%M%p (%Z)')
+
+
+def encode_cursor(values: list) -> str:
+    '''
+    Summary:
+        encode the sort key of the last returned row into an opaque
+        cursor for the keyset pagination
+
+    Parameter:
+        - values(list): the json serializable sort key
+
+    Return:
+        - cursor(string)
+    '''
+
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    '''
+    Summary:
+        decode the cursor generated by encode_cursor
+
+    Parameter:
+        - cursor(string): the opaque cursor from the previous page
+
+    Return:
+        - values(list): the sort key of the last returned row
+    '''
+
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError('invalid cursor %s' % cursor)
@@ -17,6 +17,7 @@ import httpx
 from common import LoggerFactory
 from fastapi import APIRouter
 from fastapi_utils import cbv
+from starlette.concurrency import run_in_threadpool
 
 from app.commons.psql_services.invitation import create_invite
 from app.commons.psql_services.user_event import create_event
@@ -24,9 +25,9 @@ from app.config import ConfigSettings
 from app.models.accounts import AccountRequestPOST, ContractRequestPOST
 from app.models.api_response import APIResponse, EAPIResponseCode
 from app.resources.error_handler import APIException, catch_internal
-from app.resources.keycloak_api.ops_admin import OperationsAdmin
+from app.resources.keycloak_api.ops_admin import get_admin_client
 from app.resources.utils import get_formatted_datetime
-from app.services.data_providers.ldap_client import LdapClient
+from app.services.data_providers.ldap_async import AsyncLdapClient
 from app.services.notifier_services.email_service import SrvEmail
 
 # from flask import request
@@ -44,11 +45,11 @@ logger = LoggerFactory(_API_NAMESPACE).get_logger()
 # THE api is used directly from frontend to create test account
 @cbv.cbv(router)
 class AccountRequest:
-    def is_duplicate_user(self, username: str, email: str) -> bool:
+    async def is_duplicate_user(self, username: str, email: str) -> bool:
 
         # get user all roles
-        admin_client = OperationsAdmin(ConfigSettings.KEYCLOAK_REALM)
-        user_info = admin_client.get_user_by_email(email)
+        admin_client = get_admin_client(ConfigSettings.KEYCLOAK_REALM)
+        user_info = await admin_client.get_user_by_email(email)
         # if user not exist then return false to proceed the user
         # account request flow
         if not user_info:
@@ -57,7 +58,7 @@ class AccountRequest:
         # now will mapping the test project role to see if user
         # has any of them if no send the email. if yes raise the
         # duplicate error
-        realm_roles = admin_client.get_user_realm_roles(user_info.get('id'))
+        realm_roles = await admin_client.get_user_realm_roles(user_info.get('id'))
         test_project_role = [
             ConfigSettings.TEST_PROJECT_CODE + '-admin',
             ConfigSettings.TEST_PROJECT_CODE + '-collaborator',
@@ -125,13 +126,13 @@ class AccountRequest:
         logger.info(f'TestRequest called: {username}')
 
         email_service = SrvEmail()
-        if self.is_duplicate_user(username, email):
+        if await self.is_duplicate_user(username, email):
             res.error_msg = 'duplicate user'
             res.code = EAPIResponseCode.bad_request
             return res.json_response()
 
-        ldap_client = LdapClient()
-        user_dn, user_data = ldap_client.get_user_by_username(username)
+        async with AsyncLdapClient() as ldap_client:
+            user_dn, user_data = await ldap_client.get_user_by_username(username)
 
         # User not found, send alert to support
         if not user_dn:
@@ -182,14 +183,18 @@ class AccountRequest:
             logger.info(f'User found in AD, email matches: {username}')
 
             try:
-                ldap_user_group = ldap_client.format_group_dn(ConfigSettings.LDAP_USER_GROUP)
-                ldap_client.add_user_to_group(user_dn, ldap_user_group)
-                project_group = ldap_client.format_group_dn(ConfigSettings.TEST_PROJECT_CODE)
-                ldap_client.add_user_to_group(user_dn, project_group)
+                async with AsyncLdapClient() as ldap_client:
+                    ldap_user_group = ldap_client.format_group_dn(ConfigSettings.LDAP_USER_GROUP)
+                    project_group = ldap_client.format_group_dn(ConfigSettings.TEST_PROJECT_CODE)
+                    results = await ldap_client.modify_group_members(
+                        [('add', user_dn, ldap_user_group), ('add', user_dn, project_group)]
+                    )
+                failed = [x for x in results if x['status'] not in ('success', 'conflict')]
+                if failed:
+                    raise Exception(str(failed))
             except Exception as e:
                 error_msg = f'Error adding user to AD group: {str(e)}'
                 logger.error(error_msg)
-                ldap_client.disconnect()
                 raise APIException(status_code=EAPIResponseCode.internal_error.value, error_msg=error_msg)
 
             invite_data = {
@@ -200,7 +205,7 @@ class AccountRequest:
                 "project_code": ConfigSettings.TEST_PROJECT_CODE,
                 "status": "pending",
             }
-            invite = create_invite(invite_data)
+            invite = await run_in_threadpool(create_invite, invite_data)
 
             event_detail = {
                 "operator": username,
@@ -212,7 +217,8 @@ class AccountRequest:
                     "project_code": ConfigSettings.TEST_PROJECT_CODE,
                 }
             }
-            create_event(event_detail)
+            # written right away so completing the invitation always finds it
+            await create_event(event_detail)
 
             email_service.send(
                 subject='Auto-Notification: Request for a Test Account Approved',
@@ -283,7 +289,6 @@ class AccountRequest:
                 },
             )
             res.result = 'Request for a test account is under review'
-        ldap_client.disconnect()
         return res.json_response()
 
 
@@ -21,7 +21,7 @@ import math
 
 from app.commons.psql_services.user_event import create_event, query_events
 from app.config import ConfigSettings
-from app.models.api_response import APIResponse, EAPIResponseCode
+from app.models.api_response import APIResponse, CursorAPIResponse, EAPIResponseCode
 from app.models.events import EventPOST, EventPOSTResponse, EventGETResponse, EventList
 from app.resources.keycloak_api.ops_admin import OperationsAdmin
 
@@ -40,7 +40,7 @@ class UserEvent:
         summary='Creates a new event',
         tags=[_API_TAG]
     )
-    def create_event(self, data: EventPOST):
+    async def create_event(self, data: EventPOST):
         """
             Create event in psql event table of actions on user account such as invites or roles changes.
         """
@@ -55,7 +55,7 @@ class UserEvent:
             "event_type": data.event_type,
             "detail": data.detail,
         }
-        event_obj = create_event(event_data)
+        event_obj = await create_event(event_data)
         api_response.result = event_obj.to_dict()
         return api_response.json_response()
 
@@ -69,9 +69,11 @@ class UserEvent:
     def list_events(self, data: EventList = Depends(EventList)):
         """
             Lists events from psql event table of actions on user account such as invites or roles changes.
+            Pass the next_cursor of the previous page as cursor to get the next page without an offset,
+            with exact_total=false the total is estimated instead of counted.
         """
         self._logger.info('Called list_events')
-        api_response = APIResponse()
+        api_response = CursorAPIResponse()
         query = {}
         if data.user_id:
             query["target_user_id"] = data.user_id
@@ -79,9 +81,12 @@ class UserEvent:
             query["project_code"] = data.project_code
         if data.invitation_id:
             query["invitation_id"] = data.invitation_id
-        event_list, total = query_events(query, data.page, data.page_size, data.order_type, data.order_by)
+        event_list, total, next_cursor = query_events(
+            query, data.page, data.page_size, data.order_type, data.order_by, data.cursor, data.exact_total
+        )
         api_response.page = data.page
         api_response.total = total
         api_response.num_of_pages = math.ceil(total / data.page_size)
+        api_response.next_cursor = next_cursor
         api_response.result = [i.to_dict() for i in event_list]
         return api_response.json_response()
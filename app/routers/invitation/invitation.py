@@ -19,19 +19,21 @@ from common import LoggerFactory
 from fastapi import APIRouter
 from fastapi_sqlalchemy import db
 from fastapi_utils.cbv import cbv
+from starlette.concurrency import run_in_threadpool
 
 from app.commons.project_services import get_project_by_code
-from app.commons.psql_services.invitation import create_invite, query_invites
+from app.commons.psql_services.invitation import create_invite, query_invites, update_invite
+from app.commons.psql_services.pagination import count_rows, paginate
 from app.commons.psql_services.user_event import create_event, update_event
 from app.config import ConfigSettings
-from app.models.api_response import APIResponse, EAPIResponseCode
+from app.models.api_response import APIResponse, CursorAPIResponse, EAPIResponseCode
 from app.models.invitation import (InvitationListPOST, InvitationPOST,
                                    InvitationPOSTResponse, InvitationPUT)
 from app.models.sql_invitation import InvitationModel
 from app.resources.error_handler import APIException
-from app.resources.keycloak_api.ops_admin import OperationsAdmin
+from app.resources.keycloak_api.ops_admin import get_admin_client
 from app.routers.invitation.invitation_notify import send_emails
-from app.services.data_providers.ldap_client import LdapClient
+from app.services.data_providers.ldap_async import AsyncLdapClient
 
 router = APIRouter()
 
@@ -61,13 +63,13 @@ class Invitation:
             if relation_data.get('project_code'):
                 project = await get_project_by_code(relation_data.get('project_code'))
             query = {'project_code': project['code'], 'email': email}
-            if query_invites(query):
+            if await run_in_threadpool(query_invites, query):
                 res.result = 'Invitation for this user already exists'
                 res.code = EAPIResponseCode.conflict
                 return res.json_response()
 
-        admin_client = OperationsAdmin(ConfigSettings.KEYCLOAK_REALM)
-        if admin_client.get_user_by_email(email):
+        admin_client = get_admin_client(ConfigSettings.KEYCLOAK_REALM)
+        if await admin_client.get_user_by_email(email):
             self._logger.info('User already exists in platform')
             res.result = '[ERROR] User already exists in platform'
             res.code = EAPIResponseCode.bad_request
@@ -75,18 +77,19 @@ class Invitation:
 
         account_in_ad = False
         if ConfigSettings.ENABLE_ACTIVE_DIRECTORY:
-            ldap_cli = LdapClient()
-            account_in_ad = ldap_cli.is_account_in_ad(email)
-            if account_in_ad:
-                group_dn = ldap_cli.format_group_dn(ConfigSettings.AD_USER_GROUP)
-                user_dn, _ = ldap_cli.get_user_by_email(email)
-                ldap_cli.add_user_to_group(user_dn, group_dn)
-                if platform_role == 'admin':
-                    group_dn = ldap_cli.format_group_dn(ConfigSettings.AD_ADMIN_GROUP)
-                    ldap_cli.add_user_to_group(user_dn, group_dn)
-                elif relation_data:
-                    group_dn = ldap_cli.format_group_dn(project['code'])
-                    ldap_cli.add_user_to_group(user_dn, group_dn)
+            async with AsyncLdapClient() as ldap_cli:
+                account_in_ad = await ldap_cli.is_account_in_ad(email)
+                if account_in_ad:
+                    group_dns = [ldap_cli.format_group_dn(ConfigSettings.AD_USER_GROUP)]
+                    user_dn, _ = await ldap_cli.get_user_by_email(email)
+                    if platform_role == 'admin':
+                        group_dns.append(ldap_cli.format_group_dn(ConfigSettings.AD_ADMIN_GROUP))
+                    elif relation_data:
+                        group_dns.append(ldap_cli.format_group_dn(project['code']))
+                    results = await ldap_cli.modify_group_members([('add', user_dn, x) for x in group_dns])
+                    failed = [x for x in results if x['status'] not in ('success', 'conflict')]
+                    if failed:
+                        raise Exception(f'failed to add the user to ad groups: {failed}')
 
         model_data = {
             'email': email,
@@ -97,7 +100,7 @@ class Invitation:
         }
         if project:
             model_data['project_code'] = project['code']
-        invitation_entry = create_invite(model_data)
+        invitation_entry = await run_in_threadpool(create_invite, model_data)
 
         event_detail = {
             "operator": invitation_entry.invited_by,
@@ -110,8 +113,9 @@ class Invitation:
         if project:
             event_detail["detail"]["project_role"] = invitation_entry.project_role
             event_detail["detail"]["project_code"] = project["code"]
-        create_event(event_detail)
-        send_emails(invitation_entry, project, account_in_ad)
+        # written right away so completing the invitation always finds it
+        await create_event(event_detail)
+        await send_emails(invitation_entry, project, account_in_ad)
         res.result = 'success'
         return res.json_response()
 
@@ -124,8 +128,8 @@ class Invitation:
     async def check_user(self, email: str, project_code: str = ''):
         self._logger.info('Called check_user')
         res = APIResponse()
-        admin_client = OperationsAdmin(ConfigSettings.KEYCLOAK_REALM)
-        user_info = admin_client.get_user_by_email(email)
+        admin_client = get_admin_client(ConfigSettings.KEYCLOAK_REALM)
+        user_info = await admin_client.get_user_by_email(email)
         project = None
         if not user_info:
             invite = db.session.query(InvitationModel).filter_by(email=email, status="pending").first()
@@ -142,7 +146,7 @@ class Invitation:
         if project_code:
             project = await get_project_by_code(project_code)
 
-        roles = admin_client.get_user_realm_roles(user_info['id'])
+        roles = await admin_client.get_user_realm_roles(user_info['id'])
         platform_role = 'member'
         project_role = ''
         for role in roles:
@@ -172,7 +176,7 @@ class Invitation:
     )
     def invitation_list(self, data: InvitationListPOST):
         self._logger.info('Called invitation_list')
-        res = APIResponse()
+        res = CursorAPIResponse()
         query = {}
         for field in ['project_code', 'status']:
             if data.filters.get(field):
@@ -182,12 +186,18 @@ class Invitation:
             for field in ['email', 'invited_by']:
                 if data.filters.get(field):
                     invites = invites.filter(getattr(InvitationModel, field).like('%' + data.filters[field] + '%'))
-            if data.order_type == 'desc':
-                sort_param = getattr(InvitationModel, data.order_by).desc()
-            else:
-                sort_param = getattr(InvitationModel, data.order_by).asc()
-            count = invites.count()
-            invites = invites.order_by(sort_param).offset(data.page * data.page_size).limit(data.page_size).all()
+            count = count_rows(invites, data.exact_total)
+            invites, next_cursor = paginate(
+                invites,
+                getattr(InvitationModel, data.order_by),
+                InvitationModel.id,
+                data.order_type,
+                data.page,
+                data.page_size,
+                data.cursor,
+            )
+        except ValueError as e:
+            raise APIException(status_code=EAPIResponseCode.bad_request.value, error_msg=str(e))
         except Exception as e:
             error_msg = f'Error querying invite for listing in psql: {str(e)}'
             self._logger.error(error_msg)
@@ -197,6 +207,7 @@ class Invitation:
         res.page = data.page
         res.num_of_pages = math.ceil(count / data.page_size)
         res.total = count
+        res.next_cursor = next_cursor
         return res.json_response()
 
     @router.put(
@@ -205,7 +216,7 @@ class Invitation:
         summary='update a single invite',
         tags=[_API_TAG]
     )
-    def invitation_update(self, invite_id: str, data: InvitationPUT):
+    async def invitation_update(self, invite_id: str, data: InvitationPUT):
         self._logger.info('Called invitation_update')
         res = APIResponse()
         update_data = {}
@@ -215,16 +226,14 @@ class Invitation:
         query = {"id": invite_id}
         if data.status == "complete":
             # update user event entry to add the target_user
-            invite = db.session.query(InvitationModel).filter_by(**query).first()
-            admin_client = OperationsAdmin(ConfigSettings.KEYCLOAK_REALM)
-            user = admin_client.get_user_by_email(invite.email)
-            update_event({"invitation_id": invite_id}, {"target_user": user["username"], "target_user_id": user["id"]})
-        try:
-            db.session.query(InvitationModel).filter_by(**query).update(update_data)
-            db.session.commit()
-        except Exception as e:
-            error_msg = f'Error updating invite in psql: {str(e)}'
-            self._logger.error(error_msg)
-            raise APIException(status_code=EAPIResponseCode.internal_error.value, error_msg=error_msg)
+            invite = (await run_in_threadpool(query_invites, query))[0]
+            admin_client = get_admin_client(ConfigSettings.KEYCLOAK_REALM)
+            user = await admin_client.get_user_by_email(invite.email)
+            await run_in_threadpool(
+                update_event,
+                {"invitation_id": invite_id},
+                {"target_user": user["username"], "target_user_id": user["id"]},
+            )
+        await run_in_threadpool(update_invite, query, update_data)
         res.result = "success"
         return res.json_response()
@@ -19,18 +19,18 @@ from common import LoggerFactory
 
 from app.config import ConfigSettings
 from app.models.sql_invitation import InvitationModel
-from app.resources.keycloak_api.ops_admin import OperationsAdmin
+from app.resources.keycloak_api.ops_admin import get_admin_client
 from app.services.notifier_services.email_service import SrvEmail
 
 _logger = LoggerFactory('api_invitation').get_logger()
 
 
-def send_emails(invitation_entry: InvitationModel, project: dict, account_in_ad: bool):
+async def send_emails(invitation_entry: InvitationModel, project: dict, account_in_ad: bool):
     _logger.info('Called send_emails')
     email_sender = SrvEmail()
 
-    admin_client = OperationsAdmin(ConfigSettings.KEYCLOAK_REALM)
-    inviter_entry = admin_client.get_user_by_username(invitation_entry.invited_by)
+    admin_client = get_admin_client(ConfigSettings.KEYCLOAK_REALM)
+    inviter_entry = await admin_client.get_user_by_username(invitation_entry.invited_by)
 
     template_kwargs = {
         'inviter_email': inviter_entry['email'],
@@ -30,7 +30,8 @@ from app.models.ops_admin import (
     UserOpsPOST,
 )
 from app.resources.error_handler import catch_internal
-from app.resources.keycloak_api.ops_admin import OperationsAdmin
+from app.resources.keycloak_api.attribute_buffer import get_attribute_buffer
+from app.resources.keycloak_api.ops_admin import get_admin_client
 
 # from users import api
 
@@ -64,17 +65,17 @@ class UserOps:
 
         res = APIResponse()
         try:
-            admin_client = OperationsAdmin(ConfigSettings.KEYCLOAK_REALM)
+            admin_client = get_admin_client(ConfigSettings.KEYCLOAK_REALM)
 
             # search the user by given input. Raise the exception
             # if ALL three inputs are missing
             user_info = None
             if email:
-                user_info = admin_client.get_user_by_email(email)
+                user_info = await admin_client.get_user_by_email(email)
             elif username:
-                user_info = admin_client.get_user_by_username(username)
+                user_info = await admin_client.get_user_by_username(username)
             elif user_id:
-                user_info = admin_client.get_user_by_id(user_id)
+                user_info = await admin_client.get_user_by_id(user_id)
             else:
                 res.error_msg = 'One of email, username, user_id is mandetory'
                 res.code = EAPIResponseCode.bad_request
@@ -102,10 +103,8 @@ class UserOps:
                 user_attribute.update({'status': 'pending'})
             user_info.update({'attributes': user_attribute})
 
-            # also use the realm roles to match if user is platform admin
-            realm_roles = admin_client.get_user_realm_roles(user_info.get('id'))
-            platform_admin = [r for r in realm_roles if r.get('name') == 'platform-admin']
-            if platform_admin:
+            # also match the user against the platform admins
+            if await admin_client.is_platform_admin(user_info.get('id')):
                 user_info.update({'role': 'admin'})
             else:
                 user_info.update({'role': 'member'})
@@ -160,8 +159,11 @@ class UserOps:
             return res.json_response()
 
         try:
-            admin_client = OperationsAdmin(ConfigSettings.KEYCLOAK_REALM)
-            user_id = admin_client.get_user_id(username)
+            admin_client = get_admin_client(ConfigSettings.KEYCLOAK_REALM)
+            user_id = await admin_client.get_user_id(username)
+
+            if user_id is None:
+                raise exceptions.KeycloakGetError('User %s is not found' % username, response_code=404)
 
             # update the attribute if payload is not None
             attri = {}
@@ -172,7 +174,13 @@ class UserOps:
             # update the announce as announcement_<project_code>: <announcement_pk>
             if announcement:
                 attri.update({'announcement_' + announcement.project_code: announcement.announcement_pk})
-            new_attribute = admin_client.update_user_attributes(user_id, attri)
+                # write the pending attributes of the user along with the announcement
+                pending = get_attribute_buffer().take(user_id)
+                new_attribute = await admin_client.update_user_attributes(user_id, {**pending, **attri})
+            else:
+                # only last_login, which can be written behind
+                get_attribute_buffer().add(user_id, attri)
+                new_attribute = attri
 
             res.result = new_attribute
             res.code = EAPIResponseCode.success
@@ -210,15 +218,15 @@ class UserGroup:
             username = data.username
             groupname = data.groupname
 
-            operations_admin = OperationsAdmin(ConfigSettings.KEYCLOAK_REALM)
-            user_id = operations_admin.get_user_id(username)
-            group = operations_admin.get_group_by_name(groupname)
+            operations_admin = get_admin_client(ConfigSettings.KEYCLOAK_REALM)
+            user_id = await operations_admin.get_user_id(username)
+            group = await operations_admin.get_group_by_name(groupname)
             # create the group in keycloak if not exist
             if not group:
-                operations_admin.create_group(groupname)
-                group = operations_admin.get_group_by_name(groupname)
+                await operations_admin.create_group(groupname)
+                group = await operations_admin.get_group_by_name(groupname)
 
-            operations_admin.add_user_to_group(user_id, group['id'])
+            await operations_admin.add_user_to_group(user_id, group['id'])
             res.result = 'success'
             res.code = EAPIResponseCode.success
         except Exception as e:
@@ -249,10 +257,10 @@ class UserGroup:
             realm = ConfigSettings.KEYCLOAK_REALM
 
             # remove the user from target group
-            operations_admin = OperationsAdmin(realm)
-            user_id = operations_admin.get_user_id(username)
-            group = operations_admin.get_group_by_name(groupname)
-            operations_admin.remove_user_from_group(user_id, group['id'])
+            operations_admin = get_admin_client(realm)
+            user_id = await operations_admin.get_user_id(username)
+            group = await operations_admin.get_group_by_name(groupname)
+            await operations_admin.remove_user_from_group(user_id, group['id'])
 
             res.result = 'success'
             res.code = EAPIResponseCode.success
@@ -285,10 +293,10 @@ class RealmRoles:
         res = APIResponse()
         try:
             # admin operator to get the user's realm roles
-            operations_admin = OperationsAdmin(ConfigSettings.KEYCLOAK_REALM)
-            user_id = operations_admin.get_user_by_username(username).get('id')
+            operations_admin = get_admin_client(ConfigSettings.KEYCLOAK_REALM)
+            user_id = (await operations_admin.get_user_by_username(username)).get('id')
 
-            res.result = operations_admin.get_user_realm_roles(user_id)
+            res.result = await operations_admin.get_user_realm_roles(user_id)
             res.code = EAPIResponseCode.success
         except Exception as e:
             res.error_msg = f'get realm roles in keycloak failed: {e}'
@@ -318,8 +326,8 @@ class RealmRoles:
             project_roles = data.project_roles
             project_code = data.project_code
             # loop over the input roles and add user to it one by one
-            operations_admin = OperationsAdmin(ConfigSettings.KEYCLOAK_REALM)
-            keycloak_res = operations_admin.create_project_realm_roles(project_roles, project_code)
+            operations_admin = get_admin_client(ConfigSettings.KEYCLOAK_REALM)
+            keycloak_res = await operations_admin.create_project_realm_roles(project_roles, project_code)
 
             res.result = 'success'
             res.code = EAPIResponseCode.success
@@ -374,10 +382,10 @@ class UserInRole:
         total_users = 0
         try:
             # intialize the keycloak admin to get token
-            admin_client = OperationsAdmin(ConfigSettings.KEYCLOAK_REALM)
+            admin_client = get_admin_client(ConfigSettings.KEYCLOAK_REALM)
             user_list = []
             for role in data.role_names:
-                user_in_role = admin_client.get_users_in_role(role)
+                user_in_role = await admin_client.get_users_in_role(role)
 
                 # then return only certain of attributes to frontend
                 user_list += [
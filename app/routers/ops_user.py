@@ -20,31 +20,75 @@ from platform import platform
 
 import httpx
 import requests
+from common import LoggerFactory
 from fastapi import APIRouter
 from fastapi_utils import cbv
+from jose.exceptions import JWTError
 from keycloak import exceptions
 
+from app.commons.psql_services.event_queue import get_event_queue
+from app.commons.psql_services.users import USER_ORDER_FIELDS, query_users
 from app.config import ConfigSettings
-from app.models.api_response import APIResponse, EAPIResponseCode
+from app.models.api_response import APIResponse, CursorAPIResponse, EAPIResponseCode
 from app.models.ops_user import (
     UserAuthPOST,
     UserProjectRoleDELETE,
     UserProjectRolePOST,
     UserProjectRolePUT,
     UserTokenRefreshPOST,
+    UserTokenVerifyPOST,
 )
-from app.resources.error_handler import catch_internal
-from app.resources.keycloak_api.ops_admin import OperationsAdmin
-from app.resources.keycloak_api.ops_user import OperationsUser
-from app.commons.psql_services.user_event import create_event
+from app.resources.error_handler import APIException, catch_internal
+from app.resources.keycloak_api.attribute_buffer import get_attribute_buffer
+from app.resources.keycloak_api.ops_admin import get_admin_client
+from app.resources.keycloak_api.ops_user import get_user_client
+from app.resources.keycloak_api.token_verifier import get_token_verifier
 
 router = APIRouter()
 _API_TAG = 'v1/auth'
 _API_NAMESPACE = 'api_auth'
 
+_logger = LoggerFactory(_API_NAMESPACE).get_logger()
+
 
 @cbv.cbv(router)
 class UserAuth:
+    async def get_login_status(self, token: dict, username: str) -> tuple:
+        '''
+        Summary:
+            return the id and the account status of the user who logged in.
+            If KEYCLOAK_LOGIN_STATUS_CLAIM is set the status is read from the
+            issued access token. Otherwise, or if the claim is missing or the
+            token can not be verified, the user is looked up with the admin api
+
+        Parameter:
+            - token(dict): the token response from keycloak
+            - username(string): the login string for user
+
+        Return:
+            - user_id(string), status(string)
+        '''
+
+        status_claim = ConfigSettings.KEYCLOAK_LOGIN_STATUS_CLAIM
+        if status_claim:
+            try:
+                claims = await get_token_verifier(ConfigSettings.KEYCLOAK_REALM).verify(token['access_token'])
+                status = claims.get(status_claim)
+                # the multivalued attribute mapper issues the claim as a list
+                if isinstance(status, list):
+                    status = status[0] if status else None
+                if status:
+                    return claims['sub'], status
+            except JWTError as e:
+                _logger.warning('Fail to decode the login token: ' + str(e))
+            except (exceptions.KeycloakError, httpx.HTTPError) as e:
+                # the signing keys could not be fetched, the admin api still knows the status
+                _logger.warning('Fail to verify the login token: ' + str(e))
+
+        admin_client = get_admin_client(ConfigSettings.KEYCLOAK_REALM)
+        user_info = await admin_client.get_user_by_username(username)
+        return user_info.get('id'), (user_info.get('attributes', {}).get('status') or ['disabled'])[0]
+
     @router.post('/users/auth', tags=[_API_TAG], summary='make the user authentication and return the access token')
     @catch_internal(_API_NAMESPACE)
     async def post(self, data: UserAuthPOST):
@@ -73,19 +117,17 @@ class UserAuth:
             client_secret = ConfigSettings.KEYCLOAK_SECRET
 
             # log in
-            user_client = OperationsUser(client_id, realm, client_secret)
-            admin_client = OperationsAdmin(ConfigSettings.KEYCLOAK_REALM)
-            token = user_client.get_token(username, password)
+            user_client = get_user_client(realm, client_id, client_secret)
+            token = await user_client.get_token(username, password)
             # block the login if user is disabled
-            user_info = admin_client.get_user_by_username(username)
-            if user_info.get('attributes', {}).get('status', ['disabled']) == ['disabled']:
+            user_id, status = await self.get_login_status(token, username)
+            if status == 'disabled':
                 raise exceptions.KeycloakAuthenticationError('User is disabled')
 
             # if authentication success update the user last login
             # time for displaying purpose
-            user_id = user_info.get('id')
             last_login = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S')
-            admin_client.update_user_attributes(user_id, {'last_login': last_login})
+            get_attribute_buffer().add(user_id, {'last_login': last_login})
 
             res.result = token
             res.code = EAPIResponseCode.success
@@ -128,8 +170,8 @@ class UserRefresh:
             realm = ConfigSettings.KEYCLOAK_REALM
             client_id = ConfigSettings.KEYCLOAK_CLIENT_ID
             client_secret = ConfigSettings.KEYCLOAK_SECRET
-            user_client = OperationsUser(client_id, realm, client_secret)
-            token = user_client.get_refresh_token(token)
+            user_client = get_user_client(realm, client_id, client_secret)
+            token = await user_client.get_refresh_token(token)
 
             res.result = token
             res.code = EAPIResponseCode.success
@@ -140,6 +182,45 @@ class UserRefresh:
         return res.json_response()
 
 
+@cbv.cbv(router)
+class UserTokenVerify:
+    @router.post('/users/token/verify', tags=[_API_TAG], summary='verify the access token and return its claims')
+    @catch_internal(_API_NAMESPACE)
+    async def post(self, data: UserTokenVerifyPOST):
+        '''
+        Summary:
+            The api is used to validate the access token locally with the
+            cached signing keys of the realm so the other services do not
+            need to call keycloak for every request
+
+        Payload:
+            - token(string): The access token issued by keycloak
+
+        Return:
+            - claims(dict): the decoded token
+            - realm_roles(list): the realm roles of the user
+        '''
+
+        res = APIResponse()
+        try:
+            token_verifier = get_token_verifier(ConfigSettings.KEYCLOAK_REALM)
+            claims = await token_verifier.verify(data.token)
+
+            res.result = {
+                'claims': claims,
+                'realm_roles': claims.get('realm_access', {}).get('roles', []),
+            }
+            res.code = EAPIResponseCode.success
+        except JWTError as e:
+            res.error_msg = f'Invalid token : {e}'
+            res.code = EAPIResponseCode.unauthorized
+        except Exception as e:
+            res.error_msg = f'Unable to verify token : {e}'
+            res.code = EAPIResponseCode.internal_error
+
+        return res.json_response()
+
+
 # this api is used by portal to add user into projects
 @cbv.cbv(router)
 class UserProjectRole:
@@ -165,19 +246,19 @@ class UserProjectRole:
 
         try:
             # use the admin client to grant the user realm role
-            admin_client = OperationsAdmin(ConfigSettings.KEYCLOAK_REALM)
-            user = admin_client.get_user_by_email(email)
-            roles = admin_client.get_user_realm_roles(user['id'])
+            admin_client = get_admin_client(ConfigSettings.KEYCLOAK_REALM)
+            user = await admin_client.get_user_by_email(email)
+            roles = await admin_client.get_user_realm_roles(user['id'])
 
             old_role = ""
             for role in roles:
                 if realm_role.split("-")[0] in role["name"]:
                     old_role = role["name"]
                     # remove old project role
-                    admin_client.delete_role_of_user(user['id'], role["name"])
+                    await admin_client.delete_role_of_user(user['id'], role["name"])
                     break
             # add new role
-            admin_client.assign_user_role(user['id'], realm_role)
+            await admin_client.assign_user_role(user['id'], realm_role)
 
             res.result = 'success'
             res.code = EAPIResponseCode.success
@@ -186,7 +267,7 @@ class UserProjectRole:
             res.error_msg = f'Fail to add user to group: {e}'
             res.code = EAPIResponseCode.internal_error
 
-        create_event({
+        await get_event_queue().add({
             "target_user_id": user["id"],
             "target_user": user["username"],
             "operator": data.operator,
@@ -224,9 +305,9 @@ class UserProjectRole:
 
         try:
             # use the admin client to grant the user realm role
-            admin_client = OperationsAdmin(ConfigSettings.KEYCLOAK_REALM)
-            user = admin_client.get_user_by_email(email)
-            admin_client.assign_user_role(user['id'], realm_role)
+            admin_client = get_admin_client(ConfigSettings.KEYCLOAK_REALM)
+            user = await admin_client.get_user_by_email(email)
+            await admin_client.assign_user_role(user['id'], realm_role)
 
             res.result = 'success'
             res.code = EAPIResponseCode.success
@@ -236,7 +317,7 @@ class UserProjectRole:
             res.code = EAPIResponseCode.internal_error
 
         if data.invite_event:
-            create_event({
+            await get_event_queue().add({
                 "target_user_id": user["id"],
                 "target_user": user["username"],
                 "operator": data.operator,
@@ -273,9 +354,9 @@ class UserProjectRole:
 
         try:
             # use the admin client to remove the user realm role
-            admin_client = OperationsAdmin(realm)
-            user = admin_client.get_user_by_email(email)
-            admin_client.delete_role_of_user(user['id'], project_role)
+            admin_client = get_admin_client(realm)
+            user = await admin_client.get_user_by_email(email)
+            await admin_client.delete_role_of_user(user['id'], project_role)
 
             res.result = 'success'
             res.code = EAPIResponseCode.success
@@ -283,7 +364,7 @@ class UserProjectRole:
             res.error_msg = f'Fail to remove user from group: {e}'
             res.code = EAPIResponseCode.internal_error
 
-        create_event({
+        await get_event_queue().add({
             "target_user_id": user["id"],
             "target_user": user["username"],
             "operator": data.operator,
@@ -309,18 +390,18 @@ class UserList:
         role: str = None,
         order_by: str = None,
         order_type: str = 'asc',
+        cursor: str = None,
     ):
-        res = APIResponse()
+        res = CursorAPIResponse()
 
         '''
         Summary:
-            The api is used to the keycloak api and python to list all
-            user under the platform.
-            for now the api does not support the exact search and status check
-            This will need to be wait until keycloak is upto v16
-            The native api does not support join/sorting, so I temporary do them manually
-            ALL the in memory sorting, searching, mapping are the temporary solution
-            at the end, they will be sync to some primary db
+            The api is used to list all user under the platform. The users
+            are queried from the local mirror of keycloak which is kept in
+            sync by the background user sync task.
+            The result is ordered by <order_by> and the user id. To walk
+            through the large list pass the next_cursor of the previous
+            page instead of the page number
 
         Parameter:
             - order_by(string optional): the field will be ordered by.
@@ -331,7 +412,9 @@ class UserList:
                 return all user contains target username.
             - email(string optional): if payload has email, the api will
                 return all user contains target email.
-            - status(string): not support yet
+            - status(string optional): the user status eg. active, disabled
+            - role(string optional): only return the platform admin if it is admin
+            - cursor(string optional): the next_cursor from the previous page
 
         Return:
             - user list
@@ -342,109 +425,40 @@ class UserList:
         '''
 
         try:
-            admin_client = OperationsAdmin(ConfigSettings.KEYCLOAK_REALM)
-            # get the total user count
-            total_users = admin_client.get_user_count()
-
-            # query = {
-            #     "max": total_users,
-            # }
-
-            # NOTE HERE: the keycloak api does not support sorting
-            # consider the amount of the user ~100. so I decide to use
-            # python to do the sorting
-            # if order_by:
-            #     query.update({
-            #         "first": 0,
-            #         "max": 1000,
-            #     })
-
-            # admin_client = OperationsAdmin(ConfigSettings.KEYCLOAK_REALM)
-            # # get the total user count
-            # total_users = admin_client.get_user_count(**query)
-            # get user detail\
-            users = None
-            if role == 'admin':
-                users = admin_client.get_users_in_role('platform-admin')
-            else:
-                users = admin_client.get_all_users(max=total_users)
-            user_list = [user for user in users if user.get('attributes', {}).get('status')]
-            if username:
-                user_list = [user for user in user_list if username in user.get('username')]
-            if email:
-                user_list = [user for user in user_list if email in user.get('email')]
-            if status:
-                user_list = [user for user in user_list if status in user.get('attributes', {}).get('status')]
-
-            # here since the keycloak is NOT supporting sorting
-            # manually sort the user by order_by and order_type
-            if order_by:
-                # since we use the snake case, here I will add a mapper to transfer
-                # the camelcase for the sorting. only the first_name&last_name will
-                # need the mapping, others keep the same
-                order_by = {
-                    'first_name': 'firstName',
-                    'last_name': 'lastName',
-                    'name': 'username',
-                }.get(order_by, order_by)
-
-                # field checking if orderby field does not exist return error
-                if not (
-                    order_by
-                    in ['id', 'username', 'lastName', 'firstName', 'email', 'username', 'time_created', 'last_login']
-                ):
-                    res.error_msg = 'the order_by %s field does not exist' % (order_by)
-                    res.code = EAPIResponseCode.bad_request
-                    return res.json_response()
-
-                # generate order lambda the special one is last_login_time
-                # this is attached to attribute so we have to get one more step
-                order_lambda = lambda user: user.get(order_by, '')
-                if order_by == 'last_login':
-                    order_lambda = lambda user: user.get('attributes').get('last_login', [''])[0]
-                elif order_by == 'time_created':
-                    order_lambda = lambda user: user.get('attributes').get('createTimestamp', [''])[0]
-
-                user_list = sorted(user_list, key=order_lambda, reverse=True if order_type == 'desc' else False)
-
-                # manually do the pagination
-                # user_list = user_list[page*page_size:(page+1)*page_size]
-
-            user_count = len(user_list)
-            # finally filter out only return certain attributes
-            # and do the pagination here
-            user_list = [
-                {
-                    'id': user.get('id'),
-                    'name': user.get('username'),
-                    'username': user.get('username'),
-                    'first_name': user.get('firstName'),
-                    'last_name': user.get('lastName'),
-                    'email': user.get('email'),
-                    'time_created': datetime.fromtimestamp(user.get('createdTimestamp', 0) // 1000).strftime(
-                        '%Y-%m-%dT%H:%M:%S'
-                    ),
-                    'last_login': user.get('attributes', {}).get('last_login', [None])[0],
-                    'status': user.get('attributes', {}).get('status', ['disabled'])[0],
-                }
-                for user in user_list[page * page_size : (page + 1) * page_size]
-            ]
-
-            # also manually do the platform admin check
-            platform_admins = [x.get('username') for x in admin_client.get_users_in_role('platform-admin')]
-            # then do the looping over to match the return with platform admin
-            # since the page is 10 and platform admin is ~10
-            for user in user_list:
-                if user.get('name') in platform_admins:
-                    user.update({'role': 'admin'})
-                else:
-                    user.update({'role': 'member'})
+            order_by = order_by or 'username'
+            if order_by not in USER_ORDER_FIELDS:
+                res.error_msg = 'the order_by %s field does not exist' % (order_by)
+                res.code = EAPIResponseCode.bad_request
+                return res.json_response()
+
+            admin_client = get_admin_client(ConfigSettings.KEYCLOAK_REALM)
+            platform_admins = await admin_client.get_platform_admins()
+
+            query = {'username': username, 'email': email, 'status': status}
+            users, user_count, next_cursor = query_users(
+                query,
+                order_by,
+                order_type,
+                page,
+                page_size,
+                cursor=cursor,
+                user_ids=list(platform_admins) if role == 'admin' else None,
+            )
+
+            user_list = []
+            for user in users:
+                user_info = user.to_dict()
+                user_info['role'] = 'admin' if user.id in platform_admins else 'member'
+                user_list.append(user_info)
 
             res.result = user_list
             res.total = user_count
             res.num_of_pages = math.ceil(user_count / page_size)
             res.page = page
+            res.next_cursor = next_cursor
 
+        except APIException:
+            raise
         except Exception as e:
             res.error_msg = str(e)
             res.code = EAPIResponseCode.internal_error
@@ -0,0 +1,123 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from collections import defaultdict, deque
+
+import casbin
+
+PLATFORM_ADMIN = 'platform_admin'
+# the default role manager of casbin follows at most 10 levels below the direct role
+MAX_ROLE_HOPS = 11
+# the subjects resolved per (sub, dom) are dropped when the table holds that many
+ROLE_CACHE_SIZE = 10000
+
+
+class DecisionTable:
+    '''
+    Summary:
+        the policy of model.conf compiled into dict lookups. It gives the
+        same decision as casbin for the matcher
+
+            (g(r.sub, p.sub, r.dom) || r.sub == 'platform_admin')
+            && (r.dom == p.dom || p.dom == '*' || r.dom == '*')
+            && r.obj == p.obj && (r.act == p.act || p.act == '*')
+
+        with the allow-override effect. The policy lines are indexed by
+        (obj, sub) then dom, the role links are kept as the keys of the
+        casbin role manager (<dom>::<name>) and walked once per subject
+        and domain
+    '''
+
+    def __init__(self, policy: list, grouping_policy: list):
+        # casbin evaluates the matcher once with empty values when there is no policy
+        if not policy:
+            policy = [['', '', '', '']]
+
+        # (obj, sub) -> dom -> actions
+        self._rules = defaultdict(lambda: defaultdict(set))
+        # obj -> dom -> actions, the rules of any subject for the platform admin
+        self._object_rules = defaultdict(lambda: defaultdict(set))
+        for rule in policy:
+            if len(rule) != 4:
+                raise ValueError(f'invalid policy size: {rule}')
+            sub, dom, obj, act = rule
+            self._rules[(obj, sub)][dom].add(act)
+            self._object_rules[obj][dom].add(act)
+
+        self._links = defaultdict(set)
+        for rule in grouping_policy:
+            if len(rule) < 3:
+                raise ValueError(f'grouping policy elements do not meet role definition: {rule}')
+            user, role, dom = rule[:3]
+            self._links[f'{dom}::{user}'].add(f'{dom}::{role}')
+
+        self._roles = {}
+
+    @classmethod
+    def from_enforcer(cls, enforcer: casbin.Enforcer) -> 'DecisionTable':
+        return cls(enforcer.model.model['p']['p'].policy, enforcer.model.model['g']['g'].policy)
+
+    def get_subjects(self, sub: str, dom: str) -> set:
+        '''
+        Summary:
+            the policy subjects matched by g(sub, p.sub, dom): the subject
+            itself and the roles it reaches in the domain
+
+        Return:
+            set of subject names
+        '''
+
+        key = (sub, dom)
+        subjects = self._roles.get(key)
+        if subjects is not None:
+            return subjects
+
+        start = f'{dom}::{sub}'
+        reached = set()
+        queue = deque([(start, 0)])
+        while queue:
+            name, hops = queue.popleft()
+            if hops == MAX_ROLE_HOPS:
+                continue
+            for role in self._links.get(name, ()):
+                if role not in reached:
+                    reached.add(role)
+                    queue.append((role, hops + 1))
+
+        prefix = f'{dom}::'
+        subjects = {sub} | {x[len(prefix) :] for x in reached if x.startswith(prefix)}
+        if len(self._roles) >= ROLE_CACHE_SIZE:
+            self._roles.clear()
+        self._roles[key] = subjects
+        return subjects
+
+    @staticmethod
+    def _allows(domains: dict, dom: str, act: str) -> bool:
+        if dom == '*':
+            candidates = domains.values()
+        else:
+            candidates = [domains[x] for x in (dom, '*') if x in domains]
+        return any(act in actions or '*' in actions for actions in candidates)
+
+    def enforce(self, sub: str, dom: str, obj: str, act: str) -> bool:
+        if sub == PLATFORM_ADMIN:
+            return obj in self._object_rules and self._allows(self._object_rules[obj], dom, act)
+
+        for subject in self.get_subjects(sub, dom):
+            domains = self._rules.get((obj, subject))
+            if domains and self._allows(domains, dom, act):
+                return True
+        return False
@@ -0,0 +1,420 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+import select as io_select
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, List, Tuple
+
+import casbin
+import casbin_sqlalchemy_adapter
+from common import LoggerFactory
+from sqlalchemy import and_, create_engine, or_, select
+
+from app.config import ConfigSettings
+from app.models.permissions import POLICY_CHANNEL, CasbinPolicyVersion, CasbinRule
+from app.resources.cache import TTLCache
+from app.routers.permissions.decision_table import DecisionTable
+
+MODEL_PATH = 'app/routers/permissions/model.conf'
+
+_engine = None
+_logger = LoggerFactory('policy_enforcer').get_logger()
+
+
+def get_sqlalchemy_engine():
+    """Get or create engine for sqlalchemy."""
+
+    global _engine
+
+    if _engine is None:
+        _engine = create_engine(ConfigSettings.RDS_DB_URI, max_overflow=10, pool_recycle=1800, pool_size=10)
+
+    return _engine
+
+
+class PolicyNotLoaded(Exception):
+    pass
+
+
+class ZoneFilter:
+    def __init__(self, zone: str):
+        self.zone = zone
+
+    def matches(self, ptype: str, rule: List[str]) -> bool:
+        if ptype == 'p':
+            return self.zone == '*' or rule[1] in [self.zone, '*']
+        return rule[2] == self.zone
+
+
+class ZoneAdapter(casbin_sqlalchemy_adapter.Adapter):
+    '''
+    Summary:
+        the adapter loading the rules a zone is checked against: the
+        policies of the zone and of '*' with the role links of the zone.
+        A check on the zone '*' matches the policies of every zone
+    '''
+
+    def __init__(self, engine):
+        super().__init__(engine, db_class=CasbinRule, filtered=True)
+
+    def filter_query(self, querydb, zone_filter: ZoneFilter):
+        if zone_filter.zone == '*':
+            policies = CasbinRule.ptype == 'p'
+        else:
+            policies = and_(CasbinRule.ptype == 'p', CasbinRule.v1.in_([zone_filter.zone, '*']))
+        grouping_policies = and_(CasbinRule.ptype == 'g', CasbinRule.v2 == zone_filter.zone)
+        return querydb.filter(or_(policies, grouping_policies)).order_by(CasbinRule.id)
+
+
+class PolicyShard:
+    __slots__ = ('zone', 'enforcer', 'decision_table', 'used_at')
+
+    def __init__(self, zone: str, enforcer: casbin.Enforcer, decision_table: DecisionTable):
+        self.zone = zone
+        self.enforcer = enforcer
+        self.decision_table = decision_table
+        self.used_at = time.monotonic()
+
+
+class PolicyEnforcer:
+    '''
+    Summary:
+        the casbin enforcer of the worker. The policy is loaded once and
+        kept in memory, it is reloaded when the version counter bumped
+        by the trigger on casbin_rule changes. The listener thread
+        reloads it on the notification of the trigger, the counter is
+        also read at most once every CASBIN_POLICY_CHECK_INTERVAL
+        seconds in case a notification is missed.
+        The decisions are cached with the policy version they were made
+        with, an entry of another version is never returned.
+        With CASBIN_POLICY_SHARDING_ENABLED only the rules of the zones
+        being checked are loaded, a zone is loaded on its first check
+        and dropped once unused for CASBIN_POLICY_SHARD_IDLE_TIMEOUT
+        seconds or when more than CASBIN_POLICY_SHARD_COUNT zones are
+        loaded. A policy change drops all the zones
+    '''
+
+    def __init__(self, model_path: str = MODEL_PATH):
+        self.model_path = model_path
+        self.version = None
+        self._enforcer = None
+        self._decision_table = None
+        self._shards = OrderedDict()
+        self._zone_adapter = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+        self._decisions = TTLCache(ConfigSettings.CASBIN_DECISION_CACHE_SIZE, ConfigSettings.CASBIN_DECISION_CACHE_TTL)
+        self._listener = None
+        self._stop_listening = threading.Event()
+        # set while the listener is subscribed to the policy channel
+        self._subscribed = threading.Event()
+
+    def get_version(self) -> int:
+        with get_sqlalchemy_engine().connect() as connection:
+            version = connection.execute(
+                select([CasbinPolicyVersion.version]).where(CasbinPolicyVersion.id == 1)
+            ).scalar()
+        return version or 0
+
+    def load(self) -> None:
+        '''
+        Summary:
+            load the whole policy into a new enforcer and swap it in, so
+            the checks running meanwhile keep using the previous one. The
+            zones loaded with sharding are dropped instead
+
+        Return:
+            None
+        '''
+
+        with self._lock:
+            # read the version first, a change during the load is picked up by the next check
+            version = self.get_version()
+            if ConfigSettings.CASBIN_POLICY_SHARDING_ENABLED:
+                # the zones are loaded again on their next check
+                self._enforcer, self._decision_table = None, None
+                self._shards.clear()
+            else:
+                adapter = casbin_sqlalchemy_adapter.Adapter(get_sqlalchemy_engine(), db_class=CasbinRule)
+                enforcer = casbin.Enforcer(self.model_path, adapter)
+                # swap the enforcer before the version, a decision is never tagged newer than its enforcer
+                self._enforcer, self._decision_table = enforcer, self._compile(enforcer)
+            self.version = version
+            self._decisions.clear()
+            self._checked_at = time.monotonic()
+        _logger.info(f'Loaded casbin policy version {version}')
+
+    def _compile(self, enforcer: casbin.Enforcer) -> DecisionTable:
+        if not ConfigSettings.CASBIN_DECISION_TABLE_ENABLED:
+            return None
+        try:
+            return DecisionTable.from_enforcer(enforcer)
+        except ValueError as e:
+            _logger.warning(f'Fall back to the casbin matcher: {e}')
+            return None
+
+    def load_shard(self, zone: str) -> PolicyShard:
+        '''
+        Summary:
+            load the rules of the zone
+
+        Parameter:
+            - zone(str): the zone of the checks
+
+        Return:
+            the shard of the zone
+        '''
+
+        with self._lock:
+            shard = self._shards.get(zone)
+            if shard is not None:
+                return shard
+            if self._zone_adapter is None:
+                self._zone_adapter = ZoneAdapter(get_sqlalchemy_engine())
+            enforcer = casbin.Enforcer(self.model_path, self._zone_adapter)
+            enforcer.load_filtered_policy(ZoneFilter(zone))
+            shard = PolicyShard(zone, enforcer, self._compile(enforcer))
+            self._shards[zone] = shard
+            self._evict_shards()
+        _logger.info(f'Loaded casbin policy of zone {zone}')
+        return shard
+
+    def _evict_shards(self) -> None:
+        expire_before = time.monotonic() - ConfigSettings.CASBIN_POLICY_SHARD_IDLE_TIMEOUT
+        # the last shard is the one in use
+        while len(self._shards) > 1:
+            zone, shard = next(iter(self._shards.items()))
+            if len(self._shards) <= ConfigSettings.CASBIN_POLICY_SHARD_COUNT and shard.used_at >= expire_before:
+                break
+            del self._shards[zone]
+
+    def _get_shard(self, zone: str) -> PolicyShard:
+        with self._lock:
+            shard = self._shards.get(zone)
+            if shard is not None:
+                shard.used_at = time.monotonic()
+                self._shards.move_to_end(zone)
+                self._evict_shards()
+            return shard
+
+    def _apply_rules(self, enforcer: casbin.Enforcer, delta: dict, zone: str = None) -> casbin.Enforcer:
+        updated = casbin.Enforcer(self.model_path)
+        zone_filter = None if zone is None else ZoneFilter(zone)
+        for ptype in ['p', 'g']:
+            rules = [x for x in delta[ptype] if zone_filter is None or zone_filter.matches(ptype, x)]
+            policy = enforcer.get_model().get_policy(ptype, ptype)
+            if delta['operation'] == 'add':
+                policy = policy + rules
+            else:
+                removed = {tuple(x) for x in rules}
+                policy = [x for x in policy if tuple(x) not in removed]
+            updated.get_model().model[ptype][ptype].policy = policy
+        updated.build_role_links()
+        return updated
+
+    def apply_delta(self, delta: dict) -> bool:
+        '''
+        Summary:
+            apply the rules added or removed by the policy api to the
+            loaded policy, without reading the table again. The rules
+            are applied to copies of the enforcers, which are swapped in
+
+        Parameter:
+            - delta(dict): the version before and after the change, the
+              operation and the p and g rules
+
+        Return:
+            False if the loaded policy is not the version the change was
+            made on, the policy must be loaded again
+        '''
+
+        with self._lock:
+            if self.version is None or self.version != delta['from']:
+                return False
+            if ConfigSettings.CASBIN_POLICY_SHARDING_ENABLED:
+                for shard in list(self._shards.values()):
+                    shard.enforcer = self._apply_rules(shard.enforcer, delta, shard.zone)
+                    shard.decision_table = self._compile(shard.enforcer)
+            else:
+                enforcer = self._apply_rules(self._enforcer, delta)
+                self._enforcer, self._decision_table = enforcer, self._compile(enforcer)
+            self.version = delta['to']
+            self._decisions.clear()
+            self._checked_at = time.monotonic()
+        _logger.info(f'Applied casbin policy change {delta["from"]} -> {delta["to"]}')
+        return True
+
+    def is_ready(self, zones: Iterable[str]) -> bool:
+        '''
+        Summary:
+            whether the checks on the zones can run without a database query
+        '''
+
+        if self.is_check_due():
+            return False
+        if not ConfigSettings.CASBIN_POLICY_SHARDING_ENABLED:
+            return True
+        return all(zone in self._shards for zone in zones)
+
+    def prepare(self, zones: Iterable[str]) -> None:
+        '''
+        Summary:
+            refresh the policy if the check is due and load the zones
+
+        Parameter:
+            - zones(list): the zones of the upcoming checks
+
+        Return:
+            None
+        '''
+
+        if self.is_check_due():
+            self.refresh()
+        if ConfigSettings.CASBIN_POLICY_SHARDING_ENABLED:
+            for zone in set(zones):
+                if self._get_shard(zone) is None:
+                    self.load_shard(zone)
+
+    def is_check_due(self) -> bool:
+        if self.version is None:
+            return True
+        return time.monotonic() - self._checked_at >= ConfigSettings.CASBIN_POLICY_CHECK_INTERVAL
+
+    def refresh(self) -> None:
+        '''
+        Summary:
+            reload the policy if the version in the database changed
+
+        Return:
+            None
+        '''
+
+        if self.version is None:
+            self.load()
+            return
+
+        self._checked_at = time.monotonic()
+        if self.get_version() != self.version:
+            self.load()
+
+    def enforce(self, role: str, zone: str, resource: str, operation: str) -> bool:
+        '''
+        Summary:
+            check the request against the policy in memory. It never reads
+            the database, the zone is loaded beforehand with prepare
+
+        Return:
+            the decision(bool), PolicyNotLoaded is raised if the policy or
+            the zone is not loaded (eg. dropped by a policy change)
+        '''
+
+        version = self.version
+        if version is None:
+            raise PolicyNotLoaded('the casbin policy is not loaded')
+        request = (role, zone, resource, operation)
+        cached = self._decisions.get(request)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        enforcer, decision_table = self._get_rules(zone)
+        if decision_table is not None:
+            decision = decision_table.enforce(*request)
+        else:
+            decision = enforcer.enforce(*request)
+        self._decisions.set(request, (version, decision))
+        return decision
+
+    def _get_rules(self, zone: str) -> Tuple[casbin.Enforcer, DecisionTable]:
+        if ConfigSettings.CASBIN_POLICY_SHARDING_ENABLED:
+            shard = self._get_shard(zone)
+            if shard is None:
+                raise PolicyNotLoaded(f'the casbin policy of zone {zone} is not loaded')
+            return shard.enforcer, shard.decision_table
+        if self._enforcer is None:
+            raise PolicyNotLoaded('the casbin policy is not loaded')
+        return self._enforcer, self._decision_table
+
+    def _listen(self) -> None:
+        '''
+        Summary:
+            LISTEN on the policy channel and update the policy on every
+            notification. A notification is either the new version, or
+            the change made by the policy api which is applied in place.
+            The connection is opened again after an error
+
+        Return:
+            None
+        '''
+
+        while not self._stop_listening.is_set():
+            connection = None
+            try:
+                # a connection of its own, it stays subscribed for the lifetime of the worker
+                connection = get_sqlalchemy_engine().raw_connection()
+                connection.detach()
+                connection.connection.set_session(autocommit=True)
+                with connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN {POLICY_CHANNEL}')
+                # the changes made before the subscription are not notified
+                self.refresh()
+                self._subscribed.set()
+
+                dbapi_connection = connection.connection
+                while not self._stop_listening.is_set():
+                    if io_select.select([dbapi_connection], [], [], 1.0) == ([], [], []):
+                        continue
+                    dbapi_connection.poll()
+                    if not dbapi_connection.notifies:
+                        continue
+                    messages = [json.loads(notify.payload) for notify in dbapi_connection.notifies]
+                    dbapi_connection.notifies.clear()
+                    for message in messages:
+                        version = message['to'] if isinstance(message, dict) else message
+                        if self.version is not None and version <= self.version:
+                            continue
+                        if isinstance(message, dict) and self.apply_delta(message):
+                            continue
+                        self.load()
+            except Exception as e:
+                _logger.error(f'Error listening to the casbin policy changes: {e}')
+                self._stop_listening.wait(ConfigSettings.CASBIN_POLICY_LISTEN_RETRY_INTERVAL)
+            finally:
+                self._subscribed.clear()
+                if connection is not None:
+                    connection.close()
+
+    def start_listener(self) -> None:
+        if self._listener is not None and self._listener.is_alive():
+            return
+        self._stop_listening.clear()
+        self._listener = threading.Thread(target=self._listen, name='casbin-policy-listener', daemon=True)
+        self._listener.start()
+
+    def stop_listener(self) -> None:
+        self._stop_listening.set()
+        if self._listener is not None:
+            self._listener.join(timeout=5)
+            self._listener = None
+
+
+_policy_enforcer = PolicyEnforcer()
+
+
+def get_policy_enforcer() -> PolicyEnforcer:
+    return _policy_enforcer
@@ -13,19 +13,19 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import casbin
-import casbin_sqlalchemy_adapter
+from typing import List, Tuple
+
 from common import LoggerFactory
 from fastapi import APIRouter
 from fastapi_utils import cbv
-from sqlalchemy import create_engine
+from starlette.concurrency import run_in_threadpool
 
 from app.config import ConfigSettings
 from app.models.api_response import APIResponse, EAPIResponseCode
-from app.models.permissions import CasbinRule
+from app.models.authorize import AuthorizeBatchPOST, PoliciesPUT
 from app.resources.error_handler import catch_internal
-
-_engine = None
+from app.routers.permissions.enforcer import PolicyNotLoaded, get_policy_enforcer
+from app.routers.permissions.policy_store import update_policies
 
 router = APIRouter()
 
@@ -33,16 +33,35 @@ _API_TAG = '/v1/authorize'
 _API_NAMESPACE = 'api_authorize'
 _logger = LoggerFactory(_API_NAMESPACE).get_logger()
 
+# a policy change can drop the zones between the prepare and the checks
+_PREPARE_ATTEMPTS = 3
 
-def _get_sqlalchemy_engine():
-    """Get or create engine for sqlalchemy."""
 
-    global _engine
+async def check_permissions(requests: List[Tuple[str, str, str, str]]) -> dict:
+    '''
+    Summary:
+        evaluate the checks on the policy in memory. The version check
+        and the loads of the zones hit the database, they run in the
+        threadpool so the event loop only reads the loaded policy
 
-    if _engine is None:
-        _engine = create_engine(ConfigSettings.RDS_DB_URI, max_overflow=10, pool_recycle=1800, pool_size=10)
+    Parameter:
+        - requests(list): role, zone, resource and operation of each check
 
-    return _engine
+    Return:
+        - dict of the request to its decision
+    '''
+
+    enforcer = get_policy_enforcer()
+    requests = list(dict.fromkeys(requests))
+    zones = {request[1] for request in requests}
+    for attempt in range(_PREPARE_ATTEMPTS):
+        if not enforcer.is_ready(zones):
+            await run_in_threadpool(enforcer.prepare, zones)
+        try:
+            return {request: enforcer.enforce(*request) for request in requests}
+        except PolicyNotLoaded:
+            if attempt == _PREPARE_ATTEMPTS - 1:
+                raise
 
 
 @cbv.cbv(router)
@@ -54,17 +73,13 @@ class Authorize:
     @catch_internal(_API_NAMESPACE)
     async def get(self, role: str, zone: str, resource: str, operation: str):
         api_response = APIResponse()
-        api_response.result = {"has_permission": True}
-        return api_response.json_response()
-
         project_role = role
         project_zone = zone
 
         api_response.result = {'has_permission': False}
         try:
-            adapter = casbin_sqlalchemy_adapter.Adapter(_get_sqlalchemy_engine(), db_class=CasbinRule)
-            enforcer = casbin.Enforcer('app/routers/permissions/model.conf', adapter)
-            if enforcer.enforce(project_role, project_zone, resource, operation):
+            request = (project_role, project_zone, resource, operation)
+            if (await check_permissions([request]))[request]:
                 api_response.result = {'has_permission': True}
                 api_response.code = EAPIResponseCode.success
                 _logger.info(f'Access granted for {project_role}, {project_zone}, {resource}, {operation}')
@@ -76,3 +91,98 @@ class Authorize:
             api_response.code = EAPIResponseCode.internal_error
 
         return api_response.json_response()
+
+    @router.post('/authorize/batch', tags=[_API_TAG], summary='check many authorizations in one call')
+    @catch_internal(_API_NAMESPACE)
+    async def post_batch(self, data: AuthorizeBatchPOST):
+        '''
+        Summary:
+            The api evaluates a list of permission checks against the
+            policy loaded in memory, eg. to prefetch the permissions of
+            a role in a zone
+
+        Payload(AuthorizeBatchPOST):
+            - checks(list): role, zone, resource and operation of each check
+
+        Return:
+            - 200 the checks in the same order with has_permission
+        '''
+
+        api_response = APIResponse()
+        if len(data.checks) > ConfigSettings.CASBIN_BATCH_MAX_CHECKS:
+            api_response.error_msg = f'at most {ConfigSettings.CASBIN_BATCH_MAX_CHECKS} checks per request'
+            api_response.code = EAPIResponseCode.bad_request
+            return api_response.json_response()
+
+        try:
+            requests = [(check.role, check.zone, check.resource, check.operation) for check in data.checks]
+            decisions = await check_permissions(requests)
+            api_response.result = [
+                {**check.dict(), 'has_permission': decisions[request]} for check, request in zip(data.checks, requests)
+            ]
+            api_response.code = EAPIResponseCode.success
+
+        except Exception as e:
+            error_msg = f'Error checking permissions - {str(e)}'
+            _logger.error(error_msg)
+            api_response.error_msg = error_msg
+            api_response.code = EAPIResponseCode.internal_error
+
+        return api_response.json_response()
+
+    @router.put('/authorize/policies', tags=[_API_TAG], summary='add/remove the policy and grouping rules')
+    @catch_internal(_API_NAMESPACE)
+    async def put_policies(self, data: PoliciesPUT):
+        '''
+        Summary:
+            The api adds or removes many policy and grouping rules in one
+            transaction. The workers apply the change to the policy they
+            loaded instead of reading the whole table again
+
+        Payload(PoliciesPUT):
+            - operation_type(string): only accept remove or add
+            - policies(list): role, zone, resource and operation of the p rules
+            - grouping_policies(list): user, role and zone of the g rules
+
+        Return:
+            200 with the status of each rule:
+            - success
+            - conflict: the rule already exists
+            - not_found: the rule does not exist
+        '''
+
+        api_response = APIResponse()
+        operation_type = data.operation_type
+        if operation_type not in ['add', 'remove']:
+            api_response.error_msg = 'operation {} is not allowed'.format(operation_type)
+            api_response.code = EAPIResponseCode.bad_request
+            return api_response.json_response()
+        if len(data.policies) + len(data.grouping_policies) > ConfigSettings.CASBIN_POLICY_BULK_MAX_RULES:
+            api_response.error_msg = f'at most {ConfigSettings.CASBIN_POLICY_BULK_MAX_RULES} rules per request'
+            api_response.code = EAPIResponseCode.bad_request
+            return api_response.json_response()
+
+        requested = {
+            'p': [(x.role, x.zone, x.resource, x.operation) for x in data.policies],
+            'g': [(x.user, x.role, x.zone) for x in data.grouping_policies],
+        }
+        try:
+            changed = await run_in_threadpool(update_policies, operation_type, requested)
+        except Exception as e:
+            error_msg = f'Error updating policies - {str(e)}'
+            _logger.error(error_msg)
+            api_response.error_msg = error_msg
+            api_response.code = EAPIResponseCode.internal_error
+            return api_response.json_response()
+
+        unchanged_status = 'conflict' if operation_type == 'add' else 'not_found'
+        result = {}
+        for ptype, key, rules in [('p', 'policies', data.policies), ('g', 'grouping_policies', data.grouping_policies)]:
+            changed_rules = set(changed[ptype])
+            result[key] = [
+                {**rule.dict(), 'status': 'success' if rule_tuple in changed_rules else unchanged_status}
+                for rule, rule_tuple in zip(rules, requested[ptype])
+            ]
+        api_response.result = result
+        api_response.code = EAPIResponseCode.success
+        return api_response.json_response()
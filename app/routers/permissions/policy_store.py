@@ -0,0 +1,102 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+from typing import Dict, List
+
+from common import LoggerFactory
+from sqlalchemy import and_, func, select, text, tuple_
+
+from app.models.permissions import (
+    POLICY_CHANNEL,
+    POLICY_DELTA_SETTING,
+    CasbinPolicyVersion,
+    CasbinRule,
+)
+from app.routers.permissions.enforcer import get_sqlalchemy_engine
+
+# the fields of the p and g rules of the model
+RULE_FIELDS = {'p': ['v0', 'v1', 'v2', 'v3'], 'g': ['v0', 'v1', 'v2']}
+# the limit of the notification payload in postgres
+MAX_NOTIFY_PAYLOAD = 7999
+
+_logger = LoggerFactory('policy_store').get_logger()
+
+
+def update_policies(operation_type: str, rules: Dict[str, List[tuple]]) -> Dict[str, List[tuple]]:
+    '''
+    Summary:
+        add or remove the p and g rules in one transaction, with one
+        INSERT or DELETE per rule type. The rules already in the table
+        (or not in it for remove) are skipped. The changed rules are
+        notified to the workers which apply them to their policy, if the
+        change is too large for a notification the new version is sent
+        instead and the workers load the policy again
+
+    Parameter:
+        - operation_type(str): add or remove
+        - rules(dict): the rules of each type, {'p': [...], 'g': [...]}
+
+    Return:
+        the rules of each type which were changed
+    '''
+
+    changed = {}
+    with get_sqlalchemy_engine().begin() as connection:
+        # the trigger still bumps the version but leaves the notification to us
+        connection.execute(text(f"SET LOCAL {POLICY_DELTA_SETTING} = 'on'"))
+        # lock the version, the changes are applied by the workers in the order of the versions
+        version_query = select([CasbinPolicyVersion.version]).where(CasbinPolicyVersion.id == 1)
+        previous_version = connection.execute(version_query.with_for_update()).scalar()
+
+        for ptype, fields in RULE_FIELDS.items():
+            requested = list(dict.fromkeys(tuple(x) for x in rules.get(ptype, [])))
+            changed[ptype] = []
+            if not requested:
+                continue
+
+            columns = [getattr(CasbinRule, x) for x in fields]
+            condition = and_(CasbinRule.ptype == ptype, tuple_(*columns).in_(requested))
+            existing = {tuple(x) for x in connection.execute(select(columns).where(condition))}
+
+            if operation_type == 'add':
+                changed[ptype] = [x for x in requested if x not in existing]
+                if changed[ptype]:
+                    connection.execute(
+                        CasbinRule.__table__.insert(),
+                        [{'ptype': ptype, **dict(zip(fields, x))} for x in changed[ptype]],
+                    )
+            else:
+                changed[ptype] = [x for x in requested if x in existing]
+                if changed[ptype]:
+                    connection.execute(
+                        CasbinRule.__table__.delete().where(
+                            and_(CasbinRule.ptype == ptype, tuple_(*columns).in_(changed[ptype]))
+                        )
+                    )
+
+        version = connection.execute(version_query).scalar()
+        if version != previous_version:
+            payload = json.dumps(
+                {'from': previous_version, 'to': version, 'operation': operation_type, **changed},
+                separators=(',', ':'),
+            )
+            if len(payload.encode('utf-8')) > MAX_NOTIFY_PAYLOAD:
+                payload = str(version)
+            connection.execute(select([func.pg_notify(POLICY_CHANNEL, payload)]))
+
+    _logger.info(f'{operation_type} {len(changed["p"])} policies and {len(changed["g"])} grouping policies')
+    return changed
@@ -17,17 +17,21 @@ from common import LoggerFactory
 from fastapi import APIRouter
 from fastapi_utils import cbv
 
+from app.commons.psql_services.advisory_lock import AdvisoryLock
 from app.config import ConfigSettings
 from app.models.api_response import APIResponse, EAPIResponseCode
 from app.models.user_account_management import (
+    ADGroupReconcilePOST,
+    UserADGroupBulkOperationsPUT,
     UserADGroupOperationsPUT,
     UserManagementV1PUT,
 )
 from app.resources.error_handler import catch_internal
-from app.resources.keycloak_api.ops_admin import OperationsAdmin
-from app.services.data_providers.ldap_client import LdapClient
+from app.resources.keycloak_api.ops_admin import get_admin_client
+from app.services.data_providers.ldap_async import AsyncLdapClient
+from app.services.reconciliation.ad_group import AD_RECONCILE_LOCK_KEY, ADGroupReconciliation
 import ldap
-from app.commons.psql_services.user_event import create_event
+from app.commons.psql_services.event_queue import get_event_queue
 
 router = APIRouter()
 
@@ -63,15 +67,15 @@ class UserADGroupOperations:
         user_email = data.user_email
 
         try:
-            ldap_cli = LdapClient()
-            user_dn, _ = ldap_cli.get_user_by_email(user_email)
-            # format the group_code with group dn
-            group_dn = ldap_cli.format_group_dn(group_code)
+            async with AsyncLdapClient() as ldap_cli:
+                user_dn, _ = await ldap_cli.get_user_by_email(user_email)
+                # format the group_code with group dn
+                group_dn = ldap_cli.format_group_dn(group_code)
 
-            if operation_type == 'remove':
-                ldap_cli.remove_user_from_group(user_dn, group_dn)
-            elif operation_type == 'add':
-                ldap_cli.add_user_to_group(user_dn, group_dn)
+                if operation_type == 'remove':
+                    await ldap_cli.remove_user_from_group(user_dn, group_dn)
+                elif operation_type == 'add':
+                    await ldap_cli.add_user_to_group(user_dn, group_dn)
 
             res.result = '%s user %s from ad group' % (operation_type, user_email)
             res.code = EAPIResponseCode.success
@@ -80,9 +84,145 @@ class UserADGroupOperations:
             res.error_msg = 'remove/add from users group error: ' + str(e)
             res.code = EAPIResponseCode.bad_request
 
-        finally:
-            ldap_cli.disconnect()
+        return res.json_response()
+
+
+def _classify_members(operation_type: str, group_dn: str, user_emails: list, users: dict) -> tuple:
+    '''
+    Summary:
+        Split the emails of a bulk operation into the ones already settled
+        (not in AD, already in the group for add, not in it for remove) and
+        the ones the group modify has to change
+
+    Parameter:
+        - operation_type(string): add or remove
+        - group_dn(string): the dn of the target group
+        - user_emails(list): the target user emails
+        - users(dict): the found users by email as (dn, entry)
+
+    Return:
+        the status of the settled emails and the emails to change by user dn
+    '''
+
+    statuses = {}
+    emails_by_dn = {}
+    for email in user_emails:
+        if email not in users:
+            statuses[email] = 'user_not_found'
+            continue
+        user_dn, entry = users[email]
+        groups = [x.decode('utf-8').lower() for x in entry.get('memberOf', [])]
+        is_member = group_dn.lower() in groups
+        if operation_type == 'add' and is_member:
+            statuses[email] = 'conflict'
+        elif operation_type == 'remove' and not is_member:
+            statuses[email] = 'not_found'
+        else:
+            emails_by_dn.setdefault(user_dn, []).append(email)
+
+    return statuses, emails_by_dn
+
+
+@cbv.cbv(router)
+class UserADGroupBulkOperations:
+    @router.put('/user/ad-group/bulk', tags=[_API_TAG], summary='add/remove the target users to ad group')
+    @catch_internal(_API_NAMESPACE)
+    async def put(self, data: UserADGroupBulkOperationsPUT):
+        '''
+        Summary:
+            The api is used to add or remove many users of one ldap group.
+            The users are found with one search and changed with one
+            modify on the group. The users already in the group (or not
+            in it for remove) are skipped
+
+        Payload(UserADGroupBulkOperationsPUT):
+            - operation_type(string): only accept remove or add
+            - user_emails(list): the target user emails
+            - group_code(string): the group code define by upperstream
+
+        Return:
+            200 with the status of each user:
+            - success
+            - conflict: the user is already in the group
+            - not_found: the user is not in the group or the group does not exist
+            - user_not_found: the email is not in AD
+            - error
+        '''
+
+        _logger.info('Call API for bulk user ad group operations')
+
+        res = APIResponse()
+        operation_type = data.operation_type
+        user_emails = list(dict.fromkeys(data.user_emails))
+
+        if operation_type not in ['add', 'remove']:
+            res.error_msg = 'operation {} is not allowed'.format(operation_type)
+            res.code = EAPIResponseCode.bad_request
+            return res.json_response()
+        if len(user_emails) > ConfigSettings.LDAP_BULK_MAX_USERS:
+            res.error_msg = f'at most {ConfigSettings.LDAP_BULK_MAX_USERS} users per request'
+            res.code = EAPIResponseCode.bad_request
+            return res.json_response()
+
+        try:
+            async with AsyncLdapClient() as ldap_cli:
+                users = await ldap_cli.get_users_by_emails(user_emails)
+                group_dn = ldap_cli.format_group_dn(data.group_code)
+
+                statuses, emails_by_dn = _classify_members(operation_type, group_dn, user_emails, users)
+                results = await ldap_cli.update_group_members(operation_type, group_dn, list(emails_by_dn))
+                for result in results:
+                    for email in emails_by_dn[result['user_dn']]:
+                        statuses[email] = result['status']
 
+            res.result = [{'user_email': x, 'status': statuses[x]} for x in user_emails]
+            res.code = EAPIResponseCode.success
+
+        except Exception as e:
+            res.error_msg = 'bulk remove/add from users group error: ' + str(e)
+            res.code = EAPIResponseCode.bad_request
+
+        return res.json_response()
+
+
+@cbv.cbv(router)
+class ADGroupReconcile:
+    @router.post(
+        '/user/ad-group/reconcile', tags=[_API_TAG], summary='reconcile the ad project groups with keycloak roles'
+    )
+    @catch_internal(_API_NAMESPACE)
+    async def post(self, data: ADGroupReconcilePOST):
+        '''
+        Summary:
+            The api compares the members of the keycloak project roles
+            with the members of the project ad groups and applies the
+            difference to ad. With dry_run it only reports it
+
+        Payload(ADGroupReconcilePOST):
+            - project_codes(list optional): the projects to reconcile, all by default
+            - dry_run(bool): only report the difference, default true
+
+        Return:
+            200 with the report of each project
+        '''
+
+        _logger.info('Call API for ad group reconciliation')
+
+        res = APIResponse()
+        reconciliation = ADGroupReconciliation(ConfigSettings.KEYCLOAK_REALM)
+        if data.dry_run:
+            res.result = await reconciliation.reconcile(data.project_codes, data.dry_run)
+            res.code = EAPIResponseCode.success
+            return res.json_response()
+
+        # the changes are not applied while the background reconciliation runs
+        async with AdvisoryLock(AD_RECONCILE_LOCK_KEY) as locked:
+            if not locked:
+                res.error_msg = 'ad group reconciliation is already running'
+                res.code = EAPIResponseCode.conflict
+                return res.json_response()
+            res.result = await reconciliation.reconcile(data.project_codes, data.dry_run)
+        res.code = EAPIResponseCode.success
         return res.json_response()
 
 
@@ -130,37 +270,44 @@ class UserManagementV1:
             }.get(operation_type)
 
             # first update the status by action
-            kc_cli = OperationsAdmin(ConfigSettings.KEYCLOAK_REALM)
-            user = kc_cli.get_user_by_email(user_email)
+            kc_cli = get_admin_client(ConfigSettings.KEYCLOAK_REALM)
+            user = await kc_cli.get_user_by_email(user_email)
             user_id = user.get('id')
-            kc_cli.update_user_attributes(user_id, {'status': status})
+            await kc_cli.update_user_attributes(user_id, {'status': status})
 
             if operation_type == 'disable':
 
                 # keep the uma_authorization by default and remove
                 # other roles from users. It will keep the uma_authorization
                 # by default and remove other roles (remove the permission)
-                realm_role = kc_cli.get_user_realm_roles(user_id)
+                realm_role = await kc_cli.get_user_realm_roles(user_id)
                 deleted_roles = [x for x in realm_role if x.get('name') != 'uma_authorization']
-                kc_cli.remove_user_realm_roles(user_id, deleted_roles)
-
-                ldap_cli = LdapClient()
-                user_dn, ldap_info = ldap_cli.get_user_by_email(user_email)
-                # remove all ldap start with <project>-* group except ConfigSettings.LDAP_USER_GROUP
-                for x in ldap_info.get('memberOf'):
-                    ldap_group = x.decode('utf-8')
-                    if ConfigSettings.LDAP_USER_GROUP not in ldap_group and ldap_group.startswith(
-                        'CN=' + ConfigSettings.LDAP_COMMON_NAME_PREFIX
-                    ):
-                        ldap_cli.remove_user_from_group(user_dn, ldap_group)
-
-                ldap_cli.disconnect()
+                await kc_cli.remove_user_realm_roles(user_id, deleted_roles)
+
+                async with AsyncLdapClient() as ldap_cli:
+                    # the groups added by other workers or directly in AD may not be
+                    # in the cached entry yet, every one of them has to be removed
+                    user_dn, ldap_info = await ldap_cli.get_user_by_email(user_email, use_cache=False)
+                    # remove all ldap start with <project>-* group except ConfigSettings.LDAP_USER_GROUP
+                    removed_groups = []
+                    for x in ldap_info.get('memberOf'):
+                        ldap_group = x.decode('utf-8')
+                        # the groups may be formatted by format_group_dn with a lowercase cn
+                        if ConfigSettings.LDAP_USER_GROUP not in ldap_group and ldap_group.upper().startswith(
+                            'CN=' + ConfigSettings.LDAP_COMMON_NAME_PREFIX.upper()
+                        ):
+                            removed_groups.append(('remove', user_dn, ldap_group))
+                    results = await ldap_cli.modify_group_members(removed_groups)
+
+                failed = [x for x in results if x['status'] not in ('success', 'not_found')]
+                if failed:
+                    raise Exception(f'failed to remove the user from ad groups: {failed}')
 
             if operation_type == 'disable':
                 event_type = "ACCOUNT_DISABLE"
             else:
                 event_type = "ACCOUNT_ACTIVATED"
-            create_event({
+            await get_event_queue().add({
                 "target_user_id": user["id"],
                 "target_user": user["username"],
                 "operator": data.operator,
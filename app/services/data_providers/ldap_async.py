@@ -0,0 +1,173 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import asyncio
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+from app.config import ConfigSettings
+from app.services.data_providers.ldap_client import LdapClient
+from app.services.data_providers.ldap_pool import get_ldap_pool
+
+_ldap_executor = None
+_ldap_executor_lock = threading.Lock()
+
+# the connection slots per event loop, see AsyncLdapClient.connect
+_connection_slots = weakref.WeakKeyDictionary()
+
+
+def get_ldap_executor() -> ThreadPoolExecutor:
+    '''
+    Summary:
+        Return the thread pool that runs the blocking ldap calls of
+        the worker. It is separate from the default executor so the
+        slow directory calls cannot starve the other blocking work
+
+    Return:
+        - ThreadPoolExecutor
+    '''
+
+    global _ldap_executor
+
+    with _ldap_executor_lock:
+        if _ldap_executor is None:
+            _ldap_executor = ThreadPoolExecutor(
+                max_workers=ConfigSettings.LDAP_THREAD_POOL_SIZE, thread_name_prefix='ldap'
+            )
+        return _ldap_executor
+
+
+def close_ldap_executor() -> None:
+    '''
+    Summary:
+        Wait for the running ldap calls and stop the thread pool
+
+    Return:
+        None
+    '''
+
+    global _ldap_executor
+
+    with _ldap_executor_lock:
+        if _ldap_executor is not None:
+            _ldap_executor.shutdown(wait=True)
+            _ldap_executor = None
+
+
+def get_connection_slots() -> asyncio.Semaphore:
+    '''
+    Summary:
+        Return the semaphore of the running event loop that admits at
+        most one client per pooled connection. The clients wait for a
+        slot on the loop instead of blocking an ldap thread in the pool
+        acquire, so the threads stay free for the clients holding the
+        connections
+
+    Return:
+        - asyncio.Semaphore
+    '''
+
+    loop = asyncio.get_running_loop()
+    slots = _connection_slots.get(loop)
+    if slots is None:
+        slots = asyncio.Semaphore(get_ldap_pool().maxsize)
+        _connection_slots[loop] = slots
+    return slots
+
+
+class AsyncLdapClient:
+    '''
+    Summary:
+        Awaitable facade of LdapClient. The calls run in the ldap thread
+        pool on one pooled connection and are serialized, so the
+        connection is only returned once the last call has finished
+        even if the awaiting request was cancelled. A client waits on
+        the event loop for a free connection before it takes a thread
+
+        async with AsyncLdapClient() as ldap_cli:
+            user_dn, _ = await ldap_cli.get_user_by_email(email)
+    '''
+
+    def __init__(self) -> None:
+        self._client = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    async def __aenter__(self) -> 'AsyncLdapClient':
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.disconnect()
+
+    def _locked(self, func, *args):
+        with self._lock:
+            return func(*args)
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_ldap_executor(), self._locked, func, *args)
+
+    async def connect(self) -> None:
+        slots = get_connection_slots()
+        await slots.acquire()
+        try:
+            self._client = await self._run(LdapClient)
+        except BaseException:
+            slots.release()
+            raise
+        self._slots = slots
+
+    async def disconnect(self) -> None:
+        if self._client is not None:
+            client, self._client = self._client, None
+            slots, self._slots = self._slots, None
+            try:
+                await self._run(client.disconnect)
+            finally:
+                slots.release()
+
+    def format_group_dn(self, group_name: str) -> str:
+        return self._client.format_group_dn(group_name)
+
+    async def get_user_by_email(self, email: str, use_cache: bool = True) -> Tuple[str, dict]:
+        return await self._run(self._client.get_user_by_email, email, use_cache)
+
+    async def get_user_by_username(self, username: str) -> Tuple[str, dict]:
+        return await self._run(self._client.get_user_by_username, username)
+
+    async def is_account_in_ad(self, email: str) -> bool:
+        return await self._run(self._client.is_account_in_ad, email)
+
+    async def add_user_to_group(self, user_dn: str, group_dn: str) -> str:
+        return await self._run(self._client.add_user_to_group, user_dn, group_dn)
+
+    async def remove_user_from_group(self, user_dn: str, group_dn: str) -> dict:
+        return await self._run(self._client.remove_user_from_group, user_dn, group_dn)
+
+    async def list_users(self, search_filter: str, attributes: List[str] = None) -> List[Tuple[str, dict]]:
+        return await self._run(lambda: list(self._client.iter_users(search_filter, attributes)))
+
+    async def get_users_by_emails(self, emails: List[str]) -> Dict[str, Tuple[str, dict]]:
+        return await self._run(self._client.get_users_by_emails, emails)
+
+    async def update_group_members(self, operation_type: str, group_dn: str, user_dns: List[str]) -> List[dict]:
+        return await self._run(self._client.update_group_members, operation_type, group_dn, user_dns)
+
+    async def modify_group_members(self, operations: List[Tuple[str, str, str]]) -> List[dict]:
+        return await self._run(self._client.modify_group_members, operations)
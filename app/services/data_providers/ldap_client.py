@@ -13,44 +13,122 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from typing import Tuple
+from typing import Dict, Iterator, List, Tuple
 
 import ldap
 from common import LoggerFactory
+from ldap.controls import SimplePagedResultsControl
+from ldap.filter import escape_filter_chars
 
 from app.config import ConfigSettings
+from app.resources.cache import TTLCache
+from app.services.data_providers.ldap_pool import get_ldap_pool
 
 _logger = LoggerFactory('ldap client').get_logger()
 
+# the user attributes read by the service, the searches do not return the others
+USER_ATTRIBUTES = ['mail', 'givenName', 'sn', 'memberOf', ConfigSettings.LDAP_USER_OBJECTCLASS]
+
+# the users found by email or username, shared by the clients of the worker.
+# the lookup keys map to the user dn and ('dn', <user_dn>) holds the entry,
+# the users not in AD are kept as None for a shorter ttl
+_user_cache = TTLCache(maxsize=ConfigSettings.LDAP_USER_CACHE_SIZE, ttl=ConfigSettings.LDAP_USER_CACHE_TTL)
+_NOT_CACHED = object()
+
+
+def _get_cached_user(key: tuple):
+    user_dn = _user_cache.get(key, _NOT_CACHED)
+    if user_dn is None:
+        return None, None
+    if user_dn is _NOT_CACHED:
+        return _NOT_CACHED
+    entry = _user_cache.get(('dn', user_dn))
+    if entry is None:
+        return _NOT_CACHED
+    return user_dn, entry
+
+
+def _cache_user(key: tuple, user_dn: str, entry: dict) -> None:
+    if user_dn is None:
+        _user_cache.set(key, None, ConfigSettings.LDAP_USER_NEGATIVE_CACHE_TTL)
+        return
+    _user_cache.set(key, user_dn)
+    _user_cache.set(('dn', user_dn), entry)
+
+
+def _update_cached_groups(user_dn: str, group_dn: str, is_member: bool) -> None:
+    entry = _user_cache.get(('dn', user_dn))
+    if entry is None:
+        return
+    # the entry is replaced instead of modified since the callers may
+    # still be iterating over its groups. dn are compared case-insensitively
+    groups = [x for x in entry.get('memberOf', []) if x.decode('utf-8').lower() != group_dn.lower()]
+    if is_member:
+        groups.append(group_dn.encode('utf-8'))
+    _user_cache.set(('dn', user_dn), {**entry, 'memberOf': groups})
+
 
 class LdapClient:
     """LdapClient."""
 
     def __init__(self) -> None:
-        ldap.set_option(ldap.OPT_REFERRALS, ldap.OPT_OFF)
+        self.conn = None
         self.connect()
 
+    def __enter__(self) -> 'LdapClient':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.disconnect()
+
     def connect(self) -> None:
         '''
         Summary:
-            Setup the connection with ldap by the configure file
+            Take a bound connection from the shared ldap connection pool
 
         Return:
             None
         '''
-        self.conn = ldap.initialize(ConfigSettings.LDAP_URL)
+        self.conn = get_ldap_pool().acquire()
         self.objectclass = [ConfigSettings.LDAP_objectclass.encode('utf-8')]
-        self.conn.simple_bind_s(ConfigSettings.LDAP_ADMIN_DN, ConfigSettings.LDAP_ADMIN_SECRET)
 
     def disconnect(self) -> None:
         '''
         Summary:
-            disconnect from ldap
+            return the connection to the pool. It is safe to call
+            more than once
 
         Return:
             None
         '''
-        self.conn.unbind_s()
+        if self.conn is not None:
+            get_ldap_pool().release(self.conn)
+            self.conn = None
+
+    def _execute(self, operation: str, *args):
+        '''
+        Summary:
+            Run the operation on the pooled connection. If the server
+            dropped the connection, it is discarded and the operation
+            is retried once on a new one
+
+        Parameter:
+            operation(string): the method name of the ldap connection
+
+        Return:
+            the result of the operation
+        '''
+        try:
+            return getattr(self.conn, operation)(*args)
+        except ldap.SERVER_DOWN:
+            _logger.warning(f'ldap connection lost during {operation}, reconnecting')
+            self._reconnect()
+            return getattr(self.conn, operation)(*args)
+
+    def _reconnect(self) -> None:
+        conn, self.conn = self.conn, None
+        get_ldap_pool().release(conn, discard=True)
+        self.conn = get_ldap_pool().acquire()
 
     def format_group_dn(self, group_name: str) -> str:
         '''
@@ -93,10 +171,15 @@ class LdapClient:
         _logger.info('add user from group dn: ' + group_dn)
         try:
             operation_list = [(ldap.MOD_ADD, 'member', [user_dn.encode('utf-8')])]
-            res = self.conn.modify_s(group_dn, operation_list)
+            res = self._execute('modify_s', group_dn, operation_list)
         except ldap.ALREADY_EXISTS as e:
             _logger.info('Already in group skipping group add:' + group_dn)
+            _update_cached_groups(user_dn, group_dn, True)
             return "conflict"
+        except Exception:
+            _user_cache.pop(('dn', user_dn))
+            raise
+        _update_cached_groups(user_dn, group_dn, True)
         return "success"
 
     def remove_user_from_group(self, user_dn: str, group_dn: str) -> dict:
@@ -115,34 +198,253 @@ class LdapClient:
         _logger.info('removed user: ' + user_dn)
         _logger.info('remove user from group dn: ' + group_dn)
         operation_list = [(ldap.MOD_DELETE, 'member', [user_dn.encode('utf-8')])]
-        res = self.conn.modify_s(group_dn, operation_list)
+        try:
+            res = self._execute('modify_s', group_dn, operation_list)
+        except Exception:
+            _user_cache.pop(('dn', user_dn))
+            raise
+        _update_cached_groups(user_dn, group_dn, False)
         return res
 
-    def get_user_by_email(self, email: str) -> Tuple[str, dict]:
+    def modify_group_members(self, operations: List[Tuple[str, str, str]]) -> List[dict]:
+        '''
+        Summary:
+            Apply many group membership changes in one call. All the
+            modify requests are sent on the connection before the first
+            result is read, so the changes take about one round trip
+            instead of one per group. If the connection is lost, the
+            whole batch is sent again on a new one and the changes that
+            were already applied report conflict/not_found
+
+        Parameter:
+            operations(list): (operation_type, user_dn, group_dn) where
+                operation_type is add or remove
+
+        Return:
+            list of dict with operation_type, user_dn, group_dn and the
+            status of each operation in the same order:
+            - success
+            - conflict: the user is already in the group
+            - not_found: the group does not exist or the user is not in it
+            - error: the error_msg holds the ldap error
+        '''
+        try:
+            return self._modify_group_members(operations)
+        except ldap.SERVER_DOWN:
+            _logger.warning('ldap connection lost during group changes, reconnecting')
+            self._reconnect()
+            return self._modify_group_members(operations)
+
+    def _modify_group_members(self, operations: List[Tuple[str, str, str]]) -> List[dict]:
+        msgids = []
+        for operation_type, user_dn, group_dn in operations:
+            mod_op = ldap.MOD_ADD if operation_type == 'add' else ldap.MOD_DELETE
+            msgids.append(self.conn.modify(group_dn, [(mod_op, 'member', [user_dn.encode('utf-8')])]))
+
+        results = []
+        for msgid, (operation_type, user_dn, group_dn) in zip(msgids, operations):
+            result = {'operation_type': operation_type, 'user_dn': user_dn, 'group_dn': group_dn}
+            try:
+                self.conn.result(msgid)
+                result['status'] = 'success'
+            except (ldap.ALREADY_EXISTS, ldap.TYPE_OR_VALUE_EXISTS):
+                result['status'] = 'conflict'
+            except (ldap.NO_SUCH_OBJECT, ldap.NO_SUCH_ATTRIBUTE, ldap.UNWILLING_TO_PERFORM):
+                # AD answers unwilling to perform when the member to delete is not in the group
+                result['status'] = 'not_found'
+            except ldap.SERVER_DOWN:
+                raise
+            except ldap.LDAPError as e:
+                _logger.error(f'failed to {operation_type} {user_dn} in {group_dn}: {e}')
+                result.update({'status': 'error', 'error_msg': str(e)})
+            results.append(result)
+
+        for result in results:
+            if result['status'] == 'error' or (result['operation_type'] == 'add' and result['status'] == 'not_found'):
+                _user_cache.pop(('dn', result['user_dn']))
+            else:
+                _update_cached_groups(result['user_dn'], result['group_dn'], result['operation_type'] == 'add')
+
+        return results
+
+    def get_user_search_base(self) -> str:
+        '''
+        Summary:
+            the base dn of the user searches, the domain root if
+            LDAP_USER_SEARCH_BASE is not set
+
+        Return:
+            base dn(string)
+        '''
+        if ConfigSettings.LDAP_USER_SEARCH_BASE:
+            return ConfigSettings.LDAP_USER_SEARCH_BASE
+        return 'dc={},dc={}'.format(ConfigSettings.LDAP_DC1, ConfigSettings.LDAP_DC2)
+
+    def search_users(self, search_filter: str, attributes: List[str] = None) -> List[Tuple[str, dict]]:
+        '''
+        Summary:
+            search the users under the user search base
+
+        Parameter:
+            search_filter(string): ldap filter, the values must be escaped
+            attributes(list): the attributes to return, default USER_ATTRIBUTES
+
+        Return:
+            list of (user_dn, user_info) without the referrals
+        '''
+        users = self._execute(
+            'search_s',
+            self.get_user_search_base(),
+            ldap.SCOPE_SUBTREE,
+            search_filter,
+            attributes or USER_ATTRIBUTES,
+        )
+        return [(user_dn, entry) for user_dn, entry in users if user_dn]
+
+    def iter_users(
+        self, search_filter: str = '(objectClass=user)', attributes: List[str] = None, page_size: int = None
+    ) -> Iterator[Tuple[str, dict]]:
+        '''
+        Summary:
+            search the users under the user search base page by page with
+            the simple paged results control, so the whole OU can be read
+            without hitting the server size limit. The pages are fetched
+            while the generator is consumed and the connection must not
+            be used for anything else until then
+
+        Parameter:
+            search_filter(string): ldap filter, the values must be escaped
+            attributes(list): the attributes to return, default USER_ATTRIBUTES
+            page_size(int): the entries per page, default LDAP_SEARCH_PAGE_SIZE
+
+        Return:
+            generator of (user_dn, user_info)
+        '''
+        control = SimplePagedResultsControl(True, size=page_size or ConfigSettings.LDAP_SEARCH_PAGE_SIZE, cookie='')
+        while True:
+            msgid = self.conn.search_ext(
+                self.get_user_search_base(),
+                ldap.SCOPE_SUBTREE,
+                search_filter,
+                attributes or USER_ATTRIBUTES,
+                serverctrls=[control],
+            )
+            _, entries, _, server_controls = self.conn.result3(msgid)
+            for user_dn, entry in entries:
+                if user_dn:
+                    yield user_dn, entry
+
+            cookie = None
+            for server_control in server_controls:
+                if server_control.controlType == SimplePagedResultsControl.controlType:
+                    cookie = server_control.cookie
+            if not cookie:
+                return
+            control.cookie = cookie
+
+    def update_group_members(self, operation_type: str, group_dn: str, user_dns: List[str]) -> List[dict]:
+        '''
+        Summary:
+            Add or remove many users of one group with a single multi
+            valued modify on the group entry. AD rejects the whole modify
+            if one of the users is already in (or not in) the group, then
+            the users are applied one by one with modify_group_members
+
+        Parameter:
+            operation_type(string): add or remove
+            group_dn(string): formated group dn
+            user_dns(list): formated user dn
+
+        Return:
+            list of dict as modify_group_members
+        '''
+        if not user_dns:
+            return []
+
+        _logger.info(f'{operation_type} {len(user_dns)} users in group dn: {group_dn}')
+        mod_op = ldap.MOD_ADD if operation_type == 'add' else ldap.MOD_DELETE
+        operation_list = [(mod_op, 'member', [x.encode('utf-8') for x in user_dns])]
+        try:
+            self._execute('modify_s', group_dn, operation_list)
+            status = 'success'
+        except ldap.NO_SUCH_OBJECT:
+            status = 'not_found'
+        except (ldap.ALREADY_EXISTS, ldap.TYPE_OR_VALUE_EXISTS, ldap.NO_SUCH_ATTRIBUTE, ldap.UNWILLING_TO_PERFORM):
+            return self.modify_group_members([(operation_type, x, group_dn) for x in user_dns])
+
+        if status == 'success':
+            for user_dn in user_dns:
+                _update_cached_groups(user_dn, group_dn, operation_type == 'add')
+        return [
+            {'operation_type': operation_type, 'user_dn': x, 'group_dn': group_dn, 'status': status} for x in user_dns
+        ]
+
+    def get_users_by_emails(self, emails: List[str]) -> Dict[str, Tuple[str, dict]]:
+        '''
+        Summary:
+            get the users in ldap by email. The users not in the cache
+            are found with one search of OR filters, LDAP_BULK_FILTER_SIZE
+            emails per search
+
+        Parameter:
+            emails(list): user emails in ldap
+
+        Return:
+            dict of email to (user_dn, user_info), the emails not in AD
+            are left out. The emails are matched case insensitively and
+            keyed as they are given
+        '''
+        users = {}
+        missing = []
+        for email in dict.fromkeys(emails):
+            user_found = _get_cached_user(('email', email))
+            if user_found is _NOT_CACHED:
+                missing.append(email)
+            elif user_found[0]:
+                users[email] = user_found
+
+        chunk_size = ConfigSettings.LDAP_BULK_FILTER_SIZE
+        for i in range(0, len(missing), chunk_size):
+            chunk = missing[i : i + chunk_size]
+            email_filter = ''.join(f'(mail={escape_filter_chars(x)})' for x in chunk)
+            users_all = self.search_users(f'(&(objectClass=user)(|{email_filter}))')
+            found = {}
+            for user_dn, entry in users_all:
+                if 'mail' in entry:
+                    found[entry['mail'][0].decode('utf-8').lower()] = (user_dn, entry)
+            for email in chunk:
+                _cache_user(('email', email), *found.get(email.lower(), (None, None)))
+                if email.lower() in found:
+                    users[email] = found[email.lower()]
+
+        return users
+
+    def get_user_by_email(self, email: str, use_cache: bool = True) -> Tuple[str, dict]:
         '''
         Summary:
             get the user infomation in ldap by email
 
         Parameter:
             email(string): user email in ldap
+            use_cache(bool): False to search ldap even if the user is cached,
+                eg. when the groups must be up to date. The cache is refreshed
 
         Return:
             user_dn(string): user dn in ldap
             user_info(dict): the rest infomation in user eg. group
         '''
-        users_all = self.conn.search_s(
-            'dc={},dc={}'.format(ConfigSettings.LDAP_DC1, ConfigSettings.LDAP_DC2),
-            ldap.SCOPE_SUBTREE,
-            '(&(objectClass=user)(mail={}))'.format(email),
-        )
-        user_found = None
-        for user_dn, entry in users_all:
-            if 'mail' in entry:
-                decoded_email = entry['mail'][0].decode('utf-8')
-                if decoded_email == email:
-                    user_found = (user_dn, entry)
+        user_found = _get_cached_user(('email', email)) if use_cache else _NOT_CACHED
+        if user_found is _NOT_CACHED:
+            users_all = self.search_users('(&(objectClass=user)(mail={}))'.format(escape_filter_chars(email)))
+            user_found = (None, None)
+            for user_dn, entry in users_all:
+                if 'mail' in entry:
+                    decoded_email = entry['mail'][0].decode('utf-8')
+                    if decoded_email.lower() == email.lower():
+                        user_found = (user_dn, entry)
+            _cache_user(('email', email), *user_found)
         # _logger.info("found user by email: " + str(user_found))
-        if not user_found:
+        if not user_found[0]:
             raise Exception('get_user_by_email error: User not found on AD: ' + email)
         return user_found
 
@@ -158,20 +460,21 @@ class LdapClient:
             user_dn(string): user dn in ldap
             user_info(dict): the rest infomation in user eg. group
         '''
-        users = self.conn.search_s(
-            'dc={},dc={}'.format(ConfigSettings.LDAP_DC1, ConfigSettings.LDAP_DC2),
-            ldap.SCOPE_SUBTREE,
-            f'(&(objectClass=user)({ConfigSettings.LDAP_USER_OBJECTCLASS}={username}))',
-        )
+        user_found = _get_cached_user(('username', username))
+        if user_found is _NOT_CACHED:
+            users = self.search_users(
+                f'(&(objectClass=user)({ConfigSettings.LDAP_USER_OBJECTCLASS}={escape_filter_chars(username)}))'
+            )
 
-        user_found = None
-        for user_dn, entry in users:
-            if ConfigSettings.LDAP_USER_OBJECTCLASS in entry:
-                decoded_username = entry[ConfigSettings.LDAP_USER_OBJECTCLASS][0].decode('utf-8')
-                if decoded_username == username:
-                    user_found = (user_dn, entry)
+            user_found = (None, None)
+            for user_dn, entry in users:
+                if ConfigSettings.LDAP_USER_OBJECTCLASS in entry:
+                    decoded_username = entry[ConfigSettings.LDAP_USER_OBJECTCLASS][0].decode('utf-8')
+                    if decoded_username == username:
+                        user_found = (user_dn, entry)
+            _cache_user(('username', username), *user_found)
 
-        if not user_found:
+        if not user_found[0]:
             _logger.info('user %s is not found in AD' % username)
             return None, None
         _logger.info('found user by username: ' + str(user_found))
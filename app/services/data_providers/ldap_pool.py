@@ -0,0 +1,231 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import threading
+import time
+from collections import deque
+
+import ldap
+from common import LoggerFactory
+
+from app.config import ConfigSettings
+
+_logger = LoggerFactory('ldap pool').get_logger()
+
+
+class LdapPoolExhausted(Exception):
+    pass
+
+
+class LdapConnectionPool:
+    '''
+    Summary:
+        Thread-safe pool of the bound ldap connections. At most maxsize
+        connections are opened, the idle ones are reused from the most
+        recently released and closed after idle_timeout seconds. A
+        connection idle for longer than health_check_interval is checked
+        with a whoami before it is handed out and replaced if it is dead
+    '''
+
+    def __init__(
+        self,
+        maxsize: int = None,
+        idle_timeout: float = None,
+        health_check_interval: float = None,
+        acquire_timeout: float = None,
+    ) -> None:
+        self.maxsize = maxsize or ConfigSettings.LDAP_POOL_SIZE
+        self.idle_timeout = ConfigSettings.LDAP_POOL_IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+        self.health_check_interval = (
+            ConfigSettings.LDAP_POOL_HEALTH_CHECK_INTERVAL if health_check_interval is None else health_check_interval
+        )
+        self.acquire_timeout = ConfigSettings.LDAP_POOL_ACQUIRE_TIMEOUT if acquire_timeout is None else acquire_timeout
+
+        # (connection, released_at) with the oldest on the left
+        self._idle = deque()
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def _create(self):
+        conn = ldap.initialize(ConfigSettings.LDAP_URL)
+        conn.set_option(ldap.OPT_REFERRALS, ldap.OPT_OFF)
+        conn.set_option(ldap.OPT_NETWORK_TIMEOUT, ConfigSettings.LDAP_NETWORK_TIMEOUT)
+        conn.simple_bind_s(ConfigSettings.LDAP_ADMIN_DN, ConfigSettings.LDAP_ADMIN_SECRET)
+        return conn
+
+    def _is_healthy(self, conn) -> bool:
+        try:
+            conn.whoami_s()
+        except ldap.LDAPError as e:
+            _logger.warning(f'discard the broken ldap connection: {e}')
+            return False
+        return True
+
+    def _unbind(self, conn) -> None:
+        try:
+            conn.unbind_s()
+        except ldap.LDAPError:
+            pass
+
+    def _evict_idle(self) -> list:
+        # called with the lock held, the connections are unbound by the caller
+        expired = []
+        now = time.monotonic()
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            expired.append(self._idle.popleft()[0])
+            self._size -= 1
+        if expired:
+            self._cond.notify(len(expired))
+        return expired
+
+    def _take_or_reserve(self, deadline: float, expired: list) -> tuple:
+        '''
+        Summary:
+            wait until an idle connection can be taken or a slot for a new
+            one reserved. The evicted connections are added to expired
+
+        Return:
+            - (connection, released_at), (None, None) for a reserved slot
+        '''
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise LdapPoolExhausted('ldap connection pool is closed')
+                expired.extend(self._evict_idle())
+                if self._idle:
+                    return self._idle.pop()
+                if self._size < self.maxsize:
+                    self._size += 1
+                    return None, None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise LdapPoolExhausted(f'no ldap connection available after {self.acquire_timeout}s')
+                self._cond.wait(remaining)
+
+    def acquire(self):
+        '''
+        Summary:
+            Take a bound connection from the pool. It will open a new
+            one when there is no idle connection and the pool is not
+            full, otherwise wait for a release until acquire_timeout
+
+        Return:
+            - ldap connection
+        '''
+
+        deadline = time.monotonic() + self.acquire_timeout
+        # the connections evicted on every wakeup, unbound out of the lock
+        expired = []
+        try:
+            conn, released_at = self._take_or_reserve(deadline, expired)
+        finally:
+            for expired_conn in expired:
+                self._unbind(expired_conn)
+
+        if conn is not None:
+            if time.monotonic() - released_at < self.health_check_interval or self._is_healthy(conn):
+                return conn
+            self._unbind(conn)
+
+        try:
+            return self._create()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn, discard: bool = False) -> None:
+        '''
+        Summary:
+            Return the connection to the pool. The connection is closed
+            instead when it is discarded or the pool is closed
+
+        Parameter:
+            - conn(ldap connection): the connection from acquire
+            - discard(bool): the connection is broken and will not be reused
+
+        Return:
+            None
+        '''
+
+        with self._cond:
+            if not discard and not self._closed:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+                return
+            self._size -= 1
+            self._cond.notify()
+        self._unbind(conn)
+
+    def close(self) -> None:
+        '''
+        Summary:
+            Close the idle connections. The connections in use are closed
+            when they are released
+
+        Return:
+            None
+        '''
+
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            self._unbind(conn)
+
+
+_ldap_pool = None
+_ldap_pool_lock = threading.Lock()
+
+
+def get_ldap_pool() -> LdapConnectionPool:
+    '''
+    Summary:
+        Return the ldap connection pool shared by the worker
+
+    Return:
+        - LdapConnectionPool
+    '''
+
+    global _ldap_pool
+
+    with _ldap_pool_lock:
+        if _ldap_pool is None:
+            _ldap_pool = LdapConnectionPool()
+        return _ldap_pool
+
+
+def close_ldap_pool() -> None:
+    '''
+    Summary:
+        Close the shared ldap connection pool
+
+    Return:
+        None
+    '''
+
+    global _ldap_pool
+
+    with _ldap_pool_lock:
+        if _ldap_pool is not None:
+            _ldap_pool.close()
+            _ldap_pool = None
@@ -0,0 +1,210 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import asyncio
+
+from common import LoggerFactory
+from fastapi_sqlalchemy import db
+from keycloak import exceptions
+from ldap.filter import escape_filter_chars
+from starlette.concurrency import run_in_threadpool
+
+from app.commons.psql_services.advisory_lock import AdvisoryLock
+from app.commons.psql_services.invitation import query_invites
+from app.config import ConfigSettings
+from app.resources.keycloak_api.ops_admin import PLATFORM_ADMIN_ROLE, get_admin_client
+from app.services.data_providers.ldap_async import AsyncLdapClient
+
+_logger = LoggerFactory('ad_group_reconciliation').get_logger()
+
+# the key of the advisory lock so only one worker reconciles at a time
+AD_RECONCILE_LOCK_KEY = 7302
+
+
+def _get_invited_emails(code: str) -> set:
+    with db():
+        return {x.email.lower() for x in query_invites({'project_code': code, 'status': 'pending'})}
+
+
+class ADGroupReconciliation:
+    '''
+    Summary:
+        bring the ad project groups in line with the keycloak project
+        roles. The members of every <code>-<role> realm role should be
+        in the <prefix>-<code> ad group and nobody else with an email,
+        except the users with a pending invitation to the project.
+        Both sides are read in bulk and only the difference is applied
+    '''
+
+    def __init__(self, realm_name: str = ConfigSettings.KEYCLOAK_REALM):
+        self.admin_client = get_admin_client(realm_name)
+        self.project_roles = [x.strip() for x in ConfigSettings.AD_RECONCILE_PROJECT_ROLES.split(',') if x.strip()]
+
+    async def get_project_codes(self) -> list:
+        '''
+        Summary:
+            find the projects from the realm roles named <code>-<role>
+
+        Return:
+            - sorted list of the project codes(list)
+        '''
+
+        codes = set()
+        for role in await self.admin_client.get_realm_roles():
+            if role['name'] == PLATFORM_ADMIN_ROLE:
+                continue
+            code, _, project_role = role['name'].rpartition('-')
+            if code and project_role in self.project_roles:
+                codes.add(code)
+        return sorted(codes)
+
+    async def get_keycloak_members(self, code: str) -> dict:
+        '''
+        Summary:
+            collect the users holding any role of the project
+
+        Parameter:
+            - code(string): the project code
+
+        Return:
+            - dict of the lowercase email to the email(dict), None if
+                the project has none of the roles
+        '''
+
+        members = {}
+        found_role = False
+        for project_role in self.project_roles:
+            try:
+                users = await self.admin_client.get_role_members(f'{code}-{project_role}')
+            except exceptions.KeycloakGetError as e:
+                # not every project has every role
+                if e.response_code != 404:
+                    raise
+                continue
+            found_role = True
+            for user in users:
+                if user.get('email'):
+                    members[user['email'].lower()] = user['email']
+        return members if found_role else None
+
+    async def reconcile_project(self, ldap_cli: AsyncLdapClient, code: str, dry_run: bool = False) -> dict:
+        '''
+        Summary:
+            compute and apply the difference for one project
+
+        Parameter:
+            - ldap_cli(AsyncLdapClient): the connected ldap client
+            - code(string): the project code
+            - dry_run(bool): only report the difference
+
+        Return:
+            - the report of the project(dict):
+                - project_code, group_dn
+                - to_add/to_remove: the emails to change in the group
+                - not_in_ad: the emails of the role members missing in AD
+                - results: the status of each change when it is applied
+                - skipped: the project has no role in keycloak
+        '''
+
+        keycloak_members = await self.get_keycloak_members(code)
+        group_dn = ldap_cli.format_group_dn(code)
+        # never empty the group of a project unknown to keycloak
+        if keycloak_members is None:
+            _logger.warning(f'skip the ad group of {code}: no project role in keycloak')
+            return {'project_code': code, 'group_dn': group_dn, 'skipped': True}
+
+        # the members without email are not managed by the platform and left alone
+        ad_members = {}
+        search_filter = f'(&(objectClass=user)(memberOf={escape_filter_chars(group_dn)}))'
+        for user_dn, entry in await ldap_cli.list_users(search_filter, ['mail']):
+            if entry.get('mail'):
+                ad_members[entry['mail'][0].decode('utf-8').lower()] = user_dn
+
+        # both sides are keyed by the lowercase email
+        to_add = sorted(keycloak_members.keys() - ad_members.keys())
+        # the invitees are added to the group before they have a keycloak account
+        invited = await run_in_threadpool(_get_invited_emails, code)
+        to_remove = {ad_members[x]: x for x in ad_members.keys() - keycloak_members.keys() - invited}
+
+        users = await ldap_cli.get_users_by_emails(to_add) if to_add else {}
+        report = {
+            'project_code': code,
+            'group_dn': group_dn,
+            'to_add': sorted(keycloak_members[x] for x in to_add if x in users),
+            'to_remove': sorted(to_remove.values()),
+            'not_in_ad': sorted(keycloak_members[x] for x in to_add if x not in users),
+            'results': [],
+        }
+        if dry_run:
+            return report
+
+        batch_size = ConfigSettings.LDAP_BULK_MAX_USERS
+        add_dns = [users[x][0] for x in to_add if x in users]
+        remove_dns = list(to_remove)
+        for operation_type, user_dns in (('add', add_dns), ('remove', remove_dns)):
+            for i in range(0, len(user_dns), batch_size):
+                results = await ldap_cli.update_group_members(operation_type, group_dn, user_dns[i : i + batch_size])
+                report['results'].extend(results)
+
+        _logger.info(f'Reconciled ad group of {code}: added {len(add_dns)}, removed {len(remove_dns)}')
+        return report
+
+    async def reconcile(self, project_codes: list = None, dry_run: bool = False) -> list:
+        '''
+        Summary:
+            reconcile the ad groups of the projects
+
+        Parameter:
+            - project_codes(list optional): the projects to reconcile,
+                all the projects with realm roles by default
+            - dry_run(bool): only report the difference
+
+        Return:
+            - list of the project reports(list)
+        '''
+
+        if project_codes is None:
+            project_codes = await self.get_project_codes()
+
+        reports = []
+        async with AsyncLdapClient() as ldap_cli:
+            for code in project_codes:
+                reports.append(await self.reconcile_project(ldap_cli, code, dry_run))
+        return reports
+
+    async def sync(self) -> bool:
+        '''
+        Summary:
+            run one reconciliation of all the projects if no other
+            worker is running it
+
+        Return:
+            - whether the reconciliation was run(bool)
+        '''
+
+        async with AdvisoryLock(AD_RECONCILE_LOCK_KEY) as locked:
+            if not locked:
+                return False
+            await self.reconcile()
+        return True
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.sync()
+            except Exception as e:
+                _logger.error('Fail to reconcile the ad groups: ' + str(e))
+            await asyncio.sleep(ConfigSettings.AD_RECONCILE_INTERVAL)
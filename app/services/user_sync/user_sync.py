@@ -0,0 +1,172 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Tuple
+
+from common import LoggerFactory
+from fastapi_sqlalchemy import db
+from keycloak import exceptions
+from starlette.concurrency import run_in_threadpool
+
+from app.commons.psql_services.advisory_lock import AdvisoryLock
+from app.commons.psql_services.users import (
+    delete_users,
+    delete_users_synced_before,
+    get_sync_state,
+    upsert_users,
+)
+from app.config import ConfigSettings
+from app.resources.keycloak_api.ops_admin import get_admin_client
+
+_logger = LoggerFactory('user_sync').get_logger()
+
+# the key of the advisory lock so only one worker syncs the mirror at a time
+USER_SYNC_LOCK_KEY = 7301
+
+
+def _in_transaction(func, *args):
+    # one short transaction per write, run in the threadpool
+    with db():
+        result = func(*args)
+        db.session.commit()
+    return result
+
+
+def _read_sync_state() -> Tuple[datetime, int]:
+    state = get_sync_state()
+    return state.last_reconcile_at, state.last_event_time
+
+
+def _save_sync_state(last_event_time: int, last_reconcile_at: datetime = None) -> None:
+    state = get_sync_state()
+    state.last_event_time = last_event_time
+    if last_reconcile_at is not None:
+        state.last_reconcile_at = last_reconcile_at
+
+
+def _apply_changes(removed: list, updated: list, synced_at: datetime) -> None:
+    delete_users(removed)
+    upsert_users(updated, synced_at)
+
+
+class UserMirrorSync:
+    '''
+    Summary:
+        keep the local users table in sync with keycloak. The admin events
+        are applied incrementally and the whole realm is reconciled
+        periodically to catch the changes without admin event (eg. the
+        users imported from ldap)
+    '''
+
+    def __init__(self, realm_name: str = ConfigSettings.KEYCLOAK_REALM):
+        self.admin_client = get_admin_client(realm_name)
+
+    async def reconcile(self) -> int:
+        '''
+        Summary:
+            copy all the keycloak users into the mirror and remove the
+            users no longer in keycloak
+
+        Return:
+            - the number of synced users(int)
+        '''
+
+        synced_at = datetime.utcnow()
+        count = 0
+        async for users in self.admin_client.iter_users(ConfigSettings.USER_SYNC_PAGE_SIZE):
+            await run_in_threadpool(_in_transaction, upsert_users, users, synced_at)
+            count += len(users)
+        removed = await run_in_threadpool(_in_transaction, delete_users_synced_before, synced_at)
+        _logger.info(f'Reconciled {count} users from keycloak and removed {removed}')
+        return count
+
+    async def apply_admin_events(self, since: int) -> int:
+        '''
+        Summary:
+            apply the keycloak admin events on the users after <since>
+
+        Parameter:
+            - since(int): the time(ms) of the last applied event
+
+        Return:
+            - the time(ms) of the last applied event(int)
+        '''
+
+        date_from = datetime.utcfromtimestamp(since // 1000).strftime('%Y-%m-%d') if since else None
+        # the day of dateFrom is not enough, the events applied by the previous rounds are not paged again
+        events = await self.admin_client.get_admin_events(['USER'], date_from, since)
+        events = sorted((event for event in events if event.get('time', 0) > since), key=lambda x: x['time'])
+
+        # several events on the same user only need one lookup
+        changed = {}
+        for event in events:
+            # the resource path looks like users/<id> or users/<id>/<sub resource>
+            user_id = event.get('resourcePath', '').split('/')[1:2]
+            if user_id:
+                changed[user_id[0]] = event.get('operationType')
+
+        synced_at = datetime.utcnow()
+        removed, updated = [], []
+        for user_id, operation in changed.items():
+            if operation == 'DELETE':
+                removed.append(user_id)
+                continue
+            try:
+                updated.append(await self.admin_client.get_user_by_id(user_id))
+            except exceptions.KeycloakGetError as e:
+                if e.response_code != 404:
+                    raise
+                removed.append(user_id)
+        await run_in_threadpool(_in_transaction, _apply_changes, removed, updated, synced_at)
+
+        return events[-1]['time'] if events else since
+
+    async def sync(self) -> bool:
+        '''
+        Summary:
+            run one round of the synchronization if no other worker
+            is running it
+
+        Return:
+            - whether the round was run(bool)
+        '''
+
+        async with AdvisoryLock(USER_SYNC_LOCK_KEY) as locked:
+            if not locked:
+                return False
+
+            # keycloak is read outside of the transactions, the writes are short
+            last_reconcile_at, last_event_time = await run_in_threadpool(_in_transaction, _read_sync_state)
+            reconcile_interval = timedelta(seconds=ConfigSettings.USER_SYNC_RECONCILE_INTERVAL)
+            if last_reconcile_at is None or datetime.utcnow() - last_reconcile_at >= reconcile_interval:
+                started_at = datetime.utcnow()
+                started_time = int(time.time() * 1000)
+                await self.reconcile()
+                await run_in_threadpool(_in_transaction, _save_sync_state, started_time, started_at)
+            else:
+                last_event_time = await self.apply_admin_events(last_event_time)
+                await run_in_threadpool(_in_transaction, _save_sync_state, last_event_time)
+        return True
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.sync()
+            except Exception as e:
+                _logger.error('Fail to sync the users from keycloak: ' + str(e))
+            await asyncio.sleep(ConfigSettings.USER_SYNC_INTERVAL)
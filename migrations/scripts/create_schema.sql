@@ -2,3 +2,4 @@
 create schema if not exists pilot_invitation;
 create schema if not exists pilot_casbin;
 create schema if not exists pilot_event;
+create schema if not exists pilot_user;
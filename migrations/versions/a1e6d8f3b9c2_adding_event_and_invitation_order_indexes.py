@@ -0,0 +1,31 @@
+"""Adding event and invitation order indexes
+
+Revision ID: a1e6d8f3b9c2
+Revises: f7b2e4c9a1d6
+Create Date: 2026-10-18 21:07:45.310284
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'a1e6d8f3b9c2'
+down_revision = 'f7b2e4c9a1d6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_user_event_timestamp_id', 'user_event', ['timestamp', 'id'], unique=False, schema='pilot_event')
+    op.create_index(
+        'ix_invitation_create_timestamp_id',
+        'invitation',
+        ['create_timestamp', 'id'],
+        unique=False,
+        schema='pilot_invitation',
+    )
+
+
+def downgrade():
+    op.drop_index('ix_invitation_create_timestamp_id', table_name='invitation', schema='pilot_invitation')
+    op.drop_index('ix_user_event_timestamp_id', table_name='user_event', schema='pilot_event')
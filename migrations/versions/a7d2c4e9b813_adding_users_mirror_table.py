@@ -0,0 +1,60 @@
+"""Adding users mirror table
+
+Revision ID: a7d2c4e9b813
+Revises: c50577f5d93e
+Create Date: 2026-10-18 10:12:31.402118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'a7d2c4e9b813'
+down_revision = 'c50577f5d93e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('users',
+    sa.Column('id', sa.String(), nullable=False),
+    sa.Column('username', sa.String(), server_default='', nullable=False),
+    sa.Column('email', sa.String(), server_default='', nullable=False),
+    sa.Column('first_name', sa.String(), server_default='', nullable=False),
+    sa.Column('last_name', sa.String(), server_default='', nullable=False),
+    sa.Column('status', sa.String(), nullable=True),
+    sa.Column('last_login', sa.String(), server_default='', nullable=False),
+    sa.Column('time_created', sa.DateTime(), nullable=False),
+    sa.Column('synced_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('id'),
+    schema='pilot_user'
+    )
+    op.create_index('ix_users_username_id', 'users', ['username', 'id'], unique=False, schema='pilot_user')
+    op.create_index('ix_users_email_id', 'users', ['email', 'id'], unique=False, schema='pilot_user')
+    op.create_index('ix_users_first_name_id', 'users', ['first_name', 'id'], unique=False, schema='pilot_user')
+    op.create_index('ix_users_last_name_id', 'users', ['last_name', 'id'], unique=False, schema='pilot_user')
+    op.create_index('ix_users_last_login_id', 'users', ['last_login', 'id'], unique=False, schema='pilot_user')
+    op.create_index('ix_users_time_created_id', 'users', ['time_created', 'id'], unique=False, schema='pilot_user')
+    op.create_index('ix_users_status', 'users', ['status'], unique=False, schema='pilot_user')
+    op.create_index('ix_users_synced_at', 'users', ['synced_at'], unique=False, schema='pilot_user')
+    op.create_table('user_sync_state',
+    sa.Column('id', sa.String(), nullable=False),
+    sa.Column('last_event_time', sa.BigInteger(), nullable=False),
+    sa.Column('last_reconcile_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    schema='pilot_user'
+    )
+
+
+def downgrade():
+    op.drop_table('user_sync_state', schema='pilot_user')
+    op.drop_index('ix_users_synced_at', table_name='users', schema='pilot_user')
+    op.drop_index('ix_users_status', table_name='users', schema='pilot_user')
+    op.drop_index('ix_users_time_created_id', table_name='users', schema='pilot_user')
+    op.drop_index('ix_users_last_login_id', table_name='users', schema='pilot_user')
+    op.drop_index('ix_users_last_name_id', table_name='users', schema='pilot_user')
+    op.drop_index('ix_users_first_name_id', table_name='users', schema='pilot_user')
+    op.drop_index('ix_users_email_id', table_name='users', schema='pilot_user')
+    op.drop_index('ix_users_username_id', table_name='users', schema='pilot_user')
+    op.drop_table('users', schema='pilot_user')
@@ -0,0 +1,48 @@
+"""Adding casbin policy version
+
+Revision ID: b5e8f1a2c7d4
+Revises: a7d2c4e9b813
+Create Date: 2026-10-18 14:05:12.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'b5e8f1a2c7d4'
+down_revision = 'a7d2c4e9b813'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('casbin_policy_version',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    schema='pilot_casbin'
+    )
+    op.execute('INSERT INTO pilot_casbin.casbin_policy_version (id, version) VALUES (1, 0)')
+    op.execute('''
+        CREATE OR REPLACE FUNCTION pilot_casbin.bump_casbin_policy_version() RETURNS trigger AS $$
+        DECLARE
+            new_version BIGINT;
+        BEGIN
+            UPDATE pilot_casbin.casbin_policy_version SET version = version + 1 WHERE id = 1
+                RETURNING version INTO new_version;
+            PERFORM pg_notify('casbin_policy', new_version::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    op.execute('''
+        CREATE TRIGGER casbin_rule_policy_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON pilot_casbin.casbin_rule
+            FOR EACH STATEMENT EXECUTE PROCEDURE pilot_casbin.bump_casbin_policy_version()
+    ''')
+
+
+def downgrade():
+    op.execute('DROP TRIGGER IF EXISTS casbin_rule_policy_version ON pilot_casbin.casbin_rule')
+    op.execute('DROP FUNCTION IF EXISTS pilot_casbin.bump_casbin_policy_version()')
+    op.drop_table('casbin_policy_version', schema='pilot_casbin')
@@ -0,0 +1,23 @@
+"""Adding casbin rule zone index
+
+Revision ID: d3a9c6e1f5b2
+Revises: b5e8f1a2c7d4
+Create Date: 2026-10-18 16:42:37.104519
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'd3a9c6e1f5b2'
+down_revision = 'b5e8f1a2c7d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_casbin_rule_ptype_v1_v0', 'casbin_rule', ['ptype', 'v1', 'v0'], schema='pilot_casbin')
+
+
+def downgrade():
+    op.drop_index('ix_casbin_rule_ptype_v1_v0', table_name='casbin_rule', schema='pilot_casbin')
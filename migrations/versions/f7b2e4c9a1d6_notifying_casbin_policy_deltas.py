@@ -0,0 +1,48 @@
+"""Notifying casbin policy deltas
+
+Revision ID: f7b2e4c9a1d6
+Revises: d3a9c6e1f5b2
+Create Date: 2026-10-18 18:21:54.730218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'f7b2e4c9a1d6'
+down_revision = 'd3a9c6e1f5b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('''
+        CREATE OR REPLACE FUNCTION pilot_casbin.bump_casbin_policy_version() RETURNS trigger AS $$
+        DECLARE
+            new_version BIGINT;
+        BEGIN
+            UPDATE pilot_casbin.casbin_policy_version SET version = version + 1 WHERE id = 1
+                RETURNING version INTO new_version;
+            -- the policy api notifies the change itself
+            IF current_setting('casbin.delta_notify', true) IS DISTINCT FROM 'on' THEN
+                PERFORM pg_notify('casbin_policy', new_version::text);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+
+
+def downgrade():
+    op.execute('''
+        CREATE OR REPLACE FUNCTION pilot_casbin.bump_casbin_policy_version() RETURNS trigger AS $$
+        DECLARE
+            new_version BIGINT;
+        BEGIN
+            UPDATE pilot_casbin.casbin_policy_version SET version = version + 1 WHERE id = 1
+                RETURNING version INTO new_version;
+            PERFORM pg_notify('casbin_policy', new_version::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
@@ -52,7 +52,7 @@ def keycloak_admin_mock(monkeypatch):
         def fake_init(self, *args, **kwargs):
             pass
 
-        def get_user_by_username(self, *args, **kwargs):
+        async def get_user_by_username(self, *args, **kwargs):
             return {
                 'id': uuid4(),
                 'email': 'testuser@example.com',
@@ -100,6 +100,15 @@ def ldap_client_mock(monkeypatch):
     monkeypatch.setattr(LdapClient, 'disconnect', ldap_client.disconnect)
 
 
+@pytest.fixture
+def attribute_buffer(mocker):
+    from app.resources.keycloak_api import attribute_buffer
+
+    buffer = attribute_buffer.UserAttributeBuffer()
+    mocker.patch.object(attribute_buffer, '_attribute_buffer', buffer)
+    return buffer
+
+
 @pytest.fixture(scope='session', autouse=True)
 def db():
     with PostgresContainer('postgres:14.1') as postgres:
@@ -119,6 +128,16 @@ def db():
         if not engine.dialect.has_schema(engine, ConfigSettings.RDS_SCHEMA_PREFIX + '_event'):
             engine.execute(CreateSchema(ConfigSettings.RDS_SCHEMA_PREFIX + '_event'))
         Base.metadata.create_all(bind=engine)
+
+        from app.models.permissions import Base
+        if not engine.dialect.has_schema(engine, ConfigSettings.RDS_SCHEMA_PREFIX + '_casbin'):
+            engine.execute(CreateSchema(ConfigSettings.RDS_SCHEMA_PREFIX + '_casbin'))
+        Base.metadata.create_all(bind=engine)
+
+        from app.models.sql_users import Base
+        if not engine.dialect.has_schema(engine, ConfigSettings.RDS_SCHEMA_PREFIX + '_user'):
+            engine.execute(CreateSchema(ConfigSettings.RDS_SCHEMA_PREFIX + '_user'))
+        Base.metadata.create_all(bind=engine)
         yield postgres
 
 
@@ -128,3 +147,17 @@ def test_client(db):
     app = create_app()
     client = TestClient(app)
     return client
+
+
+@pytest.fixture
+def users_mirror(db):
+    from app.models.sql_users import UserModel, UserSyncStateModel
+
+    engine = create_engine(db.get_connection_url())
+
+    def insert_users(users):
+        engine.execute(UserModel.__table__.insert(), users)
+
+    yield insert_users
+    engine.execute(UserModel.__table__.delete())
+    engine.execute(UserSyncStateModel.__table__.delete())
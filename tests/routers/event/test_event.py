@@ -18,6 +18,7 @@ import pytest
 
 from app.config import ConfigSettings
 from app.resources.keycloak_api.ops_admin import OperationsAdmin
+from datetime import datetime
 from uuid import uuid4
 
 
@@ -112,3 +113,54 @@ def test_list_events_query_user_200(test_client):
     response = test_client.get('/v1/events', params=payload)
     assert response.status_code == 200
     assert response.json()["result"][0]["target_user"] == user_json["username"]
+
+
+@mock.patch.object(OperationsAdmin, 'get_user_by_username', side_effect=None)
+def test_list_events_cursor_pagination(get_user_mock, test_client, keycloak_admin_mock):
+    get_user_mock.return_value = user_json
+    invitation_id = str(uuid4())
+    for project_role in ['admin', 'contributor', 'collaborator']:
+        payload = {
+            'operator': 'admin',
+            'event_type': 'INVITE_TO_PROJECT',
+            'detail': {'invitation_id': invitation_id, 'project_role': project_role},
+        }
+        response = test_client.post('/v1/events', json=payload)
+        assert response.status_code == 200
+
+    params = {'invitation_id': invitation_id, 'page_size': 2, 'order_type': 'desc', 'exact_total': False}
+    roles = []
+    while True:
+        response = test_client.get('/v1/events', params=params)
+        assert response.status_code == 200
+        roles += [x['detail']['project_role'] for x in response.json()['result']]
+        if not response.json()['next_cursor']:
+            break
+        params['cursor'] = response.json()['next_cursor']
+    assert roles == ['collaborator', 'contributor', 'admin']
+
+
+def test_list_events_invalid_cursor(test_client):
+    response = test_client.get('/v1/events', params={'cursor': 'invalid'})
+    assert response.status_code == 400
+
+
+def test_list_events_page_uses_the_order_index(test_client):
+    from fastapi_sqlalchemy import db
+    from sqlalchemy import text
+
+    from app.models.sql_events import UserEventModel
+
+    with db():
+        db.session.execute(text('SET LOCAL enable_seqscan = off'))
+        query = (
+            db.session.query(UserEventModel)
+            .filter(UserEventModel.timestamp > datetime(2022, 1, 1))
+            .order_by(UserEventModel.timestamp.asc(), UserEventModel.id.asc())
+            .limit(25)
+        )
+        statement = query.statement.compile(dialect=db.session.bind.dialect)
+        plan = db.session.connection().execute('EXPLAIN ' + str(statement), statement.params).fetchall()
+        db.session.rollback()
+
+    assert 'ix_user_event_timestamp_id' in ' '.join(row[0] for row in plan)
@@ -64,16 +64,16 @@ def ops_admin_mock_client(monkeypatch, user_exists, relation=True, role="fakepro
         def fake_init(self, *args, **kwargs):
             pass
 
-        def get_user_by_email(self, anything):
+        async def get_user_by_email(self, anything):
             if self.user_exists:
                 return user_json
             else:
                 return None
 
-        def get_user_by_username(self, anything):
+        async def get_user_by_username(self, anything):
             return user_json
 
-        def get_user_realm_roles(self, anything):
+        async def get_user_realm_roles(self, anything):
             if self.relation:
                 return [{"name": self.role}]
             else:
@@ -132,12 +132,17 @@ def ldap_mock_client(monkeypatch, user_exists, is_in_ad=True):
         def format_group_dn(self, group_name):
             return group_name
 
-        def get_user_by_email(self, email):
+        def get_user_by_email(self, email, use_cache=True):
             return 'user_dn', self.user_data
 
         def add_user_to_group(self, user_dn, group_dn):
             return ''
 
+        def modify_group_members(self, operations):
+            return [
+                {'operation_type': x[0], 'user_dn': x[1], 'group_dn': x[2], 'status': 'success'} for x in operations
+            ]
+
     ldap_mock_client = LdapClientMock()
     ldap_mock_client.user_data = {'username': 'testuser', 'email': 'testuser@example.com'}
     ldap_mock_client.user_exists = user_exists
@@ -147,6 +152,7 @@ def ldap_mock_client(monkeypatch, user_exists, is_in_ad=True):
     monkeypatch.setattr(LdapClient, 'format_group_dn', ldap_mock_client.format_group_dn)
     monkeypatch.setattr(LdapClient, 'get_user_by_email', ldap_mock_client.get_user_by_email)
     monkeypatch.setattr(LdapClient, 'add_user_to_group', ldap_mock_client.add_user_to_group)
+    monkeypatch.setattr(LdapClient, 'modify_group_members', ldap_mock_client.modify_group_members)
 
 
 @pytest.fixture
@@ -344,6 +350,17 @@ def test_get_invite_list_order(test_client, httpx_mock, ldap_mock, ops_admin_moc
     assert response.json()['result'][1]['email'] == f'b@ordertest_{timestamp}.com'
     assert response.json()['result'][2]['email'] == f'a@ordertest_{timestamp}.com'
 
+    # walk the same list with the cursor
+    payload['page_size'] = 2
+    payload['exact_total'] = False
+    response = test_client.post('/v1/invitation-list', json=payload)
+    emails = [x['email'] for x in response.json()['result']]
+    assert emails == [f'c@ordertest_{timestamp}.com', f'b@ordertest_{timestamp}.com']
+    payload['cursor'] = response.json()['next_cursor']
+    response = test_client.post('/v1/invitation-list', json=payload)
+    assert [x['email'] for x in response.json()['result']] == [f'a@ordertest_{timestamp}.com']
+    assert response.json()['next_cursor'] is None
+
 
 def test_check_invite_email(test_client, httpx_mock, ops_admin_mock, mocker):
     mocker.patch.object(ProjectClient, 'get', return_value=FakeProjectObject())
@@ -436,3 +453,23 @@ def test_invite_update(test_client, httpx_mock, ops_admin_mock):
     assert response.status_code == 200
     assert response.json()["result"][0]["target_user"] == user_json["username"]
     assert response.json()["result"][0]["target_user_id"] == str(user_json["id"])
+
+
+def test_create_invitation_writes_the_event_right_away(
+    test_client, httpx_mock, ldap_mock, ops_admin_mock_no_user, mocker
+):
+    httpx_mock.add_response(
+        method='POST', url=ConfigSettings.NOTIFY_SERVICE + 'email/', json={'result': 'success'}, status_code=200
+    )
+    queue_add = mocker.patch('app.commons.psql_services.event_queue.UserEventQueue.add')
+    payload = {'email': 'event_right_away@test.com', 'platform_role': 'admin', 'invited_by': 'admin'}
+    response = test_client.post('/v1/invitations', json=payload)
+    assert response.status_code == 200
+
+    payload = {'page': 0, 'page_size': 1, 'filters': {'email': 'event_right_away@test.com'}}
+    response = test_client.post('/v1/invitation-list', json=payload)
+    invite_id = response.json()['result'][0]['id']
+    response = test_client.get('/v1/events', params={'invitation_id': invite_id})
+    assert response.status_code == 200
+    assert response.json()['result'][0]['event_type'] == 'INVITE_TO_PLATFORM'
+    queue_add.assert_not_called()
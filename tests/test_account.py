@@ -46,8 +46,10 @@ def test_user_account_user_dn_exist(test_client, mocker, keycloak_admin_mock, ld
         ),
     )
 
-    mocker.patch('app.services.data_providers.ldap_client.LdapClient.add_user_to_group')
-    mocker.patch('app.services.data_providers.ldap_client.LdapClient.add_user_to_group')
+    modify_group_members = mocker.patch(
+        'app.services.data_providers.ldap_client.LdapClient.modify_group_members',
+        return_value=[{'status': 'success'}, {'status': 'conflict'}],
+    )
 
     mocker.patch('app.services.notifier_services.email_service.SrvEmail.send')
     mocker.patch('app.services.notifier_services.email_service.SrvEmail.send')
@@ -55,6 +57,7 @@ def test_user_account_user_dn_exist(test_client, mocker, keycloak_admin_mock, ld
     response = test_client.post('/v1/accounts', json={'email': 'test_email', 'username': 'test_user'})
     assert response.status_code == 200
     assert response.json().get('result') == 'Request for a test account has been approved'
+    assert len(modify_group_members.call_args.args[0]) == 2
 
 
 def test_user_account_email_not_match(test_client, mocker, keycloak_admin_mock, ldap_client_mock):
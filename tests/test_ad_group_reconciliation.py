@@ -0,0 +1,133 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import asyncio
+
+from fastapi_sqlalchemy import db
+from keycloak import exceptions
+from sqlalchemy import text
+
+from app.models.sql_invitation import InvitationModel
+from app.services.reconciliation.ad_group import AD_RECONCILE_LOCK_KEY, ADGroupReconciliation
+
+
+def mock_both_sides(mocker):
+    realm_roles = [{'name': 'testproject-admin'}, {'name': 'testproject-contributor'}, {'name': 'platform-admin'}]
+    role_members = {
+        'testproject-admin': [{'username': 'admin', 'email': 'Admin@example.com'}],
+        'testproject-contributor': [
+            {'username': 'member', 'email': 'member@example.com'},
+            {'username': 'new', 'email': 'New@example.com'},
+            {'username': 'missing', 'email': 'missing@example.com'},
+        ],
+    }
+
+    def get_role_members(role_name):
+        if role_name not in role_members:
+            raise exceptions.KeycloakGetError('not found', response_code=404)
+        return role_members[role_name]
+
+    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_realm_roles', return_value=realm_roles)
+    mocker.patch(
+        'app.resources.keycloak_api.ops_admin.OperationsAdmin.get_role_members', side_effect=get_role_members
+    )
+    mocker.patch(
+        'app.services.data_providers.ldap_client.LdapClient.iter_users',
+        return_value=iter(
+            [
+                ('cn=admin', {'mail': [b'admin@example.com']}),
+                ('cn=member', {'mail': [b'member@example.com']}),
+                ('cn=former', {'mail': [b'former@example.com']}),
+                ('cn=service', {}),
+            ]
+        ),
+    )
+    mocker.patch(
+        'app.services.data_providers.ldap_client.LdapClient.get_users_by_emails',
+        return_value={'new@example.com': ('cn=new', {})},
+    )
+    return mocker.patch(
+        'app.services.data_providers.ldap_client.LdapClient.update_group_members',
+        side_effect=lambda operation_type, group_dn, user_dns: [{'user_dn': x, 'status': 'success'} for x in user_dns],
+    )
+
+
+def test_reconcile_applies_the_difference(test_client, mocker, keycloak_admin_mock, ldap_client_mock):
+    update_group_members = mock_both_sides(mocker)
+
+    reports = asyncio.run(ADGroupReconciliation().reconcile())
+
+    assert len(reports) == 1
+    report = reports[0]
+    assert report['project_code'] == 'testproject'
+    assert report['to_add'] == ['New@example.com']
+    assert report['to_remove'] == ['former@example.com']
+    assert report['not_in_ad'] == ['missing@example.com']
+    assert update_group_members.call_args_list == [
+        mocker.call('add', 'testproject', ['cn=new']),
+        mocker.call('remove', 'testproject', ['cn=former']),
+    ]
+
+
+def test_reconcile_endpoint_dry_run(test_client, mocker, keycloak_admin_mock, ldap_client_mock):
+    update_group_members = mock_both_sides(mocker)
+
+    response = test_client.post('/v1/user/ad-group/reconcile', json={'project_codes': ['testproject']})
+    assert response.status_code == 200
+    assert response.json()['result'][0]['to_add'] == ['New@example.com']
+    assert response.json()['result'][0]['results'] == []
+    update_group_members.assert_not_called()
+
+
+def test_reconcile_skips_unknown_project(test_client, mocker, keycloak_admin_mock, ldap_client_mock):
+    update_group_members = mock_both_sides(mocker)
+
+    reports = asyncio.run(ADGroupReconciliation().reconcile(['unknownproject']))
+
+    assert reports == [{'project_code': 'unknownproject', 'group_dn': 'unknownproject', 'skipped': True}]
+    update_group_members.assert_not_called()
+
+
+def test_reconcile_keeps_the_pending_invitees(test_client, mocker, keycloak_admin_mock, ldap_client_mock):
+    update_group_members = mock_both_sides(mocker)
+    invite = {'email': 'Former@example.com', 'project_code': 'testproject', 'status': 'pending'}
+    with db():
+        db.session.add(InvitationModel(**invite, invited_by='admin', platform_role='member', project_role='admin'))
+        db.session.commit()
+
+    try:
+        reports = asyncio.run(ADGroupReconciliation().reconcile())
+    finally:
+        with db():
+            db.session.query(InvitationModel).filter_by(**invite).delete()
+            db.session.commit()
+
+    assert reports[0]['to_remove'] == []
+    assert update_group_members.call_args_list == [mocker.call('add', 'testproject', ['cn=new'])]
+
+
+def test_reconcile_endpoint_waits_for_the_background_run(test_client, mocker, keycloak_admin_mock, ldap_client_mock):
+    update_group_members = mock_both_sides(mocker)
+
+    with db():
+        db.session.execute(text('SELECT pg_advisory_lock(:key)'), {'key': AD_RECONCILE_LOCK_KEY})
+        try:
+            response = test_client.post('/v1/user/ad-group/reconcile', json={'dry_run': False})
+        finally:
+            db.session.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': AD_RECONCILE_LOCK_KEY})
+
+    assert response.status_code == 409
+    update_group_members.assert_not_called()
@@ -13,8 +13,13 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
+import json
+
 from keycloak import exceptions
 
+from app.config import ConfigSettings
+
 test_user = {
     'username': 'test_user',
     'email': 'test_user',
@@ -24,9 +29,131 @@ test_user = {
     'attributes': {'status': ['active']},
 }
 
+def test_admin_client_is_shared_per_realm(mocker):
+    from app.resources.keycloak_api import ops_admin
+
+    mocker.patch.dict(ops_admin._admin_clients, clear=True)
+
+    assert ops_admin.get_admin_client('test-realm') is ops_admin.get_admin_client('test-realm')
+
+
+def test_admin_client_refreshes_token_on_unauthorized(mocker, httpx_mock):
+    from app.resources.keycloak_api import ops_admin
+
+    mocker.patch.dict(ops_admin._admin_clients, clear=True)
+
+    token_url = ConfigSettings.KEYCLOAK_SERVER_URL + 'realms/test-realm/protocol/openid-connect/token'
+    httpx_mock.add_response(method='POST', url=token_url, json={'access_token': 'expired', 'expires_in': 300})
+    httpx_mock.add_response(method='POST', url=token_url, json={'access_token': 'renewed', 'expires_in': 300})
+
+    url = ConfigSettings.KEYCLOAK_SERVER_URL + 'admin/realms/test-realm/users/test_user/role-mappings/realm'
+    httpx_mock.add_response(method='GET', url=url, status_code=401, match_headers={'Authorization': 'Bearer expired'})
+    httpx_mock.add_response(method='GET', url=url, json=[], match_headers={'Authorization': 'Bearer renewed'})
+
+    admin_client = ops_admin.get_admin_client('test-realm')
+    assert asyncio.run(admin_client.get_user_realm_roles('test_user')) == []
+    assert admin_client.token['access_token'] == 'renewed'
+
+
+def test_admin_client_fetches_all_pages(mocker, httpx_mock):
+    from app.resources.keycloak_api import ops_admin
+
+    mocker.patch.object(ops_admin, 'PAGE_SIZE', 2)
+    mocker.patch.dict(ops_admin._admin_clients, clear=True)
+
+    token_url = ConfigSettings.KEYCLOAK_SERVER_URL + 'realms/test-realm/protocol/openid-connect/token'
+    httpx_mock.add_response(method='POST', url=token_url, json={'access_token': 'test', 'expires_in': 300})
+
+    users = [{'id': str(i), 'username': 'test_user%s' % i} for i in range(3)]
+    url = ConfigSettings.KEYCLOAK_SERVER_URL + 'admin/realms/test-realm/users?search=test_user2'
+    httpx_mock.add_response(method='GET', url=url + '&first=0&max=2', json=users[:2])
+    httpx_mock.add_response(method='GET', url=url + '&first=2&max=2', json=users[2:])
+
+    admin_client = ops_admin.get_admin_client('test-realm')
+    assert asyncio.run(admin_client.get_user_id('test_user2')) == '2'
+
+
+def test_admin_client_resolves_realm_roles_from_cache(mocker, httpx_mock):
+    from app.resources.keycloak_api import ops_admin
+
+    mocker.patch.dict(ops_admin._admin_clients, clear=True)
+
+    token_url = ConfigSettings.KEYCLOAK_SERVER_URL + 'realms/test-realm/protocol/openid-connect/token'
+    httpx_mock.add_response(method='POST', url=token_url, json={'access_token': 'test', 'expires_in': 300})
+
+    admin_url = ConfigSettings.KEYCLOAK_SERVER_URL + 'admin/realms/test-realm'
+    admin_role = {'id': '1', 'name': 'test-admin'}
+    new_role = {'id': '2', 'name': 'new-admin'}
+    httpx_mock.add_response(method='GET', url=admin_url + '/roles', json=[admin_role])
+    httpx_mock.add_response(method='POST', url=admin_url + '/roles', status_code=201)
+    httpx_mock.add_response(method='GET', url=admin_url + '/roles/new-admin', json=new_role)
+    httpx_mock.add_response(method='POST', url=admin_url + '/users/test_user/role-mappings/realm', status_code=204)
+
+    async def assign_roles():
+        admin_client = ops_admin.get_admin_client('test-realm')
+        await admin_client.assign_user_role('test_user', 'test-admin')
+        await admin_client.create_project_realm_roles(['admin'], 'new')
+        await admin_client.assign_user_role('test_user', 'new-admin')
+
+    asyncio.run(assign_roles())
+
+    catalog_requests = httpx_mock.get_requests(method='GET', url=admin_url + '/roles')
+    assert len(catalog_requests) == 1
+    assign_requests = httpx_mock.get_requests(method='POST', url=admin_url + '/users/test_user/role-mappings/realm')
+    assert [json.loads(request.content) for request in assign_requests] == [[admin_role], [new_role]]
+
+
+def test_admin_client_refreshes_platform_admins_on_role_change(mocker, httpx_mock):
+    from app.resources.keycloak_api import ops_admin
+
+    mocker.patch.dict(ops_admin._admin_clients, clear=True)
+
+    token_url = ConfigSettings.KEYCLOAK_SERVER_URL + 'realms/test-realm/protocol/openid-connect/token'
+    httpx_mock.add_response(method='POST', url=token_url, json={'access_token': 'test', 'expires_in': 300})
+
+    admin_url = ConfigSettings.KEYCLOAK_SERVER_URL + 'admin/realms/test-realm'
+    admin_users_url = admin_url + '/roles/platform-admin/users?first=0&max=100'
+    httpx_mock.add_response(method='GET', url=admin_users_url, json=[{'id': 'admin_user', 'username': 'admin_user'}])
+    httpx_mock.add_response(method='GET', url=admin_url + '/roles', json=[{'id': '1', 'name': 'platform-admin'}])
+    httpx_mock.add_response(method='POST', url=admin_url + '/users/test_user/role-mappings/realm', status_code=204)
+
+    async def check_admins():
+        admin_client = ops_admin.get_admin_client('test-realm')
+        assert await admin_client.is_platform_admin('admin_user')
+        assert not await admin_client.is_platform_admin('test_user')
+        await admin_client.assign_user_role('test_user', 'platform-admin')
+        httpx_mock.add_response(
+            method='GET',
+            url=admin_users_url,
+            json=[{'id': 'admin_user', 'username': 'admin_user'}, {'id': 'test_user', 'username': 'test_user'}],
+        )
+        assert await admin_client.is_platform_admin('test_user')
+
+    asyncio.run(check_admins())
+    assert len(httpx_mock.get_requests(method='GET', url=admin_users_url)) == 2
+
+
+def test_admin_client_coalesces_concurrent_lookups(mocker, httpx_mock):
+    from app.resources.keycloak_api import ops_admin
+
+    mocker.patch.dict(ops_admin._admin_clients, clear=True)
+
+    token_url = ConfigSettings.KEYCLOAK_SERVER_URL + 'realms/test-realm/protocol/openid-connect/token'
+    httpx_mock.add_response(method='POST', url=token_url, json={'access_token': 'test', 'expires_in': 300})
+    user_url = ConfigSettings.KEYCLOAK_SERVER_URL + 'admin/realms/test-realm/users/test_user'
+    httpx_mock.add_response(method='GET', url=user_url, json=test_user)
+
+    async def get_users():
+        admin_client = ops_admin.get_admin_client('test-realm')
+        return await asyncio.gather(*[admin_client.get_user_by_id('test_user') for _ in range(5)])
+
+    assert asyncio.run(get_users()) == [test_user] * 5
+    assert len(httpx_mock.get_requests(method='GET', url=user_url)) == 1
+
+
 def test_get_user_info_by_id(test_client, mocker, keycloak_admin_mock):
     mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_user_by_id', return_value=test_user.copy())
-    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_user_realm_roles', return_value=[])
+    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_platform_admins', return_value={})
 
     response = test_client.get('/v1/admin/user', params={'user_id': 'test_user'})
     assert response.status_code == 200
@@ -36,7 +163,7 @@ def test_get_user_info_by_username(test_client, mocker, keycloak_admin_mock):
     mocker.patch(
         'app.resources.keycloak_api.ops_admin.OperationsAdmin.get_user_by_username', return_value=test_user.copy()
     )
-    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_user_realm_roles', return_value=[])
+    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_platform_admins', return_value={})
 
     response = test_client.get('/v1/admin/user', params={'username': 'test_user'})
     assert response.status_code == 200
@@ -46,7 +173,7 @@ def test_get_user_info_by_email(test_client, mocker, keycloak_admin_mock):
     mocker.patch(
         'app.resources.keycloak_api.ops_admin.OperationsAdmin.get_user_by_email', return_value=test_user.copy()
     )
-    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_user_realm_roles', return_value=[])
+    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_platform_admins', return_value={})
 
     response = test_client.get('/v1/admin/user', params={'email': 'test_user'})
     assert response.status_code == 200
@@ -57,8 +184,8 @@ def test_get_user_with_admin_role(test_client, mocker, keycloak_admin_mock):
         'app.resources.keycloak_api.ops_admin.OperationsAdmin.get_user_by_email', return_value=test_user.copy()
     )
     mocker.patch(
-        'app.resources.keycloak_api.ops_admin.OperationsAdmin.get_user_realm_roles',
-        return_value=[{'name': 'platform-admin'}],
+        'app.resources.keycloak_api.ops_admin.OperationsAdmin.get_platform_admins',
+        return_value={'test_user': 'test_user'},
     )
 
     response = test_client.get('/v1/admin/user', params={'email': 'test_user'})
@@ -71,8 +198,8 @@ def test_get_user_with_member_role(test_client, mocker, keycloak_admin_mock):
         'app.resources.keycloak_api.ops_admin.OperationsAdmin.get_user_by_email', return_value=test_user.copy()
     )
     mocker.patch(
-        'app.resources.keycloak_api.ops_admin.OperationsAdmin.get_user_realm_roles',
-        return_value=[{'name': 'not-admin'}],
+        'app.resources.keycloak_api.ops_admin.OperationsAdmin.get_platform_admins',
+        return_value={'admin_user': 'admin_user'},
     )
 
     response = test_client.get('/v1/admin/user', params={'email': 'test_user'})
@@ -97,7 +224,7 @@ def test_get_user_info_user_not_found(test_client, mocker, keycloak_admin_mock):
 
 
 def test_update_user_attribute(test_client, mocker, keycloak_admin_mock):
-    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_user_id', return_value=test_user.copy())
+    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_user_id', return_value='test_user')
     mocker.patch(
         'app.resources.keycloak_api.ops_admin.OperationsAdmin.update_user_attributes',
         return_value={'test_attribute': 'test_value'},
@@ -115,6 +242,37 @@ def test_update_user_attribute(test_client, mocker, keycloak_admin_mock):
     assert response.json().get('result') == {'test_attribute': 'test_value'}
 
 
+def test_update_user_last_login_is_written_behind(test_client, mocker, keycloak_admin_mock, attribute_buffer):
+    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_user_id', return_value='test_user')
+    update = mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.update_user_attributes')
+
+    response = test_client.put('/v1/admin/user', json={'last_login': True, 'username': 'test_user'})
+    assert response.status_code == 200
+    assert 'last_login' in response.json().get('result')
+    update.assert_not_called()
+
+    asyncio.run(attribute_buffer.flush())
+    update.assert_called_once_with('test_user', response.json().get('result'))
+
+
+def test_update_user_announcement_includes_pending_attributes(
+    test_client, mocker, keycloak_admin_mock, attribute_buffer
+):
+    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_user_id', return_value='test_user')
+    update = mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.update_user_attributes', return_value={})
+    attribute_buffer.add('test_user', {'last_login': '2022-01-01T00:00:00'})
+
+    response = test_client.put(
+        '/v1/admin/user',
+        json={'username': 'test_user', 'announcement': {'project_code': 'test_project', 'announcement_pk': '111'}},
+    )
+    assert response.status_code == 200
+    update.assert_called_once_with(
+        'test_user', {'last_login': '2022-01-01T00:00:00', 'announcement_test_project': '111'}
+    )
+    assert attribute_buffer.take('test_user') == {}
+
+
 def test_update_user_attribute_missing_username(test_client, mocker, keycloak_admin_mock):
     mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_user_id', return_value=test_user.copy())
     mocker.patch(
@@ -317,3 +475,27 @@ def test_list_users_under_roles_filter_order_by_username(test_client, mocker, ke
     assert response.status_code == 200
     user_list = response.json().get('result')
     assert user_list[0].get('name') > user_list[1].get('name')
+
+
+def test_admin_events_stop_at_the_applied_events(mocker, httpx_mock):
+    from app.resources.keycloak_api import ops_admin
+
+    mocker.patch.dict(ops_admin._admin_clients, clear=True)
+    mocker.patch.object(ops_admin, 'PAGE_SIZE', 2)
+
+    token_url = ConfigSettings.KEYCLOAK_SERVER_URL + 'realms/test-realm/protocol/openid-connect/token'
+    httpx_mock.add_response(method='POST', url=token_url, json={'access_token': 'test', 'expires_in': 300})
+    events_url = ConfigSettings.KEYCLOAK_SERVER_URL + 'admin/realms/test-realm/admin-events'
+    # the page after the applied events is never requested
+    pages = [[{'time': 5000}, {'time': 4000}], [{'time': 3000}, {'time': 2000}]]
+    for first, page in zip([0, 2], pages):
+        httpx_mock.add_response(
+            method='GET', url=f'{events_url}?resourceTypes=USER&max=2&dateFrom=2022-01-01&first={first}', json=page
+        )
+
+    async def get_events():
+        admin_client = ops_admin.get_admin_client('test-realm')
+        return await admin_client.get_admin_events(['USER'], '2022-01-01', since=2500)
+
+    assert asyncio.run(get_events()) == [{'time': 5000}, {'time': 4000}, {'time': 3000}]
+    assert len(httpx_mock.get_requests(method='GET')) == 2
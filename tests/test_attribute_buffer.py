@@ -0,0 +1,68 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+from keycloak import exceptions
+
+from app.resources.keycloak_api.attribute_buffer import UserAttributeBuffer
+
+
+def test_attribute_buffer_coalesces_and_requeues(mocker):
+    update = mocker.patch(
+        'app.resources.keycloak_api.ops_admin.OperationsAdmin.update_user_attributes',
+        side_effect=[None, Exception('keycloak is down')],
+    )
+    buffer = UserAttributeBuffer()
+    buffer.add('user_1', {'last_login': '2022-01-01T00:00:00'})
+    buffer.add('user_1', {'last_login': '2022-01-02T00:00:00'})
+    buffer.add('user_2', {'last_login': '2022-01-01T00:00:00'})
+
+    asyncio.run(buffer.flush())
+
+    assert update.call_count == 2
+    assert update.call_args_list[0].args == ('user_1', {'last_login': '2022-01-02T00:00:00'})
+    # the failed update is kept for the next flush
+    assert buffer.take('user_2') == {'last_login': '2022-01-01T00:00:00'}
+
+
+def test_attribute_buffer_drops_rejected_updates(mocker):
+    mocker.patch(
+        'app.resources.keycloak_api.ops_admin.OperationsAdmin.update_user_attributes',
+        side_effect=exceptions.KeycloakGetError('User not found', response_code=404),
+    )
+    buffer = UserAttributeBuffer()
+    buffer.add('user_1', {'last_login': '2022-01-01T00:00:00'})
+
+    asyncio.run(buffer.flush())
+
+    assert buffer.take('user_1') == {}
+
+
+def test_attribute_buffer_drops_updates_out_of_retries(mocker):
+    mocker.patch('app.config.ConfigSettings.KEYCLOAK_ATTRIBUTE_FLUSH_RETRIES', 2)
+    update = mocker.patch(
+        'app.resources.keycloak_api.ops_admin.OperationsAdmin.update_user_attributes',
+        side_effect=exceptions.KeycloakGetError('keycloak is down', response_code=503),
+    )
+    buffer = UserAttributeBuffer()
+    buffer.add('user_1', {'last_login': '2022-01-01T00:00:00'})
+
+    for _ in range(4):
+        asyncio.run(buffer.flush())
+
+    # the first try and two retries, the fourth flush has nothing left
+    assert update.call_count == 3
+    assert buffer.take('user_1') == {}
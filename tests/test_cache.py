@@ -0,0 +1,78 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+from app.resources.cache import SingleFlight, TTLCache
+
+
+def test_ttl_cache_expires_entries(mocker):
+    now = mocker.patch('app.resources.cache.time.monotonic', return_value=100)
+    cache = TTLCache(maxsize=10, ttl=5)
+    cache.set('key', 'value')
+    assert cache.get('key') == 'value'
+
+    now.return_value = 105
+    assert cache.get('key') is None
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('first', 1)
+    cache.set('second', 2)
+    cache.get('first')
+    cache.set('third', 3)
+
+    assert 'first' in cache
+    assert 'second' not in cache
+    assert 'third' in cache
+
+
+def test_single_flight_shares_the_in_flight_call():
+    calls = []
+
+    async def lookup(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return {'key': key}
+
+    async def run():
+        single_flight = SingleFlight()
+        results = await asyncio.gather(*[single_flight.do(('lookup', 'a'), lookup, 'a') for _ in range(5)])
+        results[0]['key'] = 'changed'
+        assert results[1] == {'key': 'a'}
+        # the key is released once the call is done
+        await single_flight.do(('lookup', 'a'), lookup, 'a')
+
+    asyncio.run(run())
+    assert calls == ['a', 'a']
+
+
+def test_single_flight_shares_the_exception():
+    calls = []
+
+    async def lookup():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError('lookup failed')
+
+    async def run():
+        single_flight = SingleFlight()
+        return await asyncio.gather(*[single_flight.do('lookup', lookup) for _ in range(3)], return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(isinstance(result, ValueError) for result in results)
+
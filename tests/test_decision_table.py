@@ -0,0 +1,79 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import itertools
+import random
+
+import casbin
+import pytest
+
+from app.routers.permissions.decision_table import DecisionTable
+from app.routers.permissions.enforcer import MODEL_PATH
+
+SUBJECTS = ['admin', 'contributor', 'collaborator', 'member', 'platform_admin', 'alice', 'bob', '*']
+DOMAINS = ['greenroom', 'core', '*']
+OBJECTS = ['file', 'folder', 'project']
+ACTIONS = ['view', 'upload', 'delete', '*']
+
+
+def load_casbin(tmp_path, policy, grouping_policy):
+    lines = [', '.join(['p'] + rule) for rule in policy] + [', '.join(['g'] + rule) for rule in grouping_policy]
+    policy_path = tmp_path / 'policy.csv'
+    policy_path.write_text('\n'.join(lines) + '\n')
+    return casbin.Enforcer(MODEL_PATH, str(policy_path))
+
+
+def random_rules(rng):
+    policy = [
+        [rng.choice(SUBJECTS), rng.choice(DOMAINS), rng.choice(OBJECTS), rng.choice(ACTIONS)]
+        for _ in range(rng.randint(0, 12))
+    ]
+    grouping_policy = [
+        [rng.choice(SUBJECTS), rng.choice(SUBJECTS), rng.choice(DOMAINS)] for _ in range(rng.randint(0, 8))
+    ]
+    return policy, grouping_policy
+
+
+@pytest.mark.parametrize('seed', range(25))
+def test_decision_table_matches_casbin(tmp_path, seed):
+    rng = random.Random(seed)
+    policy, grouping_policy = random_rules(rng)
+    enforcer = load_casbin(tmp_path, policy, grouping_policy)
+    table = DecisionTable.from_enforcer(enforcer)
+
+    for request in itertools.product(SUBJECTS, DOMAINS, OBJECTS + ['dataset'], ACTIONS + ['copy']):
+        assert table.enforce(*request) == enforcer.enforce(*request), (request, policy, grouping_policy)
+
+
+def test_decision_table_follows_role_hierarchy_limit(tmp_path):
+    chain = [f'role{i}' for i in range(14)]
+    grouping_policy = [[x, y, 'core'] for x, y in zip(chain, chain[1:])]
+    request = ('role0', 'core', 'file', 'view')
+
+    decisions = []
+    for role in chain[1:]:
+        policy = [[role, 'core', 'file', 'view']]
+        enforcer = load_casbin(tmp_path, policy, grouping_policy)
+        assert DecisionTable(policy, grouping_policy).enforce(*request) == enforcer.enforce(*request)
+        decisions.append(enforcer.enforce(*request))
+
+    # the roles past the hierarchy limit are not inherited
+    assert decisions == [True] * 11 + [False] * 2
+
+
+def test_decision_table_rejects_invalid_policy_size():
+    with pytest.raises(ValueError):
+        DecisionTable([['admin', 'core', 'file']], [])
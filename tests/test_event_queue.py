@@ -0,0 +1,107 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import asyncio
+from uuid import uuid4
+
+from fastapi_sqlalchemy import db
+
+from app.commons.psql_services.event_queue import UserEventQueue
+from app.models.sql_events import UserEventModel
+
+
+def test_event_queue_batches_the_events(test_client, mocker, keycloak_admin_mock):
+    mocker.patch('app.config.ConfigSettings.EVENT_FLUSH_INTERVAL', 3600)
+    user_ids = {'admin': uuid4(), 'event_queue_user': uuid4()}
+    get_user = mocker.patch(
+        'app.resources.keycloak_api.ops_admin.OperationsAdmin.get_user_by_username',
+        side_effect=lambda username: {'id': user_ids[username], 'username': username},
+    )
+    insert = mocker.spy(UserEventQueue, '_insert')
+    event_queue = UserEventQueue()
+
+    async def run():
+        event_queue.start()
+        for project_code in ['project_1', 'project_2', 'project_3']:
+            await event_queue.add(
+                {
+                    'operator': 'admin',
+                    'target_user': 'event_queue_user',
+                    'event_type': 'ROLE_CHANGE',
+                    'detail': {'project_code': project_code, 'to': 'admin', 'from': 'contributor'},
+                }
+            )
+        assert insert.call_count == 0
+        await event_queue.stop()
+
+    asyncio.run(run())
+
+    insert.assert_called_once()
+    assert get_user.call_count == 2
+    with db():
+        events = db.session.query(UserEventModel).filter_by(target_user='event_queue_user').all()
+    assert sorted(x.detail['project_code'] for x in events) == ['project_1', 'project_2', 'project_3']
+    assert {x.operator_id for x in events} == {user_ids['admin']}
+
+
+def test_event_queue_keeps_the_failed_events(test_client, mocker):
+    mocker.patch.object(UserEventQueue, '_insert', side_effect=Exception('database is down'))
+    event_queue = UserEventQueue()
+
+    asyncio.run(event_queue.add({'operator_id': str(uuid4()), 'event_type': 'ACCOUNT_DISABLE'}))
+
+    assert len(event_queue._pending) == 1
+
+
+def test_event_queue_drops_the_rejected_events(test_client, mocker):
+    event_id = uuid4()
+    event_queue = UserEventQueue()
+    asyncio.run(event_queue.add({'id': event_id, 'target_user': 'rejected_event_user', 'event_type': 'ROLE_CHANGE'}))
+
+    async def run():
+        event_queue._pending = [
+            {'id': event_id, 'target_user': 'rejected_event_user', 'event_type': 'ACCOUNT_DISABLE'},
+            {'target_user': 'rejected_event_user', 'event_type': 'ACCOUNT_ACTIVATED'},
+        ]
+        await event_queue.flush()
+
+    asyncio.run(run())
+
+    # the duplicated id is dropped, the other event of the batch is written
+    assert event_queue._pending == []
+    with db():
+        events = db.session.query(UserEventModel).filter_by(target_user='rejected_event_user').all()
+    assert sorted(x.event_type for x in events) == ['ACCOUNT_ACTIVATED', 'ROLE_CHANGE']
+
+
+def test_event_queue_is_bounded(test_client, mocker):
+    mocker.patch('app.config.ConfigSettings.EVENT_FLUSH_RETRIES', 3)
+    mocker.patch('app.config.ConfigSettings.EVENT_QUEUE_MAX_SIZE', 2)
+    mocker.patch.object(UserEventQueue, '_insert', side_effect=Exception('database is down'))
+    event_queue = UserEventQueue()
+
+    async def run():
+        for event_type in ['ROLE_CHANGE', 'ACCOUNT_DISABLE', 'ACCOUNT_ACTIVATED']:
+            await event_queue.add({'operator_id': str(uuid4()), 'event_type': event_type})
+
+    asyncio.run(run())
+    # the oldest event is dropped to keep the size
+    assert [x['event_type'] for x in event_queue._pending] == ['ACCOUNT_DISABLE', 'ACCOUNT_ACTIVATED']
+
+    # then the next one runs out of retries
+    asyncio.run(event_queue.flush())
+    asyncio.run(event_queue.flush())
+    assert [x['event_type'] for x in event_queue._pending] == ['ACCOUNT_ACTIVATED']
@@ -0,0 +1,173 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import ldap
+import pytest
+from ldap.controls import SimplePagedResultsControl
+
+from app.resources.cache import TTLCache
+from app.services.data_providers import ldap_client
+from app.services.data_providers.ldap_client import LdapClient
+
+user_dn = 'CN=test user,OU=Users,DC=test,DC=com'
+user_entry = {'mail': [b'test@example.com'], 'memberOf': [b'CN=test-group,OU=Groups,DC=test,DC=com']}
+
+
+@pytest.fixture
+def ldap_conn(mocker):
+    conn = mocker.MagicMock()
+    conn.search_s.return_value = [(user_dn, user_entry)]
+    pool = mocker.MagicMock()
+    pool.acquire.return_value = conn
+    mocker.patch.object(ldap_client, 'get_ldap_pool', return_value=pool)
+    mocker.patch.object(ldap_client, '_user_cache', TTLCache(maxsize=100, ttl=60))
+    return conn
+
+
+def test_get_user_by_email_is_cached(ldap_conn):
+    with LdapClient() as client:
+        assert client.is_account_in_ad('test@example.com')
+        assert client.get_user_by_email('test@example.com') == (user_dn, user_entry)
+
+    ldap_conn.search_s.assert_called_once()
+
+
+def test_get_user_by_email_can_bypass_the_cache(ldap_conn):
+    fresh_entry = {**user_entry, 'memberOf': user_entry['memberOf'] + [b'CN=other-group,OU=Groups,DC=test,DC=com']}
+
+    with LdapClient() as client:
+        client.get_user_by_email('test@example.com')
+        ldap_conn.search_s.return_value = [(user_dn, fresh_entry)]
+        assert client.get_user_by_email('test@example.com', use_cache=False) == (user_dn, fresh_entry)
+        # the cache is refreshed with the searched entry
+        assert client.get_user_by_email('test@example.com') == (user_dn, fresh_entry)
+
+    assert ldap_conn.search_s.call_count == 2
+
+
+def test_user_not_in_ad_is_cached(mocker, ldap_conn):
+    now = mocker.patch('app.resources.cache.time.monotonic', return_value=100)
+    ldap_conn.search_s.return_value = []
+
+    with LdapClient() as client:
+        assert not client.is_account_in_ad('test@example.com')
+        assert client.get_user_by_username('test') == (None, None)
+        assert not client.is_account_in_ad('test@example.com')
+        assert ldap_conn.search_s.call_count == 2
+
+        now.return_value = 200
+        assert not client.is_account_in_ad('test@example.com')
+        assert ldap_conn.search_s.call_count == 3
+
+
+def test_group_changes_update_cached_user(ldap_conn):
+    with LdapClient() as client:
+        client.get_user_by_email('test@example.com')
+        client.add_user_to_group(user_dn, 'cn=test-project,ou=Groups,dc=test,dc=com')
+        client.remove_user_from_group(user_dn, 'cn=test-group,ou=groups,dc=test,dc=com')
+        _, entry = client.get_user_by_email('test@example.com')
+
+    assert entry['memberOf'] == [b'cn=test-project,ou=Groups,dc=test,dc=com']
+    assert user_entry['memberOf'] == [b'CN=test-group,OU=Groups,DC=test,DC=com']
+    ldap_conn.search_s.assert_called_once()
+
+
+def test_modify_group_members_is_pipelined(ldap_conn):
+    ldap_conn.modify.side_effect = [1, 2, 3]
+    ldap_conn.result.side_effect = [None, ldap.ALREADY_EXISTS(), ldap.UNWILLING_TO_PERFORM()]
+
+    with LdapClient() as client:
+        client.get_user_by_email('test@example.com')
+        results = client.modify_group_members(
+            [
+                ('add', user_dn, 'cn=test-project,ou=Groups,dc=test,dc=com'),
+                ('add', user_dn, 'cn=test-admin,ou=Groups,dc=test,dc=com'),
+                ('remove', user_dn, 'cn=test-other,ou=Groups,dc=test,dc=com'),
+            ]
+        )
+        _, entry = client.get_user_by_email('test@example.com')
+
+    assert [x['status'] for x in results] == ['success', 'conflict', 'not_found']
+    calls = [name for name, _, _ in ldap_conn.mock_calls if name in ('modify', 'result')]
+    assert calls == ['modify'] * 3 + ['result'] * 3
+    assert len(entry['memberOf']) == 3
+
+
+def test_get_users_by_emails_uses_one_search(mocker, ldap_conn):
+    mocker.patch('app.config.ConfigSettings.LDAP_BULK_FILTER_SIZE', 2)
+    ldap_conn.search_s.side_effect = [[(user_dn, user_entry), (None, ['ldap://referral'])], []]
+
+    with LdapClient() as client:
+        users = client.get_users_by_emails(['test@example.com', 'other(*)@example.com', 'unknown@example.com'])
+        assert users == {'test@example.com': (user_dn, user_entry)}
+        assert not client.is_account_in_ad('other(*)@example.com')
+        assert client.get_user_by_email('test@example.com') == (user_dn, user_entry)
+
+    assert ldap_conn.search_s.call_count == 2
+    search_filter = ldap_conn.search_s.call_args_list[0].args[2]
+    assert search_filter == r'(&(objectClass=user)(|(mail=test@example.com)(mail=other\28\2a\29@example.com)))'
+
+
+def test_get_users_by_emails_ignores_the_case(ldap_conn):
+    ldap_conn.search_s.return_value = [(user_dn, user_entry)]
+
+    with LdapClient() as client:
+        users = client.get_users_by_emails(['Test@Example.com'])
+
+    assert users == {'Test@Example.com': (user_dn, user_entry)}
+
+
+def test_update_group_members_falls_back_per_user(ldap_conn):
+    ldap_conn.modify_s.side_effect = ldap.ALREADY_EXISTS()
+    ldap_conn.modify.side_effect = [1, 2]
+    ldap_conn.result.side_effect = [None, ldap.ALREADY_EXISTS()]
+
+    with LdapClient() as client:
+        results = client.update_group_members('add', 'cn=test-project', ['cn=user1', 'cn=user2'])
+
+    modlist = [(ldap.MOD_ADD, 'member', [b'cn=user1', b'cn=user2'])]
+    ldap_conn.modify_s.assert_called_once_with('cn=test-project', modlist)
+    assert [x['status'] for x in results] == ['success', 'conflict']
+
+
+def test_search_is_projected_on_user_base(mocker, ldap_conn):
+    mocker.patch('app.config.ConfigSettings.LDAP_USER_SEARCH_BASE', 'ou=Users,dc=test,dc=com')
+
+    with LdapClient() as client:
+        client.get_user_by_email('test@example.com')
+
+    base, _, _, attributes = ldap_conn.search_s.call_args.args
+    assert base == 'ou=Users,dc=test,dc=com'
+    assert attributes == ldap_client.USER_ATTRIBUTES
+
+
+def test_iter_users_follows_the_paged_results_cookie(mocker, ldap_conn):
+    def page(cookie):
+        control = mocker.Mock(controlType=SimplePagedResultsControl.controlType, cookie=cookie)
+        return [control]
+
+    ldap_conn.result3.side_effect = [
+        (None, [('cn=user1', {}), (None, ['ldap://referral'])], 1, page(b'next')),
+        (None, [('cn=user2', {})], 2, page(b'')),
+    ]
+
+    with LdapClient() as client:
+        users = [user_dn for user_dn, _ in client.iter_users(page_size=1)]
+
+    assert users == ['cn=user1', 'cn=user2']
+    assert ldap_conn.search_ext.call_count == 2
+    control = ldap_conn.search_ext.call_args.kwargs['serverctrls'][0]
+    assert control.size == 1 and control.cookie == b'next'
@@ -0,0 +1,158 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import asyncio
+import threading
+
+import ldap
+import pytest
+
+from app.services.data_providers import ldap_async, ldap_client, ldap_pool
+from app.services.data_providers.ldap_async import AsyncLdapClient
+from app.services.data_providers.ldap_client import LdapClient
+from app.services.data_providers.ldap_pool import LdapConnectionPool, LdapPoolExhausted
+
+
+@pytest.fixture
+def ldap_connections(mocker):
+    connections = []
+
+    def initialize(*args, **kwargs):
+        conn = mocker.MagicMock()
+        connections.append(conn)
+        return conn
+
+    mocker.patch.object(ldap_pool.ldap, 'initialize', side_effect=initialize)
+    return connections
+
+
+def test_pool_reuses_bound_connection(ldap_connections):
+    pool = LdapConnectionPool(maxsize=2, idle_timeout=60, health_check_interval=60, acquire_timeout=0)
+    conn = pool.acquire()
+    pool.release(conn)
+    assert pool.acquire() is conn
+    assert len(ldap_connections) == 1
+    conn.simple_bind_s.assert_called_once()
+
+
+def test_pool_is_bounded(ldap_connections):
+    pool = LdapConnectionPool(maxsize=1, idle_timeout=60, health_check_interval=60, acquire_timeout=0)
+    conn = pool.acquire()
+    with pytest.raises(LdapPoolExhausted):
+        pool.acquire()
+
+    pool.release(conn, discard=True)
+    assert pool.acquire() is not conn
+    conn.unbind_s.assert_called_once()
+
+
+def test_pool_replaces_dead_connection(ldap_connections):
+    pool = LdapConnectionPool(maxsize=1, idle_timeout=60, health_check_interval=0, acquire_timeout=0)
+    conn = pool.acquire()
+    conn.whoami_s.side_effect = ldap.SERVER_DOWN()
+    pool.release(conn)
+
+    new_conn = pool.acquire()
+    assert new_conn is not conn
+    assert len(ldap_connections) == 2
+
+
+def test_pool_evicts_idle_connection(mocker, ldap_connections):
+    now = mocker.patch('app.services.data_providers.ldap_pool.time.monotonic', return_value=100)
+    pool = LdapConnectionPool(maxsize=1, idle_timeout=30, health_check_interval=60, acquire_timeout=0)
+    conn = pool.acquire()
+    pool.release(conn)
+
+    now.return_value = 200
+    assert pool.acquire() is not conn
+    conn.unbind_s.assert_called_once()
+
+
+def test_client_reconnects_when_server_down(mocker, ldap_connections):
+    pool = LdapConnectionPool(maxsize=1, idle_timeout=60, health_check_interval=60, acquire_timeout=0)
+    mocker.patch.object(ldap_client, 'get_ldap_pool', return_value=pool)
+
+    with LdapClient() as client:
+        client.conn.modify_s.side_effect = ldap.SERVER_DOWN()
+        assert client.add_user_to_group('cn=user', 'cn=group') == 'success'
+        assert client.conn is ldap_connections[1]
+
+    ldap_connections[0].unbind_s.assert_called_once()
+    assert pool.acquire() is ldap_connections[1]
+
+
+def test_async_client_runs_off_the_event_loop(mocker, ldap_client_mock):
+    def get_user_by_email(self, email, use_cache=True):
+        return threading.current_thread().name, {'mail': [email.encode()]}
+
+    mocker.patch.object(LdapClient, 'get_user_by_email', get_user_by_email)
+
+    async def lookup():
+        async with AsyncLdapClient() as ldap_cli:
+            return await ldap_cli.get_user_by_email('test@example.com')
+
+    thread_name, _ = asyncio.run(lookup())
+    assert thread_name.startswith('ldap')
+
+
+def test_async_client_releases_after_cancelled_call(ldap_client_mock, mocker):
+    started, finish = threading.Event(), threading.Event()
+    calls = []
+
+    def add_user_to_group(self, user_dn, group_dn):
+        started.set()
+        finish.wait(5)
+        calls.append('modify')
+
+    mocker.patch.object(LdapClient, 'add_user_to_group', add_user_to_group)
+    mocker.patch.object(LdapClient, 'disconnect', lambda self: calls.append('disconnect'))
+
+    async def cancel_and_disconnect():
+        ldap_cli = AsyncLdapClient()
+        await ldap_cli.connect()
+        task = asyncio.create_task(ldap_cli.add_user_to_group('cn=user', 'cn=group'))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        task.cancel()
+        disconnect = asyncio.create_task(ldap_cli.disconnect())
+        await asyncio.sleep(0.05)
+        finish.set()
+        await disconnect
+
+    asyncio.run(cancel_and_disconnect())
+    assert calls == ['modify', 'disconnect']
+
+
+def test_async_clients_wait_for_a_connection_off_the_threads(mocker, ldap_connections):
+    pool = LdapConnectionPool(maxsize=2, idle_timeout=60, health_check_interval=60, acquire_timeout=2)
+    mocker.patch.object(ldap_client, 'get_ldap_pool', return_value=pool)
+    mocker.patch.object(ldap_async, 'get_ldap_pool', return_value=pool)
+    mocker.patch('app.config.ConfigSettings.LDAP_THREAD_POOL_SIZE', 2)
+    mocker.patch.object(ldap_async, '_ldap_executor', None)
+
+    async def add_user(i):
+        async with AsyncLdapClient() as ldap_cli:
+            await asyncio.sleep(0.01)
+            return await ldap_cli.add_user_to_group(f'cn=user{i}', 'cn=group')
+
+    async def run():
+        return await asyncio.gather(*[add_user(i) for i in range(10)])
+
+    try:
+        # more clients than connections, none of them runs into the acquire timeout
+        assert asyncio.run(asyncio.wait_for(run(), 1)) == ['success'] * 10
+    finally:
+        ldap_async.close_ldap_executor()
+    assert len(ldap_connections) == 2
@@ -0,0 +1,290 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import time
+
+import pytest
+from sqlalchemy import create_engine
+
+from app.models.permissions import CasbinRule
+from app.routers.permissions import enforcer, policy_store
+
+
+@pytest.fixture
+def casbin_policy(db):
+    engine = create_engine(db.get_connection_url())
+
+    def insert_rules(rules):
+        engine.execute(
+            CasbinRule.__table__.insert(),
+            [{'ptype': 'p', 'v0': v0, 'v1': v1, 'v2': v2, 'v3': v3} for v0, v1, v2, v3 in rules],
+        )
+
+    yield insert_rules
+    engine.execute(CasbinRule.__table__.delete())
+
+
+def authorize(test_client, role, zone, resource, operation):
+    response = test_client.get(
+        '/v1/authorize', params={'role': role, 'zone': zone, 'resource': resource, 'operation': operation}
+    )
+    assert response.status_code == 200
+    return response.json()['result']['has_permission']
+
+
+def test_authorize_checks_the_policy(test_client, mocker, casbin_policy):
+    mocker.patch('app.config.ConfigSettings.CASBIN_POLICY_CHECK_INTERVAL', 0)
+    casbin_policy([('admin', 'greenroom', 'file', 'view'), ('contributor', '*', 'file', '*')])
+
+    assert authorize(test_client, 'admin', 'greenroom', 'file', 'view')
+    assert not authorize(test_client, 'admin', 'core', 'file', 'view')
+    assert authorize(test_client, 'contributor', 'core', 'file', 'delete')
+    assert not authorize(test_client, 'collaborator', 'greenroom', 'file', 'view')
+    assert authorize(test_client, 'platform_admin', 'greenroom', 'file', 'view')
+
+
+def test_authorize_batch(test_client, mocker, casbin_policy):
+    mocker.patch('app.config.ConfigSettings.CASBIN_POLICY_CHECK_INTERVAL', 0)
+    casbin_policy([('admin', 'greenroom', 'file', 'view'), ('contributor', '*', 'file', '*')])
+    checks = [
+        {'role': 'admin', 'zone': 'greenroom', 'resource': 'file', 'operation': 'view'},
+        {'role': 'admin', 'zone': 'core', 'resource': 'file', 'operation': 'view'},
+        {'role': 'contributor', 'zone': 'core', 'resource': 'file', 'operation': 'delete'},
+        {'role': 'admin', 'zone': 'greenroom', 'resource': 'file', 'operation': 'view'},
+    ]
+
+    response = test_client.post('/v1/authorize/batch', json={'checks': checks})
+    assert response.status_code == 200
+    assert [x['has_permission'] for x in response.json()['result']] == [True, False, True, True]
+    assert response.json()['result'][1]['zone'] == 'core'
+
+
+def test_authorize_batch_limit(test_client, mocker):
+    mocker.patch('app.config.ConfigSettings.CASBIN_BATCH_MAX_CHECKS', 1)
+    check = {'role': 'admin', 'zone': 'greenroom', 'resource': 'file', 'operation': 'view'}
+
+    response = test_client.post('/v1/authorize/batch', json={'checks': [check, check]})
+    assert response.status_code == 400
+
+
+def test_authorize_reloads_only_on_policy_change(test_client, mocker, casbin_policy):
+    mocker.patch('app.config.ConfigSettings.CASBIN_POLICY_CHECK_INTERVAL', 0)
+    casbin_policy([('admin', 'greenroom', 'file', 'view')])
+    assert authorize(test_client, 'admin', 'greenroom', 'file', 'view')
+
+    load = mocker.spy(enforcer.PolicyEnforcer, 'load')
+    assert not authorize(test_client, 'admin', 'greenroom', 'file', 'upload')
+    load.assert_not_called()
+
+    casbin_policy([('admin', 'greenroom', 'file', 'upload')])
+    assert authorize(test_client, 'admin', 'greenroom', 'file', 'upload')
+    load.assert_called_once()
+
+
+def test_authorize_checks_version_after_interval(test_client, mocker, casbin_policy):
+    mocker.patch('app.config.ConfigSettings.CASBIN_POLICY_CHECK_INTERVAL', 3600)
+    policy_enforcer = enforcer.PolicyEnforcer()
+    mocker.patch.object(enforcer, '_policy_enforcer', policy_enforcer)
+    policy_enforcer.load()
+
+    get_version = mocker.spy(policy_enforcer, 'get_version')
+    casbin_policy([('admin', 'greenroom', 'file', 'view')])
+    assert not authorize(test_client, 'admin', 'greenroom', 'file', 'view')
+    get_version.assert_not_called()
+
+
+def test_authorize_caches_decisions_per_policy_version(test_client, mocker, casbin_policy):
+    mocker.patch('app.config.ConfigSettings.CASBIN_POLICY_CHECK_INTERVAL', 0)
+    policy_enforcer = enforcer.PolicyEnforcer()
+    mocker.patch.object(enforcer, '_policy_enforcer', policy_enforcer)
+    casbin_policy([('admin', 'greenroom', 'file', 'view')])
+    policy_enforcer.load()
+
+    casbin_enforce = mocker.spy(policy_enforcer._enforcer, 'enforce')
+    assert authorize(test_client, 'admin', 'greenroom', 'file', 'view')
+    assert authorize(test_client, 'admin', 'greenroom', 'file', 'view')
+    casbin_enforce.assert_called_once()
+
+    casbin_policy([('admin', 'greenroom', 'file', 'upload')])
+    assert authorize(test_client, 'admin', 'greenroom', 'file', 'upload')
+    assert authorize(test_client, 'admin', 'greenroom', 'file', 'view')
+    # the previous decisions are dropped with the previous policy
+    assert len(policy_enforcer._decisions) == 2
+
+
+def test_policy_listener_reloads_on_change(test_client, mocker, casbin_policy):
+    mocker.patch('app.config.ConfigSettings.CASBIN_POLICY_CHECK_INTERVAL', 3600)
+    policy_enforcer = enforcer.PolicyEnforcer()
+    mocker.patch.object(enforcer, '_policy_enforcer', policy_enforcer)
+    policy_enforcer.load()
+    assert not authorize(test_client, 'admin', 'greenroom', 'file', 'view')
+
+    load = mocker.spy(policy_enforcer, 'load')
+    policy_enforcer.start_listener()
+    try:
+        assert policy_enforcer._subscribed.wait(5)
+        load.assert_not_called()
+
+        version = policy_enforcer.version
+        casbin_policy([('admin', 'greenroom', 'file', 'view')])
+        deadline = time.monotonic() + 5
+        while policy_enforcer.version == version and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        policy_enforcer.stop_listener()
+
+    # reloaded on the notification, the version poll is not due
+    load.assert_called_once()
+    assert authorize(test_client, 'admin', 'greenroom', 'file', 'view')
+
+
+def test_authorize_loads_the_zones_on_first_check(test_client, mocker, casbin_policy):
+    mocker.patch('app.config.ConfigSettings.CASBIN_POLICY_CHECK_INTERVAL', 0)
+    mocker.patch('app.config.ConfigSettings.CASBIN_POLICY_SHARDING_ENABLED', True)
+    policy_enforcer = enforcer.PolicyEnforcer()
+    mocker.patch.object(enforcer, '_policy_enforcer', policy_enforcer)
+    casbin_policy(
+        [('admin', 'greenroom', 'file', 'view'), ('admin', 'core', 'file', 'upload'), ('contributor', '*', 'file', '*')]
+    )
+
+    assert authorize(test_client, 'admin', 'greenroom', 'file', 'view')
+    assert not authorize(test_client, 'admin', 'greenroom', 'file', 'upload')
+    assert authorize(test_client, 'contributor', 'greenroom', 'file', 'delete')
+    assert list(policy_enforcer._shards) == ['greenroom']
+    assert len(policy_enforcer._shards['greenroom'].enforcer.get_policy()) == 2
+
+    assert authorize(test_client, 'admin', 'core', 'file', 'upload')
+    assert authorize(test_client, 'admin', '*', 'file', 'upload')
+    assert list(policy_enforcer._shards) == ['greenroom', 'core', '*']
+
+    casbin_policy([('collaborator', 'core', 'file', 'view')])
+    assert authorize(test_client, 'collaborator', 'core', 'file', 'view')
+    assert list(policy_enforcer._shards) == ['core']
+
+
+def test_policy_shards_are_evicted(test_client, mocker, casbin_policy):
+    mocker.patch('app.config.ConfigSettings.CASBIN_POLICY_SHARDING_ENABLED', True)
+    mocker.patch('app.config.ConfigSettings.CASBIN_POLICY_SHARD_COUNT', 2)
+    policy_enforcer = enforcer.PolicyEnforcer()
+    casbin_policy([('admin', 'greenroom', 'file', 'view'), ('admin', 'core', 'file', 'view')])
+    policy_enforcer.load()
+
+    for zone, operation in [('greenroom', 'view'), ('core', 'view'), ('greenroom', 'upload'), ('archive', 'view')]:
+        policy_enforcer.prepare([zone])
+        policy_enforcer.enforce('admin', zone, 'file', operation)
+    assert list(policy_enforcer._shards) == ['greenroom', 'archive']
+
+    mocker.patch('app.config.ConfigSettings.CASBIN_POLICY_SHARD_IDLE_TIMEOUT', 0)
+    policy_enforcer.prepare(['core'])
+    policy_enforcer.enforce('admin', 'core', 'file', 'upload')
+    assert list(policy_enforcer._shards) == ['core']
+
+
+def test_enforce_never_loads_the_policy(test_client, mocker, casbin_policy):
+    mocker.patch('app.config.ConfigSettings.CASBIN_POLICY_SHARDING_ENABLED', True)
+    policy_enforcer = enforcer.PolicyEnforcer()
+    casbin_policy([('admin', 'core', 'file', 'view')])
+    load = mocker.spy(policy_enforcer, 'load')
+    load_shard = mocker.spy(policy_enforcer, 'load_shard')
+
+    with pytest.raises(enforcer.PolicyNotLoaded):
+        policy_enforcer.enforce('admin', 'core', 'file', 'view')
+    policy_enforcer.load()
+    with pytest.raises(enforcer.PolicyNotLoaded):
+        policy_enforcer.enforce('admin', 'core', 'file', 'view')
+    load.assert_called_once()
+    load_shard.assert_not_called()
+
+    policy_enforcer.prepare(['core'])
+    assert policy_enforcer.enforce('admin', 'core', 'file', 'view')
+
+
+def test_put_policies(test_client, mocker, casbin_policy):
+    mocker.patch('app.config.ConfigSettings.CASBIN_POLICY_CHECK_INTERVAL', 0)
+    casbin_policy([('admin', 'greenroom', 'file', 'view')])
+    payload = {
+        'operation_type': 'add',
+        'policies': [
+            {'role': 'admin', 'zone': 'greenroom', 'resource': 'file', 'operation': 'view'},
+            {'role': 'admin', 'zone': 'greenroom', 'resource': 'file', 'operation': 'upload'},
+        ],
+        'grouping_policies': [{'user': 'alice', 'role': 'admin', 'zone': 'greenroom'}],
+    }
+
+    response = test_client.put('/v1/authorize/policies', json=payload)
+    assert response.status_code == 200
+    result = response.json()['result']
+    assert [x['status'] for x in result['policies']] == ['conflict', 'success']
+    assert [x['status'] for x in result['grouping_policies']] == ['success']
+    assert authorize(test_client, 'alice', 'greenroom', 'file', 'upload')
+
+    payload['operation_type'] = 'remove'
+    payload['policies'].reverse()
+    response = test_client.put('/v1/authorize/policies', json=payload)
+    assert [x['status'] for x in response.json()['result']['policies']] == ['success', 'success']
+    assert not authorize(test_client, 'admin', 'greenroom', 'file', 'view')
+
+    response = test_client.put('/v1/authorize/policies', json=payload)
+    assert [x['status'] for x in response.json()['result']['policies']] == ['not_found', 'not_found']
+
+
+def test_put_policies_rejects_invalid_operation(test_client):
+    response = test_client.put('/v1/authorize/policies', json={'operation_type': 'update', 'policies': []})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('sharding', [False, True])
+def test_policy_listener_applies_policy_changes(test_client, mocker, casbin_policy, sharding):
+    mocker.patch('app.config.ConfigSettings.CASBIN_POLICY_CHECK_INTERVAL', 3600)
+    mocker.patch('app.config.ConfigSettings.CASBIN_POLICY_SHARDING_ENABLED', sharding)
+    policy_enforcer = enforcer.PolicyEnforcer()
+    casbin_policy([('admin', 'core', 'file', 'view')])
+    policy_enforcer.load()
+    policy_enforcer.prepare(['core', 'greenroom'])
+    assert policy_enforcer.enforce('admin', 'core', 'file', 'view')
+    assert not policy_enforcer.enforce('alice', 'greenroom', 'file', 'view')
+
+    def wait_for_change(operation_type, rules):
+        version = policy_enforcer.version
+        policy_store.update_policies(operation_type, rules)
+        deadline = time.monotonic() + 5
+        while policy_enforcer.version == version and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    load = mocker.spy(policy_enforcer, 'load')
+    policy_enforcer.start_listener()
+    try:
+        assert policy_enforcer._subscribed.wait(5)
+        wait_for_change('add', {'p': [('admin', 'greenroom', 'file', 'view')], 'g': [('alice', 'admin', 'greenroom')]})
+        assert policy_enforcer.enforce('alice', 'greenroom', 'file', 'view')
+        assert policy_enforcer.enforce('admin', 'core', 'file', 'view')
+
+        wait_for_change('remove', {'p': [('admin', 'core', 'file', 'view')]})
+        assert not policy_enforcer.enforce('admin', 'core', 'file', 'view')
+        assert policy_enforcer.enforce('alice', 'greenroom', 'file', 'view')
+    finally:
+        policy_enforcer.stop_listener()
+
+    load.assert_not_called()
+
+
+def test_apply_delta_requires_the_loaded_version(test_client, casbin_policy):
+    policy_enforcer = enforcer.PolicyEnforcer()
+    policy_enforcer.load()
+    delta = {'from': policy_enforcer.version + 1, 'to': policy_enforcer.version + 2, 'operation': 'add'}
+
+    assert not policy_enforcer.apply_delta({**delta, 'p': [['admin', 'core', 'file', 'view']], 'g': []})
+    assert not policy_enforcer.enforce('admin', 'core', 'file', 'view')
@@ -13,9 +13,19 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from keycloak import exceptions
+import asyncio
+import time
+from urllib.parse import parse_qs
 from uuid import uuid4
 
+import httpx
+import pytest
+import rsa
+from jose import jwk, jwt
+from keycloak import exceptions
+
+from app.config import ConfigSettings
+
 test_user = {
     'username': 'test_user',
     'email': 'test_user',
@@ -28,16 +38,19 @@ test_user = {
 # user authentication method
 
 
-def test_authentication(test_client, mocker, keycloak_admin_mock):
+def test_authentication(test_client, mocker, keycloak_admin_mock, attribute_buffer):
     mocker.patch(
         'app.resources.keycloak_api.ops_user.OperationsUser.get_token',
         return_value={'access_token': 'test', 'refresh_token': 'test'},
     )
     mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_user_by_username', return_value=test_user)
-    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.update_user_attributes')
+    update = mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.update_user_attributes')
 
     response = test_client.post('/v1/users/auth', json={'username': 'test_user', 'password': 'test_user'})
     assert response.status_code == 200
+    # the last login is written behind the request
+    update.assert_not_called()
+    assert 'last_login' in attribute_buffer.take('test_user')
 
 
 def test_authentication_with_disable(test_client, mocker, keycloak_admin_mock):
@@ -152,7 +165,212 @@ def test_remove_user_keycloak_realm_role(test_client, mocker, keycloak_admin_moc
     assert response.status_code == 200
 
 
-def create_test_user_list(size=10):
+def test_user_client_caches_openid_configuration(mocker):
+    from app.resources.keycloak_api import ops_user
+
+    mocker.patch.dict(ops_user._user_clients, clear=True)
+    keycloak_openid = mocker.patch.object(ops_user, 'KeycloakOpenID').return_value
+    keycloak_openid.well_know.return_value = {'issuer': 'test'}
+    now = mocker.patch('app.resources.keycloak_api.ops_user.time.monotonic', return_value=100)
+
+    user_client = ops_user.get_user_client('test-realm', 'test-client', 'secret')
+    assert user_client is ops_user.get_user_client('test-realm', 'test-client', 'secret')
+    assert user_client.config_well_know == {'issuer': 'test'}
+    assert user_client.config_well_know == {'issuer': 'test'}
+    keycloak_openid.well_know.assert_called_once()
+
+    # keep the previous document if keycloak fails the revalidation
+    now.return_value = 100 + ConfigSettings.KEYCLOAK_WELL_KNOWN_TTL
+    keycloak_openid.well_know.side_effect = exceptions.KeycloakConnectionError('down')
+    assert user_client.config_well_know == {'issuer': 'test'}
+    assert keycloak_openid.well_know.call_count == 2
+
+
+def test_user_client_requests_tokens_on_the_shared_client(mocker, httpx_mock):
+    from app.resources.keycloak_api import ops_user
+
+    mocker.patch.object(ops_user, 'KeycloakOpenID')
+    token_url = ConfigSettings.KEYCLOAK_SERVER_URL + 'realms/test-realm/protocol/openid-connect/token'
+    httpx_mock.add_response(method='POST', url=token_url, json={'access_token': 'test', 'refresh_token': 'test'})
+    httpx_mock.add_response(method='POST', url=token_url, status_code=401, json={'error': 'invalid_grant'})
+    user_client = ops_user.OperationsUser('test-client', 'test-realm', 'secret')
+
+    token = asyncio.run(user_client.get_token('test_user', 'test_password'))
+    assert token == {'access_token': 'test', 'refresh_token': 'test'}
+    payload = parse_qs(httpx_mock.get_requests()[0].content.decode())
+    assert payload == {
+        'grant_type': ['password'],
+        'username': ['test_user'],
+        'password': ['test_password'],
+        'client_id': ['test-client'],
+        'client_secret': ['secret'],
+    }
+
+    with pytest.raises(exceptions.KeycloakAuthenticationError):
+        asyncio.run(user_client.get_refresh_token('expired'))
+
+
+@pytest.fixture
+def signing_key(mocker, httpx_mock):
+    from app.resources.keycloak_api import token_verifier
+
+    mocker.patch.dict(token_verifier._token_verifiers, clear=True)
+    public_key, private_key = rsa.newkeys(1024)
+    public_jwk = jwk.construct(public_key.save_pkcs1().decode(), 'RS256').to_dict()
+    public_jwk.update({'kid': 'test-key', 'use': 'sig'})
+
+    realm_url = ConfigSettings.KEYCLOAK_SERVER_URL + 'realms/' + ConfigSettings.KEYCLOAK_REALM
+    httpx_mock.add_response(
+        method='GET', url=realm_url + '/protocol/openid-connect/certs', json={'keys': [public_jwk]}
+    )
+
+    def sign(claims, kid='test-key'):
+        claims = {
+            'iss': realm_url,
+            'exp': int(time.time()) + 300,
+            'typ': 'Bearer',
+            'azp': ConfigSettings.KEYCLOAK_CLIENT_ID,
+            **claims,
+        }
+        return jwt.encode(claims, private_key.save_pkcs1().decode(), algorithm='RS256', headers={'kid': kid})
+
+    return sign
+
+
+def test_verify_token(test_client, signing_key, httpx_mock):
+    token = signing_key({'sub': 'test_user', 'realm_access': {'roles': ['platform-admin']}})
+
+    response = test_client.post('/v1/users/token/verify', json={'token': token})
+    assert response.status_code == 200
+    assert response.json()['result']['claims']['sub'] == 'test_user'
+    assert response.json()['result']['realm_roles'] == ['platform-admin']
+
+    # the signing keys are cached
+    response = test_client.post('/v1/users/token/verify', json={'token': token})
+    assert response.status_code == 200
+    assert len(httpx_mock.get_requests()) == 1
+
+
+def test_verify_token_expired(test_client, signing_key):
+    token = signing_key({'sub': 'test_user', 'exp': int(time.time()) - 10})
+
+    response = test_client.post('/v1/users/token/verify', json={'token': token})
+    assert response.status_code == 401
+
+
+def test_verify_token_unknown_key(test_client, signing_key):
+    token = signing_key({'sub': 'test_user'}, kid='rotated-key')
+
+    response = test_client.post('/v1/users/token/verify', json={'token': token})
+    assert response.status_code == 401
+
+
+@pytest.mark.parametrize(
+    'claims',
+    [
+        # id token of the client
+        {'typ': 'ID'},
+        # access token of another client
+        {'azp': 'another-client'},
+    ],
+)
+def test_verify_token_of_another_kind(test_client, signing_key, claims):
+    token = signing_key({'sub': 'test_user', **claims})
+
+    response = test_client.post('/v1/users/token/verify', json={'token': token})
+    assert response.status_code == 401
+
+
+def test_verify_token_checks_the_audience(test_client, mocker, signing_key):
+    mocker.patch('app.config.ConfigSettings.KEYCLOAK_TOKEN_AUDIENCE', 'test-api')
+
+    token = signing_key({'sub': 'test_user', 'aud': 'test-api', 'azp': 'another-client'})
+    response = test_client.post('/v1/users/token/verify', json={'token': token})
+    assert response.status_code == 200
+
+    token = signing_key({'sub': 'test_user', 'aud': 'another-api'})
+    response = test_client.post('/v1/users/token/verify', json={'token': token})
+    assert response.status_code == 401
+
+
+def test_verify_token_pins_the_algorithms(test_client, mocker, signing_key):
+    mocker.patch('app.config.ConfigSettings.KEYCLOAK_TOKEN_ALGORITHMS', 'RS512')
+    token = signing_key({'sub': 'test_user'})
+
+    response = test_client.post('/v1/users/token/verify', json={'token': token})
+    assert response.status_code == 401
+
+
+def test_authentication_reads_status_from_token(
+    test_client, mocker, keycloak_admin_mock, signing_key, attribute_buffer
+):
+    mocker.patch.object(ConfigSettings, 'KEYCLOAK_LOGIN_STATUS_CLAIM', 'status')
+    token = signing_key({'sub': 'test_user_id', 'status': ['active']})
+    mocker.patch(
+        'app.resources.keycloak_api.ops_user.OperationsUser.get_token',
+        return_value={'access_token': token, 'refresh_token': 'test'},
+    )
+    get_user = mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_user_by_username')
+
+    response = test_client.post('/v1/users/auth', json={'username': 'test_user', 'password': 'test_user'})
+    assert response.status_code == 200
+    get_user.assert_not_called()
+    assert 'last_login' in attribute_buffer.take('test_user_id')
+
+
+def test_authentication_with_disabled_status_in_token(test_client, mocker, keycloak_admin_mock, signing_key):
+    mocker.patch.object(ConfigSettings, 'KEYCLOAK_LOGIN_STATUS_CLAIM', 'status')
+    token = signing_key({'sub': 'test_user_id', 'status': 'disabled'})
+    mocker.patch(
+        'app.resources.keycloak_api.ops_user.OperationsUser.get_token',
+        return_value={'access_token': token, 'refresh_token': 'test'},
+    )
+
+    response = test_client.post('/v1/users/auth', json={'username': 'test_user', 'password': 'test_user'})
+    assert response.status_code == 401
+
+
+def test_authentication_without_status_claim(test_client, mocker, keycloak_admin_mock, signing_key):
+    mocker.patch.object(ConfigSettings, 'KEYCLOAK_LOGIN_STATUS_CLAIM', 'status')
+    token = signing_key({'sub': 'test_user_id'})
+    mocker.patch(
+        'app.resources.keycloak_api.ops_user.OperationsUser.get_token',
+        return_value={'access_token': token, 'refresh_token': 'test'},
+    )
+    get_user = mocker.patch(
+        'app.resources.keycloak_api.ops_admin.OperationsAdmin.get_user_by_username', return_value=test_user
+    )
+
+    response = test_client.post('/v1/users/auth', json={'username': 'test_user', 'password': 'test_user'})
+    assert response.status_code == 200
+    get_user.assert_called_once()
+
+
+@pytest.mark.parametrize(
+    'error',
+    [
+        exceptions.KeycloakGetError('certs unavailable', response_code=503),
+        httpx.ConnectError('connection refused'),
+    ],
+)
+def test_authentication_falls_back_when_keys_are_unavailable(test_client, mocker, keycloak_admin_mock, error):
+    mocker.patch.object(ConfigSettings, 'KEYCLOAK_LOGIN_STATUS_CLAIM', 'status')
+    token = jwt.encode({'sub': 'test_user_id', 'status': ['active']}, 'secret', headers={'kid': 'test-key'})
+    mocker.patch(
+        'app.resources.keycloak_api.ops_user.OperationsUser.get_token',
+        return_value={'access_token': token, 'refresh_token': 'test'},
+    )
+    mocker.patch('app.resources.keycloak_api.token_verifier.TokenVerifier.get_signing_key', side_effect=error)
+    get_user = mocker.patch(
+        'app.resources.keycloak_api.ops_admin.OperationsAdmin.get_user_by_username', return_value=test_user
+    )
+
+    response = test_client.post('/v1/users/auth', json={'username': 'test_user', 'password': 'test_user'})
+    assert response.status_code == 200
+    get_user.assert_called_once()
+
+
+def create_test_mirror_list(size=10):
     user_list = []
     for x in range(size):
         user_list.append(
@@ -160,9 +378,9 @@ def create_test_user_list(size=10):
                 'username': 'test_user_%d' % x,
                 'email': 'test_user_%d@email.com' % x,
                 'id': 'test_user_%d' % x,
-                'firstName': 'firstName_%d' % x,
-                'lastName': 'lastName_%d' % x,
-                'attributes': {'status': ['active']},
+                'first_name': 'firstName_%d' % x,
+                'last_name': 'lastName_%d' % x,
+                'status': 'active',
             }
         )
 
@@ -170,28 +388,24 @@ def create_test_user_list(size=10):
 
 
 # list platform user test
-def test_list_platform_user_pagination_1(test_client, mocker, keycloak_admin_mock):
+def test_list_platform_user_pagination_1(test_client, mocker, keycloak_admin_mock, users_mirror):
     num_of_user = 20
     page_size = 10
-    users = create_test_user_list(num_of_user)
+    users_mirror(create_test_mirror_list(num_of_user))
 
-    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_user_count', return_value=len(users))
-    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_all_users', return_value=users)
-    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_users_in_role', return_value=[])
+    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_platform_admins', return_value={})
 
     response = test_client.get('/v1/users', params={'page_size': page_size})
     assert response.status_code == 200
     assert len(response.json().get('result')) == page_size
 
 
-def test_list_platform_user_pagination_2(test_client, mocker, keycloak_admin_mock):
+def test_list_platform_user_pagination_2(test_client, mocker, keycloak_admin_mock, users_mirror):
     num_of_user = 20
     page_size = 5
-    users = create_test_user_list(num_of_user)
+    users_mirror(create_test_mirror_list(num_of_user))
 
-    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_user_count', return_value=len(users))
-    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_all_users', return_value=users)
-    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_users_in_role', return_value=[])
+    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_platform_admins', return_value={})
 
     response = test_client.get('/v1/users', params={'page_size': page_size})
     assert response.status_code == 200
@@ -199,15 +413,35 @@ def test_list_platform_user_pagination_2(test_client, mocker, keycloak_admin_moc
     assert response.json().get('num_of_pages') == (num_of_user / page_size)
 
 
-def test_list_platform_user_platform_admin_check(test_client, mocker, keycloak_admin_mock):
+def test_list_platform_user_cursor_pagination(test_client, mocker, keycloak_admin_mock, users_mirror):
+    num_of_user = 20
+    page_size = 8
+    users_mirror(create_test_mirror_list(num_of_user))
+
+    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_platform_admins', return_value={})
+
+    usernames = []
+    params = {'page_size': page_size, 'order_by': 'email', 'order_type': 'desc'}
+    while True:
+        response = test_client.get('/v1/users', params=params)
+        assert response.status_code == 200
+        usernames += [x.get('username') for x in response.json().get('result')]
+        if not response.json().get('next_cursor'):
+            break
+        params['cursor'] = response.json().get('next_cursor')
+
+    response = test_client.get('/v1/users', params={'page_size': 100, 'order_by': 'email', 'order_type': 'desc'})
+    assert usernames == [x.get('username') for x in response.json().get('result')]
+    assert len(set(usernames)) == num_of_user
+
+
+def test_list_platform_user_platform_admin_check(test_client, mocker, keycloak_admin_mock, users_mirror):
     num_of_user = 20
-    users = create_test_user_list(num_of_user)
+    users_mirror(create_test_mirror_list(num_of_user))
 
-    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_user_count', return_value=len(users))
-    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_all_users', return_value=users)
     mocker.patch(
-        'app.resources.keycloak_api.ops_admin.OperationsAdmin.get_users_in_role',
-        return_value=[{'username': 'test_user_1'}],
+        'app.resources.keycloak_api.ops_admin.OperationsAdmin.get_platform_admins',
+        return_value={'test_user_1': 'test_user_1'},
     )
 
     response = test_client.get('/v1/users', params={})
@@ -217,14 +451,26 @@ def test_list_platform_user_platform_admin_check(test_client, mocker, keycloak_a
             assert x.get('role') == 'admin'
 
 
-def test_list_users_under_roles_filter_order_by_email(test_client, mocker, keycloak_admin_mock):
+def test_list_platform_user_filter_admin_role(test_client, mocker, keycloak_admin_mock, users_mirror):
     num_of_user = 20
-    page_size = 10
-    users = create_test_user_list(num_of_user)
+    users_mirror(create_test_mirror_list(num_of_user))
+
+    mocker.patch(
+        'app.resources.keycloak_api.ops_admin.OperationsAdmin.get_platform_admins',
+        return_value={'test_user_1': 'test_user_1'},
+    )
+
+    response = test_client.get('/v1/users', params={'role': 'admin'})
+    assert response.status_code == 200
+    assert response.json().get('total') == 1
+    assert response.json().get('result')[0].get('role') == 'admin'
 
-    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_user_count', return_value=len(users))
-    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_all_users', return_value=users)
-    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_users_in_role', return_value=[])
+
+def test_list_users_under_roles_filter_order_by_email(test_client, mocker, keycloak_admin_mock, users_mirror):
+    num_of_user = 20
+    users_mirror(create_test_mirror_list(num_of_user))
+
+    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_platform_admins', return_value={})
 
     response = test_client.get('/v1/users', params={'order_by': 'email', 'order_type': 'desc'})
     assert response.status_code == 200
@@ -232,14 +478,11 @@ def test_list_users_under_roles_filter_order_by_email(test_client, mocker, keycl
     assert user_list[0].get('email') > user_list[1].get('email')
 
 
-def test_list_users_under_roles_filter_order_by_username(test_client, mocker, keycloak_admin_mock):
+def test_list_users_under_roles_filter_order_by_username(test_client, mocker, keycloak_admin_mock, users_mirror):
     num_of_user = 20
-    page_size = 10
-    users = create_test_user_list(num_of_user)
+    users_mirror(create_test_mirror_list(num_of_user))
 
-    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_user_count', return_value=len(users))
-    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_all_users', return_value=users)
-    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_users_in_role', return_value=[])
+    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_platform_admins', return_value={})
 
     response = test_client.get('/v1/users', params={'order_by': 'username', 'order_type': 'desc'})
     assert response.status_code == 200
@@ -247,14 +490,11 @@ def test_list_users_under_roles_filter_order_by_username(test_client, mocker, ke
     assert user_list[0].get('email') > user_list[1].get('email')
 
 
-def test_list_users_under_roles_filter_order_by_last_name(test_client, mocker, keycloak_admin_mock):
+def test_list_users_under_roles_filter_order_by_last_name(test_client, mocker, keycloak_admin_mock, users_mirror):
     num_of_user = 20
-    page_size = 10
-    users = create_test_user_list(num_of_user)
+    users_mirror(create_test_mirror_list(num_of_user))
 
-    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_user_count', return_value=len(users))
-    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_all_users', return_value=users)
-    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_users_in_role', return_value=[])
+    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_platform_admins', return_value={})
 
     response = test_client.get('/v1/users', params={'order_by': 'last_name', 'order_type': 'desc'})
     assert response.status_code == 200
@@ -50,6 +50,44 @@ def test_user_remove_ad_group(test_client, mocker, ldap_client_mock):
     assert response.json().get('result') == '%s user %s from ad group' % ('remove', 'test_email')
 
 
+def test_user_bulk_add_ad_group(test_client, mocker, ldap_client_mock):
+    mocker.patch(
+        'app.services.data_providers.ldap_client.LdapClient.get_users_by_emails',
+        return_value={
+            'new@example.com': ('cn=new', {'memberOf': []}),
+            'member@example.com': ('cn=member', {'memberOf': [b'TEST_GROUP']}),
+        },
+    )
+    update_group_members = mocker.patch(
+        'app.services.data_providers.ldap_client.LdapClient.update_group_members',
+        return_value=[{'operation_type': 'add', 'user_dn': 'cn=new', 'group_dn': 'test_group', 'status': 'success'}],
+    )
+
+    response = test_client.put(
+        '/v1/user/ad-group/bulk',
+        json={
+            'user_emails': ['new@example.com', 'member@example.com', 'unknown@example.com'],
+            'group_code': 'test_group',
+            'operation_type': 'add',
+        },
+    )
+    assert response.status_code == 200
+    assert response.json().get('result') == [
+        {'user_email': 'new@example.com', 'status': 'success'},
+        {'user_email': 'member@example.com', 'status': 'conflict'},
+        {'user_email': 'unknown@example.com', 'status': 'user_not_found'},
+    ]
+    update_group_members.assert_called_once_with('add', 'test_group', ['cn=new'])
+
+
+def test_user_bulk_ad_group_invalid_operation(test_client, ldap_client_mock):
+    response = test_client.put(
+        '/v1/user/ad-group/bulk',
+        json={'user_emails': ['new@example.com'], 'group_code': 'test_group', 'operation_type': 'move'},
+    )
+    assert response.status_code == 400
+
+
 # disable/enable user
 def test_user_enable(test_client, mocker, keycloak_admin_mock):
     mocker.patch(
@@ -80,7 +118,7 @@ def test_user_disable(test_client, mocker, keycloak_admin_mock, ldap_client_mock
     mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_user_realm_roles', return_value=[])
     mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.remove_user_realm_roles', return_value='')
 
-    mocker.patch(
+    get_user_by_email = mocker.patch(
         'app.services.data_providers.ldap_client.LdapClient.get_user_by_email', return_value=(None, {'memberOf': []})
     )
 
@@ -93,3 +131,5 @@ def test_user_disable(test_client, mocker, keycloak_admin_mock, ldap_client_mock
     )
     assert response.status_code == 200
     assert response.json().get('result') == '%s user %s' % ('disable', 'test_email')
+    # the groups to remove are read from AD, not from the cache
+    get_user_by_email.assert_called_once_with('test_email', False)
@@ -0,0 +1,131 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+from fastapi_sqlalchemy import db
+from keycloak import exceptions
+from sqlalchemy import text
+
+from app.models.sql_users import UserModel, UserSyncStateModel
+from app.services.user_sync.user_sync import USER_SYNC_LOCK_KEY, UserMirrorSync
+
+
+def keycloak_user(user_id, status='active'):
+    return {
+        'id': user_id,
+        'username': user_id,
+        'email': user_id + '@email.com',
+        'firstName': 'firstName',
+        'lastName': 'lastName',
+        'createdTimestamp': 1650000000000,
+        'attributes': {'status': [status]},
+    }
+
+
+def test_user_sync_reconciles_the_realm(test_client, mocker, keycloak_admin_mock, users_mirror):
+    users_mirror([{'id': 'removed_user', 'username': 'removed_user', 'status': 'active'}])
+
+    async def iter_users(*args, **kwargs):
+        yield [keycloak_user('test_user_1'), keycloak_user('test_user_2')]
+        yield [keycloak_user('test_user_3', 'disabled')]
+
+    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.iter_users', side_effect=iter_users)
+
+    assert asyncio.run(UserMirrorSync().sync())
+
+    with db():
+        users = {user.id: user for user in db.session.query(UserModel).all()}
+        state = db.session.query(UserSyncStateModel).one()
+    assert sorted(users) == ['test_user_1', 'test_user_2', 'test_user_3']
+    assert users['test_user_3'].status == 'disabled'
+    assert state.last_reconcile_at is not None
+
+
+def test_user_sync_applies_admin_events(test_client, mocker, keycloak_admin_mock, users_mirror):
+    users_mirror(
+        [
+            {'id': 'test_user_1', 'username': 'test_user_1', 'status': 'active'},
+            {'id': 'test_user_2', 'username': 'test_user_2', 'status': 'active'},
+            {'id': 'test_user_3', 'username': 'test_user_3', 'status': 'active'},
+        ]
+    )
+    events = [
+        {'time': 1000, 'operationType': 'UPDATE', 'resourcePath': 'users/test_user_1'},
+        {'time': 3000, 'operationType': 'UPDATE', 'resourcePath': 'users/test_user_2'},
+        {'time': 4000, 'operationType': 'DELETE', 'resourcePath': 'users/test_user_3'},
+        {'time': 5000, 'operationType': 'CREATE', 'resourcePath': 'users/test_user_4'},
+        {'time': 6000, 'operationType': 'UPDATE', 'resourcePath': 'users/test_user_5/groups/test_group'},
+    ]
+
+    def get_user_by_id(user_id):
+        if user_id == 'test_user_5':
+            raise exceptions.KeycloakGetError('not found', response_code=404)
+        return keycloak_user(user_id, 'disabled')
+
+    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.get_admin_events', return_value=events)
+    get_user = mocker.patch(
+        'app.resources.keycloak_api.ops_admin.OperationsAdmin.get_user_by_id', side_effect=get_user_by_id
+    )
+
+    with db():
+        last_event_time = asyncio.run(UserMirrorSync().apply_admin_events(2000))
+        db.session.commit()
+        users = {user.id: user for user in db.session.query(UserModel).all()}
+
+    assert last_event_time == 6000
+    assert sorted(call.args[0] for call in get_user.call_args_list) == ['test_user_2', 'test_user_4', 'test_user_5']
+    assert sorted(users) == ['test_user_1', 'test_user_2', 'test_user_4']
+    assert users['test_user_1'].status == 'active'
+    assert users['test_user_2'].status == 'disabled'
+
+
+def test_user_sync_holds_no_transaction_while_reading_keycloak(test_client, mocker, keycloak_admin_mock, users_mirror):
+    users_mirror([{'id': 'test_user_1', 'username': 'test_user_1', 'status': 'active'}])
+    open_transactions = []
+
+    async def iter_users(*args, **kwargs):
+        with db():
+            open_transactions.append(
+                db.session.execute(
+                    text(
+                        "SELECT count(*) FROM pg_stat_activity WHERE state = 'idle in transaction' "
+                        'AND datname = current_database() AND pid <> pg_backend_pid()'
+                    )
+                ).scalar()
+            )
+            locks = db.session.execute(
+                text("SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND objid = :key"),
+                {'key': USER_SYNC_LOCK_KEY},
+            ).scalar()
+        assert locks == 1
+        yield [keycloak_user('test_user_1')]
+
+    mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.iter_users', side_effect=iter_users)
+
+    assert asyncio.run(UserMirrorSync().sync())
+    assert open_transactions == [0]
+
+
+def test_user_sync_skips_when_locked(test_client, mocker, keycloak_admin_mock):
+    iter_users = mocker.patch('app.resources.keycloak_api.ops_admin.OperationsAdmin.iter_users')
+
+    with db():
+        db.session.execute(text('SELECT pg_advisory_lock(:key)'), {'key': USER_SYNC_LOCK_KEY})
+        try:
+            assert not asyncio.run(UserMirrorSync().sync())
+        finally:
+            db.session.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': USER_SYNC_LOCK_KEY})
+    iter_users.assert_not_called()